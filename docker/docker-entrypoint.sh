@@ -21,23 +21,13 @@ export HOST_PORT=${HOST_PORT}
 export RUST_LOG=${RUST_LOG:-error}
 export TEST_POOL_IP=${TEST_POOL_IP:-10.0.0.2}
 export AGENT_PROFILE=${AGENT_PROFILE}
-export WAIT_FOR_TA_SEC=${WAIT_FOR_TA_SEC:-0}
-export TA_NETLOC=${TA_NETLOC:-'trust-anchor:8990'}
+export WORKERS=${WORKERS:-1}
 
 cd "${HOME}"/src
 CMD="$@"
 if [ -z "${CMD}" ]
 then
-    CMD="python -m sanic app.app --host=${HOST_IP} --port=${HOST_PORT}"
+    CMD="python -m sanic app.app --host=${HOST_IP} --port=${HOST_PORT} --workers=${WORKERS}"
 fi
 
-while [ "${WAIT_FOR_TA_SEC}" -gt 0 ]
-do
-    echo "Sleeping up to ${WAIT_FOR_TA_SEC} seconds in case trust anchor is spinning up and agent needs it ..."
-    sleep 1
-    ((WAIT_FOR_TA_SEC--))
-    DID_TA_JSON=$(wget -q -O - "http://${TA_NETLOC}/api/v0/did")
-    [ -n "${DID_TA_JSON}" ] && break
-done
-
 exec ${CMD}
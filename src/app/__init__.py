@@ -15,9 +15,17 @@ limitations under the License.
 """
 
 from app import cfg
-from app.cache import mem_cache
+from app.cache import LedgerCache, registry
+from app.claims import ClaimIndex
 from app.service.bootseq import BootSequence
 from app.service.eventloop import do
+from app.service.limits import Limits
+from app.service.metrics import Metrics
+from app.service.offload import is_offload_process, Offload
+from app.service.profiler import Profiler
+from app.service.relay import Relay
+from app.service.trace import Tracer
+from os import environ
 from os.path import dirname, join
 from sanic import Sanic
 
@@ -29,19 +37,52 @@ app = Sanic(strict_slashes=True)
 app.static('/static', DIR_STATIC)
 app.static('/favicon.ico', join(DIR_STATIC, 'favicon.ico'))
 c = cfg.init_config()
+offload = Offload(c.get('Offload', {}))
+ledger_cache = LedgerCache(c.get('Ledger Cache', {}))
+limits = Limits(c.get('Limits', {}))
+metrics = Metrics(c.get('Metrics', {}))
+profiler = Profiler(c.get('Profiler', {}))
+tracer = Tracer(c.get('Tracing', {}))
+relay = Relay(c.get('Relay', {}), ledger_cache, tracer)
+claim_index = ClaimIndex(c.get('Claim Index', {}), BootSequence.dir_run,
+    environ.get('AGENT_PROFILE', 'trust-anchor'))
+
+@app.listener('after_server_start')
+async def start_services(app, loop):
+    offload.start(registry.master_secret)
+    metrics.start()
+
+@app.listener('after_server_start')
+async def boot_later(app, loop):
+    loop.create_task(BootSequence.go_later())  # register agent and check ledger store, off the boot path
 
 @app.listener('before_server_stop')
 async def cleanup(app, loop):
-    ag = await mem_cache.get('agent')
+    metrics.close()
+    offload.close()
+    await relay.close()
+    tracer.close()
+
+    ag = registry.agent
     if ag is not None:
         await ag.close()
 
-    pool = await mem_cache.get('pool')
+    pool = registry.pool
     if pool is not None:
         await pool.close()
 
-# start
-BootSequence.go()
+# start: sanic forks worker processes after import, and each needs its own pool and agent handles
+workers = int(environ.get('WORKERS', '1'))
+if is_offload_process():
+    registry.agent_class = BootSequence.agent_class_for(c)  # offload worker process boots its own agent
+elif workers > 1:
+    registry.agent_class = BootSequence.agent_class_for(c)
+
+    @app.listener('before_server_start')
+    def boot(app, loop):
+        BootSequence.go_worker()
+else:
+    BootSequence.go(register_later=True)
 
 # load views (which depend on agent role)
 from app import views
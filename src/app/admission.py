@@ -0,0 +1,80 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from app.cache import registry
+from von_agent.error import ErrorCode
+
+
+READ_ONLY = ('agent-nym-lookup', 'agent-endpoint-lookup', 'schema-lookup')  # served while agent registers
+
+
+class Rejection(Exception):
+    """
+    Message rejected before reaching the agent, with the error code, message, HTTP status and headers to report.
+    """
+
+    def __init__(self, error_code, message, status=400, headers=None):
+        super().__init__(message)
+        self.error_code = error_code
+        self.message = message
+        self.status = status
+        self.headers = headers
+
+
+def msg_type_of(form):
+    """
+    Return message type of client form, None if form is not an object or its type is not a string
+    (e.g., a list or object, which would fail as a dict key).
+
+    :param form: decoded client form
+    :return: message type or None
+    """
+
+    msg_type = form.get('type', None) if isinstance(form, dict) else None
+    return msg_type if isinstance(msg_type, str) else None
+
+
+def admit(matrix, msg_type, proxy_did):
+    """
+    Raise Rejection if the agent does not offer the message type, needs a proxy DID to relay it and
+    has none, or is not yet ready for it.
+
+    :param matrix: capability matrix for agent class, as per app.model.capabilities()
+    :param msg_type: message type
+    :param proxy_did: whether message carries a proxy DID
+    """
+
+    caps = matrix.get(msg_type, None)
+    if not (caps and caps['offered']):
+        raise Rejection(ErrorCode.TokenType, 'Agent does not offer message type {}'.format(msg_type))
+    if caps['proxy-required'] and not proxy_did:
+        raise Rejection(
+            ErrorCode.ProxyRelayConfig,
+            'Agent relays message type {} only by proxy: specify proxy-did'.format(msg_type))
+    if registry.status != 'ready' and msg_type not in READ_ONLY:
+        raise Rejection(503, 'Agent is not ready ({})'.format(registry.status), 503, {'Retry-After': '5'})
+
+
+def readiness(status):
+    """
+    Return body and HTTP status to report readiness on agent boot status: 200 once ready, 503 while
+    booting, registering, or failed.
+
+    :param status: agent boot status, as per registry.status
+    :return: (body dict, HTTP status) tuple
+    """
+
+    return ({'ready': status == 'ready', 'status': status}, 200 if status == 'ready' else 503)
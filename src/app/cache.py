@@ -15,5 +15,229 @@ limitations under the License.
 """
 
 from aiocache import SimpleMemoryCache
+from app import codec
+from collections import OrderedDict
+from functools import partial
+from time import monotonic
+from von_agent.agents import _BaseAgent
+from von_agent.nodepool import NodePool
+
+import asyncio
 
 mem_cache = SimpleMemoryCache()
+
+
+class Registry:
+    """
+    Process-local registry of the node pool and agent that the boot sequence opens.
+
+    Request handlers resolve these on every call: plain attribute access keeps aiocache
+    coroutine hops and key serialization off the hot path.
+    """
+
+    def __init__(self):
+        """
+        Initialize empty registry.
+        """
+
+        self._pool = None
+        self._agent = None
+        self._agent_class = None
+        self.master_secret = None  # HolderProver master secret label, for processes opening the same wallet
+        self.status = 'booting'  # 'registering' while boot sequence writes to ledger, then 'ready' or 'failed: ...'
+
+    @property
+    def pool(self) -> NodePool:
+        """
+        Accessor for node pool.
+
+        :return: node pool
+        """
+
+        return self._pool
+
+    @pool.setter
+    def pool(self, value: NodePool) -> None:
+        """
+        Set node pool if it changes identity.
+
+        :param value: node pool
+        """
+
+        if value is self._pool:
+            return
+        if value is not None and not isinstance(value, NodePool):
+            raise TypeError('Registry pool must be a NodePool, not {}'.format(type(value).__name__))
+        self._pool = value
+
+    @property
+    def agent(self) -> _BaseAgent:
+        """
+        Accessor for agent.
+
+        :return: agent
+        """
+
+        return self._agent
+
+    @agent.setter
+    def agent(self, value: _BaseAgent) -> None:
+        """
+        Set agent if it changes identity.
+
+        :param value: agent
+        """
+
+        if value is self._agent:
+            return
+        if value is not None and not isinstance(value, _BaseAgent):
+            raise TypeError('Registry agent must be a von_agent agent, not {}'.format(type(value).__name__))
+        self._agent = value
+        if value is not None:
+            self._agent_class = type(value)
+
+    @property
+    def agent_class(self) -> type:
+        """
+        Accessor for agent class, available before agent itself if boot sequence defers opening it.
+
+        :return: agent class
+        """
+
+        return self._agent_class
+
+    @agent_class.setter
+    def agent_class(self, value: type) -> None:
+        """
+        Set agent class.
+
+        :param value: agent class
+        """
+
+        if value is not None and not issubclass(value, _BaseAgent):
+            raise TypeError('Registry agent class must be a von_agent agent class, not {}'.format(value))
+        self._agent_class = value
+
+
+registry = Registry()
+
+
+class LedgerCache:
+    """
+    Read-through cache on ledger lookup message types, with per-type TTL and LRU size bound, and a shorter
+    TTL for negative ("{}") results. A send through this agent invalidates the corresponding lookup type.
+
+    Underneath the cache, concurrent identical lookups share one in-flight request (single flight),
+    whether or not their type is cached.
+    """
+
+    LOOKUP_FOR_SEND = {
+        'schema-send': 'schema-lookup',
+        'agent-nym-send': 'agent-nym-lookup',
+        'agent-endpoint-send': 'agent-endpoint-lookup'
+    }
+
+    def __init__(self, cfg):
+        """
+        Initialize on configuration.
+
+        :param cfg: Ledger Cache configuration section dict, e.g., {
+                'schema-lookup.ttl': '86400',
+                'schema-lookup.ttl.negative': '30',
+                'schema-lookup.size': '1024',
+                ...
+            }; a lookup type with no positive TTL or size is not cached
+        """
+
+        self._cfg = {}
+        self._entries = {}
+        self._stats = {}
+        self._in_flight = {}  # (msg_type, key) to task processing lookup
+        self._generation = {}  # msg_type to invalidation count, to keep lookups landing after a send out of cache
+        for msg_type in LedgerCache.LOOKUP_FOR_SEND.values():
+            self._stats[msg_type] = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'coalesced': 0}
+            ttl = int(cfg.get('{}.ttl'.format(msg_type), 0))
+            size = int(cfg.get('{}.size'.format(msg_type), 0))
+            if ttl > 0 and size > 0:
+                self._cfg[msg_type] = (ttl, int(cfg.get('{}.ttl.negative'.format(msg_type), 0)), size)
+                self._entries[msg_type] = OrderedDict()  # key to (expiry, json); most recently used last
+                self._generation[msg_type] = 0
+
+    def invalidate(self, msg_type):
+        """
+        Clear all entries for lookup message type.
+
+        :param msg_type: lookup message type
+        """
+
+        if msg_type in self._entries:
+            self._entries[msg_type].clear()
+            self._generation[msg_type] += 1
+            self._stats[msg_type]['invalidations'] += 1
+
+    async def process_post(self, form, processor):
+        """
+        Return response json for form from cache if fresh, otherwise from processor (joining any identical
+        lookup already in flight), caching it as configured.
+
+        :param form: request form
+        :param processor: coroutine function taking form and returning response json
+        :return: response json
+        """
+
+        msg_type = form.get('type', None) if isinstance(form, dict) else None
+        if msg_type not in self._stats:
+            rv = await processor(form)
+            if msg_type in LedgerCache.LOOKUP_FOR_SEND:
+                self.invalidate(LedgerCache.LOOKUP_FOR_SEND[msg_type])
+            return rv
+
+        stats = self._stats[msg_type]
+        key = codec.dumps(form.get('data', None), sort_keys=True)  # agent may alter form: key it first
+        entries = self._entries.get(msg_type, None)
+        if entries is not None and key in entries:
+            (expiry, rv) = entries[key]
+            if expiry > monotonic():
+                entries.move_to_end(key)
+                stats['hits'] += 1
+                return rv
+            del entries[key]
+
+        flight = (msg_type, key)
+        task = self._in_flight.get(flight, None)
+        if task is None:
+            stats['misses'] += 1
+            task = asyncio.ensure_future(processor(form))
+            self._in_flight[flight] = task
+            task.add_done_callback(partial(self._land, msg_type, key, self._generation.get(msg_type, None)))
+        else:
+            stats['coalesced'] += 1
+        return await asyncio.shield(task)  # a cancelled caller leaves lookup to finish for the others
+
+    def _land(self, msg_type, key, generation, task):
+        del self._in_flight[(msg_type, key)]
+        if task.cancelled() or task.exception() is not None or msg_type not in self._entries:
+            return
+        if generation != self._generation[msg_type]:
+            return  # invalidated while in flight
+
+        rv = task.result()
+        entries = self._entries[msg_type]
+        (ttl, ttl_negative, size) = self._cfg[msg_type]
+        ttl = ttl_negative if rv.strip() == '{}' else ttl
+        if ttl > 0:
+            entries[key] = (monotonic() + ttl, rv)
+            entries.move_to_end(key)
+            while len(entries) > size:
+                entries.popitem(last=False)
+                self._stats[msg_type]['evictions'] += 1
+
+    def stats(self):
+        """
+        Return per-message-type hit, miss, eviction, invalidation, and coalesced (single-flight) counts
+        and current size.
+
+        :return: dict mapping message type to stats
+        """
+
+        return {t: dict(s, size=len(self._entries.get(t, ()))) for (t, s) in self._stats.items()}
@@ -15,6 +15,7 @@ limitations under the License.
 """
 
 from app.cache import mem_cache
+from app.service import logs
 from app.service.eventloop import do
 from configparser import ConfigParser
 from io import StringIO
@@ -33,23 +34,19 @@ _inis = [
         '{}.ini'.format(environ.get('AGENT_PROFILE', 'trust-anchor')))
 ]
 
-def init_logging():
+def init_logging(cfg):
     dir_log = pjoin(dirname(abspath(__file__)), 'log')
     makedirs(dir_log, exist_ok=True)
-    path_log = pjoin(dir_log, environ.get('AGENT_PROFILE', 'trust-anchor') + '.log')
 
-    LOG_FORMAT='%(asctime)-15s | %(levelname)-8s | %(name)-12s | %(message)s'
-    logging.basicConfig(filename=path_log, level=logging.INFO, format=LOG_FORMAT, datefmt='%Y-%m-%d %H:%M:%S')
+    logs.init(dir_log, environ.get('AGENT_PROFILE', 'trust-anchor'), cfg)  # writes off the event loop
     logging.getLogger('asyncio').setLevel(logging.ERROR)
     logging.getLogger('von_conx').setLevel(logging.INFO)
     logging.getLogger('von_agent').setLevel(logging.INFO)
-    logging.getLogger('indy').setLevel(logging.DEBUG)
+    logging.getLogger('indy').setLevel(logging.INFO)
     logging.getLogger('requests').setLevel(logging.ERROR)
     logging.getLogger('urllib3').setLevel(logging.CRITICAL)
 
 def init_config():
-    init_logging()
-
     global _inis
     if not do(mem_cache.get('config')):
         if all(isfile(ini) for ini in _inis):
@@ -84,4 +81,6 @@ def init_config():
     }
     '''
 
-    return do(mem_cache.get('config'))
+    config = do(mem_cache.get('config'))
+    init_logging(config.get('Logging', {}))
+    return config
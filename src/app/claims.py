@@ -0,0 +1,467 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from app import codec
+from bisect import bisect_left, bisect_right
+from indy import anoncreds
+from itertools import chain
+from os import makedirs, replace, stat
+from os.path import join as pjoin
+from time import time
+from uuid import uuid4
+from von_agent.error import AbsentSchema, ClaimsFocus, JSONValidation
+from von_agent.schemakey import schema_key_for
+
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _number(value):
+    """
+    Return input value as a number if it parses as one, None otherwise.
+
+    :param value: value, e.g., claim attribute raw value
+    :return: int, float, or None
+    """
+
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _in_range(value, bounds):
+    """
+    Return whether value is within inclusive bounds, comparing numerically where value and bound
+    both parse as numbers and as strings otherwise.
+
+    :param value: claim attribute raw value
+    :param bounds: dict with optional 'min' and 'max' keys
+    :return: whether value is within bounds
+    """
+
+    for (key, ok) in (('min', lambda v, b: v >= b), ('max', lambda v, b: v <= b)):
+        if key in bounds:
+            (v, b) = (_number(value), _number(bounds[key]))
+            if not (ok(v, b) if v is not None and b is not None else ok(str(value), str(bounds[key]))):
+                return False
+    return True
+
+
+class ClaimSelection:
+    """
+    Selection of claims from a claim-request response, by filter predicates and then by page: filters apply
+    to each claim found, and pages run over distinct claim referents in sorted order, from the referent after
+    the cursor. Applied on the HolderProver side, only the selected page goes back over the wire.
+    """
+
+    KEYS = ('schemata', 'attr-eq', 'attr-range', 'referents', 'limit', 'cursor')
+
+    def __init__(self, spec):
+        """
+        Initialize on selection spec from claim-request form 'select' property; raise JSONValidation if malformed.
+
+        :param spec: selection spec, all keys optional, e.g., {
+                'schemata': [{'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'}],
+                'attr-eq': {'legalName': 'Tart City'},
+                'attr-range': {'effectiveDate': {'min': '2010-01-01', 'max': '2018-12-31'}},
+                'referents': ['claim::00000000-0000-0000-0000-000000000000'],
+                'limit': 50,
+                'cursor': 'claim::00000000-0000-0000-0000-000000000000'
+            }
+        """
+
+        if not isinstance(spec, dict) or any(k not in ClaimSelection.KEYS for k in spec):
+            raise JSONValidation('Bad claim selection: expected object with keys from {}'.format(ClaimSelection.KEYS))
+        try:
+            self._schema_keys = None if 'schemata' not in spec else [
+                {'did': s['origin-did'], 'name': s['name'], 'version': s['version']} for s in spec['schemata']]
+            self._attr_eq = {k: str(v) for (k, v) in spec.get('attr-eq', {}).items()}
+            self._attr_range = {k: dict(v) for (k, v) in spec.get('attr-range', {}).items()}
+            self._referents = None if 'referents' not in spec else set(spec['referents'])
+            self._limit = int(spec['limit']) if 'limit' in spec else None
+            self._cursor = spec.get('cursor', None)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise JSONValidation('Bad claim selection: {}'.format(e))
+        if self._limit is not None and self._limit < 1:
+            raise JSONValidation('Bad claim selection: limit must be positive')
+
+    def matches(self, claim):
+        """
+        Return whether claim (as per claim-request response) passes all filter predicates.
+
+        :param claim: claim dict with 'referent', 'attrs', and 'schema_key' keys
+        :return: whether claim passes filter
+        """
+
+        if self._referents is not None and claim['referent'] not in self._referents:
+            return False
+        if self._schema_keys is not None and claim['schema_key'] not in self._schema_keys:
+            return False
+        attrs = claim['attrs']
+        if any(k not in attrs or str(attrs[k]) != v for (k, v) in self._attr_eq.items()):
+            return False
+        return all(k in attrs and _in_range(attrs[k], b) for (k, b) in self._attr_range.items())
+
+    def apply(self, rv_json):
+        """
+        Return claim-request response json reduced to claims on selected page, adding 'next-cursor'
+        to resume from (null for last page).
+
+        :param rv_json: claim-request response json from agent
+        :return: reduced claim-request response json
+        """
+
+        rv = codec.loads(rv_json)
+        found = rv['claims']
+        all_claims = chain.from_iterable(chain(found.get('attrs', {}).values(), found.get('predicates', {}).values()))
+        referents = sorted({claim['referent'] for claim in all_claims if self.matches(claim)})
+        if self._cursor is not None:
+            referents = referents[bisect_right(referents, self._cursor):]
+        page = referents if self._limit is None else referents[:self._limit]
+
+        keep = set(page)
+        for key in ('attrs', 'predicates'):
+            if key in found:
+                found[key] = {
+                    uuid: [claim for claim in claims if claim['referent'] in keep]
+                    for (uuid, claims) in found[key].items()
+                }
+        rv['next-cursor'] = page[-1] if len(page) < len(referents) else None
+        return codec.dumps(rv)
+
+
+def _restrictions(s_key):
+    """
+    Return proof request restrictions on schema key.
+
+    :param s_key: SchemaKey
+    :return: restrictions list for requested attribute or predicate
+    """
+
+    return [{'schema_key': {'did': s_key.origin_did, 'name': s_key.name, 'version': s_key.version}}]
+
+
+class ClaimIndex:
+    """
+    Secondary index on claims in HolderProver wallet, for claim-request and proof-request to resolve their
+    claim filters to candidate referents without the agent scanning every claim it holds per request.
+
+    The index keeps each claim's info (as indy-sdk reports it: referent, raw attribute values, schema key,
+    issuer DID, revocation registry sequence number) by referent, referents by schema key, referents by
+    (schema key, attribute, raw value) for attr-match, and (number, referent) lists sorted by number
+    per (schema key, attribute) for pred-match ranges.
+
+    Indy-sdk assigns the referent only inside the wallet, so claim-store cannot add its claim directly:
+    claim-store and claims-reset instead stamp the index stale, in a file that all worker processes on the
+    shared wallet check, and the next lookup rebuilds the index in one pass over the wallet. A run of stores
+    thus costs one pass, and lookups between stores cost one stat() of the stamp file: rewriting it changes
+    its inode and modification time.
+    """
+
+    def __init__(self, cfg, dir_run, profile):
+        """
+        Initialize on configuration and run directory.
+
+        :param cfg: configuration dict from Claim Index section, e.g., {'enabled': 'true'}; index is off unless enabled
+        :param dir_run: directory for stamp file
+        :param profile: agent profile, naming stamp file
+        """
+
+        self._enabled = str(cfg.get('enabled', 'false')).lower() in ('true', '1', 'yes')
+        makedirs(dir_run, exist_ok=True)
+        self._path_stamp = pjoin(dir_run, '{}.claims.stamp'.format(profile))
+        self._stamp = None  # stamp file (inode, mtime) as of last rebuild
+        self._dirty = True  # stamped stale in this process since last rebuild
+        self._lock = None
+        self._clear()
+
+    @property
+    def enabled(self):
+        """
+        Accessor for whether index serves claim-request and proof-request.
+
+        :return: whether index is enabled
+        """
+
+        return self._enabled
+
+    def _clear(self):
+        self._claims = {}  # referent to claim info
+        self._ordinal = {}  # referent to position in wallet order, to list candidates as the wallet would
+        self._by_schema = {}  # schema key to list of referents
+        self._by_value = {}  # (schema key, attribute, raw value) to set of referents
+        self._by_number = {}  # (schema key, attribute) to list of (int value, referent), sorted
+
+    def _read_stamp(self):
+        try:
+            st = stat(self._path_stamp)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def _write_stamp(self):
+        path_tmp = '{}.{}'.format(self._path_stamp, uuid4().hex)
+        with open(path_tmp, 'w') as stamp_f:
+            stamp_f.write(uuid4().hex)
+        replace(path_tmp, self._path_stamp)  # atomic, and a new inode: readers see old stamp or new
+
+    async def touch(self):
+        """
+        Stamp index stale for all processes, e.g., on claim-store or claims-reset; write stamp file off the loop.
+        """
+
+        self._dirty = True
+        await asyncio.get_event_loop().run_in_executor(None, self._write_stamp)
+
+    async def clear(self):
+        """
+        Empty index and stamp it stale, e.g., on claims-reset.
+        """
+
+        self._clear()
+        await self.touch()
+
+    def load(self, claims):
+        """
+        Replace index content with input claim infos.
+
+        :param claims: claim infos in wallet order, each as indy-sdk reports it, e.g., {
+                'referent': 'claim::00000000-0000-0000-0000-000000000000',
+                'attrs': {'legalName': 'Tart City', 'orgTypeId': '2', ...},
+                'schema_key': {'did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'},
+                'issuer_did': 'Q4zqM7aXqm7gDQkUVLng9h',
+                'revoc_reg_seq_no': None
+            }
+        """
+
+        self._clear()
+        for claim in claims:
+            referent = claim['referent']
+            if referent in self._claims:
+                continue
+            s_key = schema_key_for(claim['schema_key'])
+            self._claims[referent] = claim
+            self._ordinal[referent] = len(self._ordinal)
+            self._by_schema.setdefault(s_key, []).append(referent)
+            for (attr, value) in claim['attrs'].items():
+                self._by_value.setdefault((s_key, attr, str(value)), set()).add(referent)
+                try:
+                    number = int(value)  # as von_agent and indy-sdk compare predicates
+                except (TypeError, ValueError):
+                    continue
+                self._by_number.setdefault((s_key, attr), []).append((number, referent))
+        for numbers in self._by_number.values():
+            numbers.sort()
+
+    async def refresh(self, ag):
+        """
+        Rebuild index from HolderProver wallet if it is stale, in one pass over the wallet.
+
+        :param ag: HolderProver agent
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:  # concurrent lookups share one rebuild
+            stamp = self._read_stamp()
+            if stamp == self._stamp and not self._dirty:
+                return
+            self._dirty = False  # a touch() during the rebuild sets it again
+            try:
+                self.load(codec.loads(await anoncreds.prover_get_claims(ag.wallet.handle, '{}')))
+            except Exception:
+                self._dirty = True
+                raise
+            self._stamp = stamp
+            logger.info('Claim index rebuilt on %s claims', len(self._claims))
+
+    def _at_least(self, s_key, attr, value):
+        """
+        Return set of referents to claims on schema key with integer attribute value at least input value.
+
+        :param s_key: SchemaKey
+        :param attr: attribute name
+        :param value: least value
+        :return: set of referents
+        """
+
+        numbers = self._by_number.get((s_key, attr), [])
+        return {referent for (_, referent) in numbers[bisect_left(numbers, (value, '')):]}
+
+    def candidates(self, s_key, filt=None):
+        """
+        Return claim infos on schema key passing filter, in wallet order.
+
+        :param s_key: SchemaKey
+        :param filt: filter dict with optional 'attr-match' (attribute to value) and 'pred-match'
+            (list of {'attr': ..., 'pred-type': '>=', 'value': ...}) keys, None or empty for none
+        :return: list of claim infos
+        """
+
+        referents = None
+        for (attr, value) in ((filt or {}).get('attr-match', None) or {}).items():
+            found = self._by_value.get((s_key, attr, str(value)), set())
+            referents = found if referents is None else referents & found
+        for pred_match in (filt or {}).get('pred-match', None) or []:
+            found = self._at_least(s_key, pred_match['attr'], pred_match['value'])
+            referents = found if referents is None else referents & found
+        if referents is None:
+            return [self._claims[referent] for referent in self._by_schema.get(s_key, [])]
+        return [self._claims[referent] for referent in sorted(referents, key=self._ordinal.get)]
+
+    async def _plan(self, ag, form):
+        """
+        Return proof request, requested attributes, requested predicates, and filter per schema key
+        for claim-request or proof-request form, as von_agent's HolderProver composes them; refresh index.
+
+        :param ag: HolderProver agent
+        :param form: claim-request or proof-request form
+        :return: (proof request, requested attributes, requested predicates, filter per schema key) tuple
+        """
+
+        data = form['data']
+        claim_filter = data['claim-filter']
+        schemata = {}
+        form_schema_keys = []
+        for s_key_spec in (data['schemata'] +
+                [attr_match['schema'] for attr_match in claim_filter['attr-match']] +
+                [pred_match['schema'] for pred_match in claim_filter['pred-match']] +
+                [r_attr['schema'] for r_attr in data['requested-attrs']]):
+            s_key = schema_key_for(s_key_spec)
+            if s_key not in schemata:
+                schemata[s_key] = codec.loads(await ag.get_schema(s_key))
+            if not schemata[s_key]:
+                raise AbsentSchema('Absent schema {}, {} may pertain to another ledger'.format(s_key, form['type']))
+            form_schema_keys.append(s_key)
+
+        req_preds = {}  # preds first: defaulting requested attributes skip predicate attributes
+        for pred_match in claim_filter['pred-match']:
+            s_key = schema_key_for(pred_match['schema'])
+            for match in pred_match['match']:
+                req_preds['{}_{}_uuid'.format(schemata[s_key]['seqNo'], match['attr'])] = {
+                    'attr_name': match['attr'],
+                    'p_type': match['pred-type'],
+                    'value': match['value'],
+                    'restrictions': _restrictions(s_key)
+                }
+        pred_attrs = {(schema_key_for(p['restrictions'][0]['schema_key']), p['attr_name']) for p in req_preds.values()}
+
+        req_attrs = {}
+        for (s_key, names) in ([(schema_key_for(r['schema']), r['names']) for r in data['requested-attrs']] or
+                [(s_key, None) for s_key in form_schema_keys]):
+            for name in names or schemata[s_key]['data']['attr_names']:
+                if (s_key, name) not in pred_attrs:
+                    req_attrs['{}_{}_uuid'.format(schemata[s_key]['seqNo'], name)] = {
+                        'name': name,
+                        'restrictions': _restrictions(s_key)
+                    }
+
+        find_req = {
+            'nonce': str(int(time() * 1000)),
+            'name': 'find_req_0',  # informational only
+            'version': '1.0',  # informational only
+            'requested_attrs': req_attrs,
+            'requested_predicates': req_preds
+        }
+
+        filt = {schema_key_for(m['schema']): {'attr-match': m['match']} for m in claim_filter['attr-match']}
+        for pred_match in claim_filter['pred-match']:
+            filt.setdefault(schema_key_for(pred_match['schema']), {})['pred-match'] = pred_match['match']
+
+        await self.refresh(ag)
+        return (find_req, req_attrs, req_preds, filt)
+
+    def _found(self, req_attrs, req_preds, filt):
+        """
+        Generate ('attrs', uuid, claims) per requested attribute, then ('predicates', uuid, claims) per requested
+        predicate, resolving each on the index only as the caller advances.
+        """
+
+        for (uuid, req_attr) in req_attrs.items():
+            s_key = schema_key_for(req_attr['restrictions'][0]['schema_key'])
+            claims = self.candidates(s_key, filt.get(s_key, None))
+            if claims or not filt:  # von_agent prunes attributes without claims only on filter
+                yield ('attrs', uuid, claims)
+        for (uuid, req_pred) in req_preds.items():
+            s_key = schema_key_for(req_pred['restrictions'][0]['schema_key'])
+            yield ('predicates', uuid, self.candidates(
+                s_key,
+                {'pred-match': [{'attr': req_pred['attr_name'], 'value': req_pred['value']}]}))
+
+    async def iter_claims(self, ag, form):
+        """
+        Return proof request for claim-request or proof-request form and an iterator over claims found, as
+        ('attrs', attribute uuid, claims) then ('predicates', predicate uuid, claims) tuples, each resolved
+        on the index only as the caller advances: for a caller to stream claims without building the whole
+        response.
+
+        :param ag: HolderProver agent
+        :param form: claim-request or proof-request form
+        :return: (proof request, iterator) tuple
+        """
+
+        (find_req, req_attrs, req_preds, filt) = await self._plan(ag, form)
+        return (find_req, self._found(req_attrs, req_preds, filt))
+
+    async def find_claims(self, ag, form):
+        """
+        Return proof request and claims found for claim-request or proof-request form, as von_agent's
+        HolderProver does, but resolving filters through the index.
+
+        :param ag: HolderProver agent
+        :param form: claim-request or proof-request form
+        :return: (proof request, claims found) tuple
+        """
+
+        (find_req, found) = await self.iter_claims(ag, form)
+        claims_found = {'attrs': {}, 'predicates': {}}
+        for (key, uuid, claims) in found:
+            claims_found[key][uuid] = claims
+        return (find_req, claims_found)
+
+    async def process_post(self, ag, form):
+        """
+        Process claim-request or proof-request form on index, and return json response as von_agent would.
+
+        :param ag: HolderProver agent
+        :param form: claim-request or proof-request form
+        :return: json response
+        """
+
+        (find_req, claims_found) = await self.find_claims(ag, form)
+        if form['type'] == 'claim-request':
+            return codec.dumps({'proof-req': find_req, 'claims': claims_found})
+
+        x_uuids = [uuid for (uuid, claims) in claims_found['attrs'].items() if len(claims) != 1]
+        if x_uuids:
+            raise ClaimsFocus('Proof request requires unique claims per attribute; violators: {}'.format(x_uuids))
+        requested_claims = {
+            'self_attested_attributes': {},
+            'requested_attrs': {
+                uuid: [claims[0]['referent'], True] for (uuid, claims) in claims_found['attrs'].items()
+            },
+            'requested_predicates': {
+                uuid: claims[0]['referent'] for (uuid, claims) in claims_found['predicates'].items()
+            }
+        }
+        proof_json = await ag.create_proof(find_req, claims_found, requested_claims)
+        return codec.dumps({'proof-req': find_req, 'proof': codec.loads(proof_json)})
@@ -0,0 +1,150 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from os import environ
+
+import json
+
+
+# JSON codec for all of von_conx: encode and decode through the fastest backend installed (orjson, then ujson),
+# else the standard library json module; environment variable JSON_CODEC ('orjson', 'ujson', 'json') limits choice.
+# Canonical output: compact separators, non-ASCII characters as is, forward slashes unescaped, keys sorted on
+# request, and exact values (integers of any size, floats to the last bit); only the spelling of float exponents
+# may differ by backend (1e-07 against 1e-7). A backend serves encoding or decoding only if it reproduces the
+# standard library on a probe document at import: e.g., orjson decodes integers beyond 64 bits as floats, so it
+# does not decode. Where a backend fails on a value (e.g., orjson encoding a big integer) or rejects a document,
+# the call falls back to the standard library, which then gives the canonical result or error.
+
+_PROBE = {
+    'slash/path': ['a/b', 'é☃', '\n"', None, True, False],
+    'int': [0, -1, 2 ** 63 - 1, 2 ** 64, 10 ** 30],
+    'float': [0.1, 0.30000000000000004, -0.0, 123456.789],
+    'exp': [1e-07, 1e+30, 5e-324],
+    'nested': {'b': [{}], 'a': []}
+}
+
+
+def _std_dumps(obj, sort_keys=False):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys)
+
+
+def _std_loads(text):
+    return json.loads(text.decode('utf-8') if isinstance(text, (bytes, bytearray)) else text)
+
+
+def _orjson():
+    import orjson
+
+    def dumps(obj, sort_keys=False):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode('utf-8')
+
+    return (dumps, orjson.loads, (orjson.JSONEncodeError, orjson.JSONDecodeError, TypeError))
+
+
+def _ujson():
+    import ujson
+
+    def dumps(obj, sort_keys=False):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, sort_keys=sort_keys)
+
+    return (dumps, ujson.loads, (OverflowError, TypeError, ValueError))
+
+
+def _with_fallback(fn, std_fn, exceptions):
+    def rv(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except exceptions:
+            return std_fn(*args, **kwargs)
+    return rv
+
+
+def _encodes(dumps):
+    """
+    Return whether dumps() reproduces the standard library on the probe, up to float exponent spelling.
+    """
+
+    plain = {k: v for (k, v) in _PROBE.items() if k != 'exp'}
+    try:
+        return (dumps(plain, sort_keys=True) == _std_dumps(plain, sort_keys=True)
+            and _std_loads(dumps(plain)) == plain
+            and _std_loads(dumps(_PROBE['exp'])) == _PROBE['exp'])
+    except Exception:
+        return False
+
+
+def _decodes(loads):
+    """
+    Return whether loads() reproduces the standard library on the probe, value for value and type for type.
+    """
+
+    text = _std_dumps(_PROBE)
+    try:
+        return repr(loads(text)) == repr(_std_loads(text)) and repr(loads(text.encode())) == repr(_std_loads(text))
+    except Exception:
+        return False
+
+
+def _backends():
+    """
+    Return backend name, dumps, and loads: for each operation, the first backend that the environment admits,
+    that imports, and that passes the probe.
+
+    :return: (name, dumps, loads) tuple; name is encoder/decoder, e.g., 'orjson/ujson'
+    """
+
+    choice = environ.get('JSON_CODEC', None) or None
+    (enc, dumps, dec, loads) = ('json', _std_dumps, 'json', _std_loads)
+    for (name, load) in (('orjson', _orjson), ('ujson', _ujson)):
+        if choice not in (None, name):
+            continue
+        try:
+            (b_dumps, b_loads, exceptions) = load()
+        except ImportError:
+            continue
+        b_dumps = _with_fallback(b_dumps, _std_dumps, exceptions)
+        b_loads = _with_fallback(b_loads, _std_loads, exceptions)
+        if enc == 'json' and _encodes(b_dumps):
+            (enc, dumps) = (name, b_dumps)
+        if dec == 'json' and _decodes(b_loads):
+            (dec, loads) = (name, b_loads)
+    return ('{}/{}'.format(enc, dec), dumps, loads)
+
+
+(BACKEND, _dumps, _loads) = _backends()
+
+
+def dumps(obj, sort_keys=False):
+    """
+    Return compact json text for input object.
+
+    :param obj: json-serializable object
+    :param sort_keys: whether to sort object keys, e.g., for a canonical cache key
+    :return: json text
+    """
+
+    return _dumps(obj, sort_keys=sort_keys)
+
+
+def loads(text):
+    """
+    Return object that json text (str or UTF-8 bytes) encodes; raise ValueError on invalid json.
+
+    :param text: json text
+    :return: decoded object
+    """
+
+    return _loads(text)
@@ -0,0 +1,280 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from app import codec
+from app.service import logs, protocol
+from app.store import IssueStore
+from concurrent.futures import ThreadPoolExecutor
+from os import getpid, kill
+from uuid import uuid4
+
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _alive(pid):
+    """
+    Return whether process is running.
+
+    :param pid: process id, None for none
+    :return: whether process is running
+    """
+
+    if pid is None:
+        return False
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class BulkIssue:
+    """
+    Bulk claim issuance jobs on Issuer agent, for one schema and holder-prover: the issuer creates a claim offer,
+    the holder-prover stores it (by proxy) and returns its claim request, and then, per item of claim attributes,
+    the issuer creates the claim and the holder-prover stores it (by proxy). Items run through claim-create and
+    claim-store up to a configured number at a time, so that one item's claim-store overlaps the next items'
+    claim-create.
+
+    Jobs and per-item results persist in an IssueStore that each server process opens for itself once it starts
+    (an sqlite connection must not cross a fork), on a dedicated thread that all its reads and writes then use,
+    keeping them off the event loop. On restart, a process adopts any running job whose owner process is gone and
+    resumes it from its first unprocessed item; an item in process at the crash runs again, so its holder-prover
+    may store its claim twice.
+    """
+
+    def __init__(self, cfg, step):
+        """
+        Initialize on configuration and message processing coroutine function.
+
+        :param cfg: configuration dict from Bulk Issue section, e.g.,
+            {'concurrency': '4', 'claims.max': '100000', 'retry.max': '30'}
+        :param step: coroutine function processing protocol message form and description for log, returning
+            (json response, None) on success or (None, (error code, message, HTTP status, HTTP headers)) on failure
+        """
+
+        self._concurrency = int(cfg.get('concurrency', 4))
+        self._claims_max = int(cfg.get('claims.max', 100000))
+        self._retry_max = int(cfg.get('retry.max', 30))
+        self._step = step
+        self._store = None
+        self._executor = None
+        self._tasks = {}  # job id to task running it in this process
+
+    @property
+    def claims_max(self):
+        """
+        Accessor for most claims per job.
+
+        :return: most claims per job
+        """
+
+        return self._claims_max
+
+    async def _db(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+
+    async def open(self, name):
+        """
+        Open job store for current process, on the thread that is to use it.
+
+        :param name: store name, e.g., agent profile
+        """
+
+        self._executor = ThreadPoolExecutor(max_workers=1)  # store connection lives and dies on this one thread
+        self._store = await self._db(IssueStore, name)
+
+    async def submit(self, schema, holder_did, claims, job_id=None):
+        """
+        Store and start new job; return its id and whether it is new (False if job id exists already).
+
+        :param schema: schema key specifier, e.g., {'origin-did': ..., 'name': 'bc-reg', 'version': '1.0'}
+        :param holder_did: holder-prover DID to relay claim-offer-store and claim-store to
+        :param claims: list of claim attribute dicts
+        :param job_id: job id, None to generate
+        :return: (job id, whether job is new) tuple
+        """
+
+        job_id = job_id or uuid4().hex
+        created = await self._db(
+            self._store.create,
+            job_id,
+            codec.dumps(schema),
+            holder_did,
+            [codec.dumps(attrs) for attrs in claims],
+            getpid())
+        if created:
+            self._start(job_id)
+        return (job_id, created)
+
+    def _start(self, job_id):
+        self._tasks[job_id] = asyncio.ensure_future(self._run(job_id))
+        self._tasks[job_id].add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def resume(self):
+        """
+        Adopt and resume running jobs whose owner processes are gone, e.g., after a crash.
+        """
+
+        for (job_id, owner) in await self._db(self._store.running):
+            if job_id not in self._tasks and (owner == getpid() or not _alive(owner)) and await self._db(
+                    self._store.adopt,
+                    job_id,
+                    owner,
+                    getpid()):
+                logger.info('Resuming bulk issue job %s of process %s', job_id, owner)
+                self._start(job_id)
+
+    async def _process(self, form, where):
+        """
+        Process form, waiting out admission control and offload rejections (HTTP 429, 503) up to the configured
+        number of retries; return (json response, None) on success or (None, failure tuple) on failure.
+
+        :param form: protocol message form
+        :param where: description of message for log
+        :return: (json response or None, None or (error code, message, HTTP status, HTTP headers) tuple)
+        """
+
+        for retry in range(self._retry_max + 1):
+            if retry:
+                await asyncio.sleep(float((failed[3] or {}).get('Retry-After', 1)))
+            (rv_json, failed) = await self._step(form, where)
+            if not failed or failed[2] not in (429, 503):
+                break
+        return (rv_json, failed)
+
+    async def _run(self, job_id):
+        """
+        Run job, marking it failed on any unexpected exception (cancellation leaves it running, to resume later).
+
+        :param job_id: job id
+        """
+
+        logs.bind(request_id=job_id, msg_type='bulk-issue')
+        try:
+            await self._issue(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception('Bulk issue job %s failed: %s', job_id, e)
+            try:
+                await self._db(self._store.finish, job_id, 'failed', str(e) or e.__class__.__name__)
+            except Exception as x:
+                logger.exception('Could not mark bulk issue job %s failed: %s', job_id, x)
+
+    async def _issue(self, job_id):
+        """
+        Issue claims for job: claim offer and claim request unless done already, then remaining items.
+
+        :param job_id: job id
+        """
+
+        job = await self._db(self._store.job, job_id)
+        holder_did = job['holder_did']
+        claim_req_json = job['claim_req']
+        if claim_req_json is None:
+            s = codec.loads(job['schema'])
+            (offer_json, failed) = await self._process(
+                protocol.form('claim-offer-create', s['origin-did'], s['name'], s['version'], holder_did),
+                'bulk issue {} claim-offer-create'.format(job_id))
+            if not failed:
+                (claim_req_json, failed) = await self._process(
+                    protocol.form('claim-offer-store', codec.loads(offer_json), proxy_did=holder_did),
+                    'bulk issue {} claim-offer-store'.format(job_id))
+            if failed:
+                await self._db(self._store.finish, job_id, 'failed', failed[1])
+                return
+            await self._db(self._store.set_claim_req, job_id, claim_req_json)
+        claim_req = codec.loads(claim_req_json)
+
+        items = iter(await self._db(self._store.pending, job_id))
+
+        async def issue():
+            for (idx, attrs_json) in items:  # workers share iterator: each item goes to one worker
+                logs.bind(request_id='{}/{}'.format(job_id, idx), msg_type='bulk-issue')
+                where = 'bulk issue {} item {}'.format(job_id, idx)
+                (claim_json, failed) = await self._process(
+                    protocol.form('claim-create', claim_req, codec.loads(attrs_json)),
+                    where)
+                if not failed:
+                    (_, failed) = await self._process(
+                        protocol.form('claim-store', codec.loads(claim_json), proxy_did=holder_did),
+                        where)
+                if failed:
+                    await self._db(self._store.record, job_id, idx, failed[2], int(failed[0]), failed[1])
+                else:
+                    await self._db(self._store.record, job_id, idx, 200)
+
+        workers = [asyncio.ensure_future(issue()) for _ in range(self._concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:  # on failure in one, stop the rest
+                worker.cancel()
+        await self._db(self._store.finish, job_id, 'done')
+        logger.info('Bulk issue job %s done', job_id)
+
+    async def status(self, job_id, start=0, limit=-1):
+        """
+        Return job progress and per-item results, None for no such job.
+
+        :param job_id: job id
+        :param start: least item index to report results for
+        :param limit: most item results to report, -1 for all
+        :return: dict with job id, schema, holder DID, status ('running', 'done', 'failed'), message on failure,
+            item counts (total, succeeded, failed, pending), and results: list of {'index': ..., 'status': ...},
+            with 'error-code' and 'message' on failure
+        """
+
+        job = await self._db(self._store.job, job_id)
+        if job is None:
+            return None
+        (total, succeeded, failed) = await self._db(self._store.counts, job_id)
+        rv = {
+            'job-id': job_id,
+            'schema': codec.loads(job['schema']),
+            'holder-did': job['holder_did'],
+            'status': job['status'],
+            'total': total,
+            'succeeded': succeeded,
+            'failed': failed,
+            'pending': total - succeeded - failed,
+            'results': [
+                {'index': idx, 'status': status} if status == 200 else
+                    {'index': idx, 'status': status, 'error-code': error_code, 'message': message}
+                for (idx, status, error_code, message) in await self._db(self._store.results, job_id, start, limit)
+            ]
+        }
+        if job['message'] is not None:
+            rv['message'] = job['message']
+        return rv
+
+    def close(self):
+        """
+        Cancel jobs running in this process, for a later process to resume, and close store.
+        """
+
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._executor is not None:
+            self._executor.submit(self._store.close)
+            self._executor.shutdown(wait=True)
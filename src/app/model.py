@@ -17,10 +17,11 @@ limitations under the License.
 
 import re
 
+from collections import OrderedDict
+from functools import lru_cache
 from sanic_openapi import doc
 from von_agent.agents import AgentRegistrar, Origin, Issuer, HolderProver, Verifier
 from von_agent.proto.validate import PROTO_MSG_JSON_SCHEMA
-from von_agent.util import ppjson
 
 
 def slug2pascal(slug):
@@ -30,37 +31,59 @@ def slug2pascal(slug):
     return rv
 
 
-def proxy_did_required(agent, msg_type):
-    rv = True
-    if msg_type in ('agent-nym-lookup', 'agent-endpoint-lookup', 'agent-endpoint-send', 'schema-lookup'):
-        rv = False
-    elif msg_type == 'agent-nym-send' and isinstance(agent, AgentRegistrar):
-        rv = False
-    elif msg_type == 'schema-send' and isinstance(agent, Origin):
-        rv = False
-    elif msg_type in ('claim-def-send', 'claim-offer-create', 'claim-create') and isinstance(agent, Issuer):
-        rv = False
-    elif msg_type in (
-            'claim-offer-store',
-            'claim-request',
-            'proof-request',
-            'proof-request-by-referent',
-            'claim-store') and isinstance(agent, HolderProver):
-        rv = False
-    elif msg_type == 'verification-request' and isinstance(agent, Verifier):
-        rv = False
-
+BASE_MSG_TYPES = ('agent-nym-lookup', 'agent-endpoint-lookup', 'agent-endpoint-send', 'schema-lookup')
+
+NATIVE_MSG_TYPES = (  # agent class, message types that it processes natively
+    (AgentRegistrar, ('agent-nym-send',)),
+    (Origin, ('schema-send',)),
+    (Issuer, ('claim-def-send', 'claim-offer-create', 'claim-create')),
+    (HolderProver, (
+        'master-secret-set',
+        'claim-offer-store',
+        'claim-store',
+        'claim-request',
+        'claims-reset',
+        'proof-request',
+        'proof-request-by-referent')),
+    (Verifier, ('verification-request',))
+)
+
+
+@lru_cache(maxsize=None)
+def capabilities(agent_cls):
+    """
+    Return capability matrix for agent class: map from each protocol message type, in sorted order,
+    to whether agent class offers it, whether it processes it natively, and whether it requires
+    a proxy DID to relay it. Agents offer any message type that they can relay.
+
+    :param agent_cls: agent class
+    :return: OrderedDict mapping message type to dict with keys 'offered', 'native', 'proxy-required'
+    """
+
+    native = set(BASE_MSG_TYPES)
+    for (cls, msg_types) in NATIVE_MSG_TYPES:
+        if issubclass(agent_cls, cls):
+            native.update(msg_types)
+
+    rv = OrderedDict()
+    for msg_type in sorted(PROTO_MSG_JSON_SCHEMA):
+        relayable = 'proxy-did' in PROTO_MSG_JSON_SCHEMA[msg_type]['properties']['data'].get('properties', [])
+        offered = msg_type in native or relayable
+        rv[msg_type] = {
+            'offered': offered,
+            'native': msg_type in native,
+            'proxy-required': offered and msg_type not in native
+        }
     return rv
 
 
-def json_schema_obj2model_obj(agent, msg_type, obj):
+def json_schema_obj2model_obj(agent_cls, msg_type, obj):
     rv = {}
-    # print('\n\n-- key: {}, obj {}'.format(k, ppjson(obj)))
     required = obj.get('required', [])
     if 'properties' in obj:
         for p in obj['properties']:
             if p == 'proxy-did':
-                rv[p] = doc.String(description=p, required=proxy_did_required(agent, msg_type))
+                rv[p] = doc.String(description=p, required=capabilities(agent_cls)[msg_type]['proxy-required'])
             elif obj['properties'][p]['type'] == 'string':
                 rv[p] = doc.String(description=p, required=(p in required))
             elif obj['properties'][p]['type'] == 'integer':
@@ -77,33 +100,15 @@ def json_schema_obj2model_obj(agent, msg_type, obj):
                     sample_items.append('sample')
                 rv[p] = doc.List(description=p, items=sample_items, required=(p in required))
             elif obj['properties'][p]['type'] == 'object':
-                rv[p] = json_schema_obj2model_obj(agent, msg_type, obj['properties'][p])
+                rv[p] = json_schema_obj2model_obj(agent_cls, msg_type, obj['properties'][p])
     else:
         rv = doc.Dictionary(description='', required=True)
-    # print('\n-->> returning {}'.format(rv))
-    return rv
-
-
-def is_native(agent, msg_type):
-    rv = False
-    if msg_type in ('master-secret-set', 'claims-reset'):
-        rv = isinstance(agent, HolderProver)
-    elif offers(agent, msg_type):
-        rv = not proxy_did_required(agent, msg_type)
     return rv
 
 
-def offers(agent, msg_type):
-    rv = False
-    if msg_type in ('master-secret-set', 'claims-reset'):
-        rv = isinstance(agent, HolderProver)
-    elif 'proxy-did' in PROTO_MSG_JSON_SCHEMA[msg_type]['properties']['data'].get('properties', []):
-        rv = True
-    return rv
-
-
-def openapi_model(agent, msg_type):
-    if not offers(agent, msg_type):
+@lru_cache(maxsize=None)
+def openapi_model(agent_cls, msg_type):
+    if not capabilities(agent_cls)[msg_type]['offered']:
         return None
 
     return type(
@@ -111,5 +116,9 @@ def openapi_model(agent, msg_type):
         (),
         {
             'type': doc.String(description=msg_type, required=True, choices=[msg_type]),
-            'data': json_schema_obj2model_obj(agent, msg_type, PROTO_MSG_JSON_SCHEMA[msg_type]['properties']['data'])
+            'data': json_schema_obj2model_obj(
+                agent_cls,
+                msg_type,
+                PROTO_MSG_JSON_SCHEMA[msg_type]['properties']['data'])
         })
+
@@ -14,74 +14,299 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from app.cache import mem_cache
+from app import codec
+from app.cache import mem_cache, registry
+from app.service.client import HTTPClient
+from app.service import protocol
 from app.service.eventloop import do
-from os import environ
-from os.path import abspath, dirname, join as pjoin
-from requests.adapters import HTTPAdapter
+from app.store import LedgerStore
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fcntl import flock, LOCK_EX
+from os import environ, getpid, makedirs
+from os.path import abspath, dirname, isfile, join as pjoin
 from sanic.exceptions import ServerError
-from urllib.parse import urlsplit
+from time import monotonic
+from uuid import uuid4
 from von_agent.agents import Issuer
+from von_agent.cache import CLAIM_DEF_CACHE, SCHEMA_CACHE
 from von_agent.demo_agents import TrustAnchorAgent, SRIAgent, BCRegistrarAgent, OrgBookAgent
 from von_agent.nodepool import NodePool
+from von_agent.schemakey import SchemaKey
 from von_agent.wallet import Wallet
 
 import asyncio
-import json
 import logging
-import requests
 
 
 class BootSequence:
-    dir_proto = pjoin(dirname(dirname(abspath(__file__))), 'protocol')
-    async def originate(ag, cfg):
+    dir_run = pjoin(dirname(dirname(abspath(__file__))), 'run')
+    boot_token = uuid4().hex  # fresh per server start: sanic master imports this before forking workers
+    store = None
+    executor = None  # single thread for ledger store calls: off the event loop, one at a time
+    pending = None
+    phases = OrderedDict()  # boot phase to its duration in seconds, for metrics
+
+    async def db(fn, *args):
+        """
+        Run ledger store call on store thread, starting it if need be, and return its result.
+
+        :param fn: store method
+        :param args: its arguments
+        :return: its result
+        """
+
+        if BootSequence.executor is None:
+            BootSequence.executor = ThreadPoolExecutor(max_workers=1)
+        return await asyncio.get_event_loop().run_in_executor(BootSequence.executor, fn, *args)
+
+    async def originate_schema(ag, schema_name, schema_version, store):
+        """
+        Send schema that agent originates if need be, then send claim definition on it if agent is an Issuer.
+
+        Take schema and claim def in store as on ledger, loading them into von_agent caches; store any
+        that this call finds on or sends to ledger.
+
+        :param ag: agent object
+        :param schema_name: schema name
+        :param schema_version: schema version
+        :param store: ledger store
+        """
+
+        logger = logging.getLogger(__name__)
+
+        s_key = LedgerStore.schema_key(ag.did, schema_name, schema_version)
+        schema_json = await BootSequence.db(store.get, 'schema', s_key)
+        if schema_json:
+            with SCHEMA_CACHE.lock:
+                SCHEMA_CACHE[SchemaKey(ag.did, schema_name, schema_version)] = codec.loads(schema_json)
+        else:
+            schema_json = await ag.process_post(protocol.form('schema-lookup', ag.did, schema_name, schema_version))
+
+            if not codec.loads(schema_json):
+                schema_json = await ag.process_post(protocol.form(
+                    'schema-send',
+                    ag.did,
+                    schema_name,
+                    schema_version,
+                    protocol.form('schema-send/{}/{}/attr-names'.format(schema_name, schema_version))))
+                logger.info('Originated schema {} version {}'.format(schema_name, schema_version))
+
+        schema = codec.loads(schema_json)
+        assert schema
+        await BootSequence.db(store.put, 'schema', s_key, schema_json)
+
+        if isinstance(ag, Issuer):
+            cd_key = LedgerStore.claim_def_key(schema['seqNo'], schema['dest'])
+            claim_def_json = await BootSequence.db(store.get, 'claim-def', cd_key)
+            if claim_def_json:
+                with CLAIM_DEF_CACHE.lock:
+                    CLAIM_DEF_CACHE[(schema['seqNo'], schema['dest'])] = codec.loads(claim_def_json)
+
+            await ag.send_claim_def(schema_json)  # with claim def in cache, this only touches wallet
+            logger.info('Ensured claim def on ledger and wallet {} for schema {} version {}'.format(
+                ag.wallet.name,
+                schema_name,
+                schema_version))
+
+            if not claim_def_json:
+                claim_def_json = await ag.get_claim_def(schema['seqNo'], schema['dest'])
+                if codec.loads(claim_def_json):
+                    await BootSequence.db(store.put, 'claim-def', cd_key, claim_def_json)
+
+    async def originate(ag, cfg, store):
         """
         Send schemata that configuration identifies agent as originating, send claim definition if agent is an Issuer.
 
+        Each schema version is an independent pipeline (lookup, send, claim def); pipelines run concurrently,
+        up to configured limit. Raise ServerError on any pipeline failing, once all have finished.
+
         :param ag: agent object
         :param cfg_agent: configuration dict
+        :param store: ledger store
+        :return: dict mapping (schema name, version) pairs to None for success or exception for failure
         """
         # note that for our demo, all issuers originate exactly the schemata on which they make claim definitions
 
         logger = logging.getLogger(__name__)
 
         if 'Origin' not in cfg:
+            return {}
+
+        semaphore = asyncio.Semaphore(int(cfg.get('Boot', {}).get('originate.concurrency', 1)))
+
+        async def pipeline(schema_name, schema_version):
+            async with semaphore:
+                await BootSequence.originate_schema(ag, schema_name, schema_version, store)
+
+        s_specs = [
+            (schema_name, schema_version)
+            for schema_name in cfg['Origin']
+            for schema_version in (v.strip() for v in cfg['Origin'][schema_name].split(','))]
+        results = await asyncio.gather(*[pipeline(*s_spec) for s_spec in s_specs], return_exceptions=True)
+
+        rv = dict(zip(s_specs, results))
+        for (s_spec, result) in rv.items():
+            if result is None:
+                logger.info('Origination pipeline for schema {} version {}: OK'.format(*s_spec))
+            else:
+                logger.error('Origination pipeline for schema {} version {}: failed: {}'.format(*s_spec, repr(result)))
+        failures = ['{} version {}'.format(*s_spec) for s_spec in s_specs if rv[s_spec] is not None]
+        if failures:
+            raise ServerError('Could not originate schemata: {}'.format(', '.join(failures)))
+
+        return rv
+
+    async def register(ag, cfg, store):
+        """
+        Ensure agent nym and endpoint are on ledger, and schemata and claim defs that configuration
+        identifies agent as originating.
+
+        Take artifacts in store as on ledger; store any that this call finds on or sends to ledger.
+
+        :param ag: agent object
+        :param cfg: configuration dict
+        :param store: ledger store
+        """
+
+        logger = logging.getLogger(__name__)
+
+        role = (cfg['Agent']['role'] or '').lower().replace(' ', '')
+        profile = environ.get('AGENT_PROFILE').lower().replace(' ', '')
+
+        nym_json = await BootSequence.db(store.get, 'nym', ag.did) or await ag.get_nym(ag.did)
+        if not codec.loads(nym_json):
+            if role == 'trust-anchor':
+                # register trust anchor
+                await ag.send_nym(ag.did, ag.verkey, ag.wallet.profile)
+
+            else:
+                trust_anchor_base_url = 'http://{}:{}/api/v0'.format(
+                    cfg['Trust Anchor']['host'],
+                    cfg['Trust Anchor']['port'])
+
+                # not registered: get trust-anchor host & port, post an agent-nym-send form
+                attempts = int(cfg['Trust Anchor'].get('register.attempts', 1))
+                client = HTTPClient(cfg.get('HTTP Client', {}))
+                try:
+                    tag_did = await client.request('GET', '{}/did'.format(trust_anchor_base_url), attempts=attempts)
+                    logger.debug('{}; tag_did {}'.format(profile, tag_did))
+                    assert tag_did
+
+                    form = protocol.form('agent-nym-send', ag.did, ag.verkey)
+                    logger.debug('{}; sending {}'.format(profile, form))
+                    await client.request(
+                        'POST',
+                        '{}/agent-nym-send'.format(trust_anchor_base_url),
+                        json=form,
+                        attempts=attempts)
+                except Exception:
+                    logger.error(
+                        'Agent {} nym is not on the ledger, but trust anchor is not responding'.format(profile))
+                    raise ServerError('Agent {} requires Trust Anchor agent, but it is not responding'.format(profile))
+                finally:
+                    await client.close()
+            nym_json = await ag.get_nym(ag.did)
+        if codec.loads(nym_json):
+            await BootSequence.db(store.put, 'nym', ag.did, nym_json)
+
+        # get endpoint: if not present, send it
+        endpoint_json = await BootSequence.db(store.get, 'endpoint', ag.did) or await ag.get_endpoint(ag.did)
+        if not codec.loads(endpoint_json):
+            endpoint_json = await ag.send_endpoint()
+        if codec.loads(endpoint_json):
+            await BootSequence.db(store.put, 'endpoint', ag.did, endpoint_json)
+
+        if role in ('trust-anchor', 'bc-registrar', 'sri'):
+            # originate schemata if need be
+            await BootSequence.originate(ag, cfg, store)
+
+    async def go_later():
+        """
+        Complete boot on server event loop: register agent if go() deferred it, marking registry ready
+        or failed, then verify ledger store.
+        """
+
+        logger = logging.getLogger(__name__)
+
+        if BootSequence.pending is not None:
+            (ag, cfg) = BootSequence.pending
+            BootSequence.pending = None
+            start = monotonic()
+            try:
+                await BootSequence.register(ag, cfg, BootSequence.store)
+            except Exception as e:
+                logger.exception('Agent registration failed: {}'.format(e))
+                registry.status = 'failed: {}'.format(e)
+                return
+            BootSequence.phases['register'] = monotonic() - start
+            registry.status = 'ready'
+            logger.info('Agent registration complete')
+
+        start = monotonic()
+        await BootSequence.verify()
+        BootSequence.phases['verify'] = monotonic() - start
+
+    async def verify():
+        """
+        Check artifacts that boot took from store against ledger, refreshing any that changed. If any is
+        gone from ledger (e.g., on ledger reset), clear store so that next boot checks ledger and writes afresh.
+        """
+
+        logger = logging.getLogger(__name__)
+
+        store = BootSequence.store
+        ag = registry.agent
+        if store is None or ag is None:
             return
-        for schema_name in cfg['Origin']:
-            for schema_version in (v.strip() for v in cfg['Origin'][schema_name].split(',')):
-                j = None
-                attrs_json = None
-                with open(pjoin(BootSequence.dir_proto, 'schema-lookup.json'), 'r') as proto_f:
-                    j = proto_f.read()
-
-                schema_json = await ag.process_post(json.loads(j % (ag.did, schema_name, schema_version)))
-
-                if not json.loads(schema_json):
-                    with open(pjoin(BootSequence.dir_proto, 'schema-send.json'), 'r') as proto_f:
-                        j = proto_f.read()
-                    with open(pjoin(
-                            BootSequence.dir_proto,
-                            'schema-send',
-                            schema_name,
-                            schema_version,
-                            'attr-names.json'), 'r') as attr_names_f:
-                        attrs_json = attr_names_f.read()
-                    schema_json = await ag.process_post(json.loads(j % (
-                        ag.did,
-                        schema_name,
-                        schema_version,
-                        json.dumps(json.loads(attrs_json)))))
-                    logger.info('Originated schema {} version {}'.format(schema_name, schema_version))
-
-                schema = json.loads(schema_json)
-                assert schema
-
-                if isinstance(ag, Issuer):
-                    await ag.send_claim_def(schema_json)
-                    logger.info('Ensured claim def on ledger and wallet {} for schema {} version {}'.format(
-                        ag.wallet.name,
-                        schema_name,
-                        schema_version))
+        BootSequence.store = None
+
+        try:
+            absent = []
+            for (did, nym_json) in await BootSequence.db(store.items, 'nym'):
+                ledger_json = await ag.get_nym(did)
+                if not codec.loads(ledger_json):
+                    absent.append('nym {}'.format(did))
+                elif codec.loads(ledger_json) != codec.loads(nym_json):
+                    await BootSequence.db(store.put, 'nym', did, ledger_json)
+
+            for (did, endpoint_json) in await BootSequence.db(store.items, 'endpoint'):
+                ledger_json = await ag.get_endpoint(did)
+                if not codec.loads(ledger_json):
+                    absent.append('endpoint for {}'.format(did))
+                elif codec.loads(ledger_json) != codec.loads(endpoint_json):
+                    await BootSequence.db(store.put, 'endpoint', did, ledger_json)
+
+            for (s_key, schema_json) in await BootSequence.db(store.items, 'schema'):
+                schema = codec.loads(schema_json)
+                txn = codec.loads(await ag.process_get_txn(schema['seqNo']))
+                if not (txn.get('type', None) == '101' and
+                        txn['identifier'] == schema['dest'] and
+                        txn['data']['name'] == schema['data']['name'] and
+                        txn['data']['version'] == schema['data']['version']):
+                    absent.append('schema {}'.format(s_key))
+
+            for (cd_key, claim_def_json) in await BootSequence.db(store.items, 'claim-def'):
+                (seq_no, issuer_did) = cd_key.split(':', 1)
+                with CLAIM_DEF_CACHE.lock:
+                    CLAIM_DEF_CACHE.pop((int(seq_no), issuer_did), None)  # force ledger lookup
+                ledger_json = await ag.get_claim_def(int(seq_no), issuer_did)
+                if not codec.loads(ledger_json):
+                    absent.append('claim def {}'.format(cd_key))
+                elif codec.loads(ledger_json) != codec.loads(claim_def_json):
+                    await BootSequence.db(store.put, 'claim-def', cd_key, ledger_json)
+
+            if absent:
+                logger.error('Ledger store has artifacts absent from ledger ({}): cleared store; restart agent'.format(
+                    ', '.join(absent)))
+                await BootSequence.db(store.clear)
+            else:
+                logger.info('Verified ledger store against ledger')
+            await BootSequence.db(store.close)
+        finally:
+            if BootSequence.executor is not None:  # verify() is the store's last use
+                BootSequence.executor.shutdown(wait=False)
+                BootSequence.executor = None
 
     def agent_config_for(cfg):
         return {
@@ -91,101 +316,128 @@ class BootSequence:
             'proxy-relay': True
         }
 
-    def go():
+    def agent_class_for(cfg):
+        """
+        Return agent class for configured role.
+
+        :param cfg: configuration dict
+        :return: agent class
+        """
+
+        role = (cfg['Agent']['role'] or '').lower().replace(' ', '')
+        rv = {
+            'trust-anchor': TrustAnchorAgent,
+            'sri': SRIAgent,
+            'org-book': OrgBookAgent,
+            'bc-registrar': BCRegistrarAgent
+        }.get(role, None)
+        if rv is None:
+            raise ServerError('Agent profile {} configured for unsupported role {}'.format(
+                environ.get('AGENT_PROFILE'),
+                role))
+        return rv
+
+    def go(lead=True, master_secret=None, register_later=False):
+        """
+        Open node pool and agent for configured profile, and set them in registry.
+
+        :param lead: whether to write to ledger (nym, endpoint, schemata, claim defs) as need be;
+            a worker following a leader that has already done so only opens its pool and agent
+        :param master_secret: master secret label for HolderProver, None to derive from configuration and pid
+        :param register_later: whether to defer ledger writes to go_later(), on server event loop, so that
+            server can start on read-only routes while agent registers
+        """
+
         logger = logging.getLogger(__name__)
 
         cfg = do(mem_cache.get('config'))
 
         role = (cfg['Agent']['role'] or '').lower().replace(' ', '')  # will be a dir as a pool name: spaces are evil
         profile = environ.get('AGENT_PROFILE').lower().replace(' ', '') # several profiles may share a role
-        logger.debug('Starting agent; profile={}, role={}'.format(profile, role))
+        logger.debug('Starting agent; profile={}, role={}, lead={}'.format(profile, role, lead))
 
+        start = monotonic()
         pool = NodePool('pool.{}'.format(profile), cfg['Pool']['genesis.txn.path'])
         do(pool.open())
         assert pool.handle
-        do(mem_cache.set('pool', pool))
-
-        ag = None
-        if role == 'trust-anchor':
-            bootstrap_json = cfg['Agent']
-            ag = TrustAnchorAgent(
-                do(Wallet(pool, cfg['Agent']['seed'], profile).create()),
-                BootSequence.agent_config_for(cfg))
-            do(ag.open())
-            assert ag.did
-            tag_did = ag.did
-            
-            # register trust anchor if need be
-            if not json.loads(do(ag.get_nym(ag.did))):
-                do(ag.send_nym(ag.did, ag.verkey, ag.wallet.profile))
-            if not json.loads(do(ag.get_endpoint(ag.did))):
-                do(ag.send_endpoint())
-
-            # originate schemata if need be
-            do(BootSequence.originate(ag, cfg))
-
-        elif role in ('sri', 'org-book', 'bc-registrar'):
-            # create agent by role
-            if role == 'sri':
-                ag = SRIAgent(
-                    do(Wallet(pool, cfg['Agent']['seed'], profile).create()),
-                    BootSequence.agent_config_for(cfg))
-            elif role == 'org-book':
-                ag = OrgBookAgent(
-                    do(Wallet(pool, cfg['Agent']['seed'], profile).create()),
-                    BootSequence.agent_config_for(cfg))
-            elif role == 'bc-registrar':
-                ag = BCRegistrarAgent(
-                    do(Wallet(pool, cfg['Agent']['seed'], profile).create()),
-                    BootSequence.agent_config_for(cfg))
-
-            do(ag.open())
-            logger.debug('profile {}; ag class {}'.format(profile, ag.__class__.__name__))
-
-            trust_anchor_base_url = 'http://{}:{}/api/v0'.format(
-                cfg['Trust Anchor']['host'],
-                cfg['Trust Anchor']['port'])
-
-            # get nym: if not registered; get trust-anchor host & port, post an agent-nym-send form
-            if not json.loads(do(ag.get_nym(ag.did))):
-                try:
-                    r = requests.get('{}/did'.format(trust_anchor_base_url))
-                    if not r.ok:
-                        logger.error(
-                            'Agent {} nym is not on the ledger, but trust anchor is not responding'.format(profile))
-                        r.raise_for_status()
-                    tag_did = r.json()
-                    logger.debug('{}; tag_did {}'.format(profile, tag_did))
-                    assert tag_did
+        registry.pool = pool
+        BootSequence.phases['pool.open'] = monotonic() - start
+
+        start = monotonic()
+        ag = BootSequence.agent_class_for(cfg)(
+            do(Wallet(pool, cfg['Agent']['seed'], profile).create()),
+            BootSequence.agent_config_for(cfg))
+        do(ag.open())
+        assert ag.did
+        BootSequence.phases['agent.open'] = monotonic() - start
+        logger.debug('profile {}; ag class {}'.format(profile, ag.__class__.__name__))
+
+        if lead:
+            BootSequence.store = LedgerStore(pool.name)  # boot takes artifacts in store on faith: verify() checks
+            if register_later:
+                BootSequence.pending = (ag, cfg)
+                registry.status = 'registering'
+            else:
+                start = monotonic()
+                do(BootSequence.register(ag, cfg, BootSequence.store))
+                BootSequence.phases['register'] = monotonic() - start
+                registry.status = 'ready'
+        else:
+            registry.status = 'ready'  # leader has registered agent
 
-                    with open(pjoin(BootSequence.dir_proto, 'agent-nym-send.json'), 'r') as proto:
-                        j = proto.read()
-                    logger.debug('{}; sending {}'.format(profile, j % (ag.did, ag.verkey)))
-                    r = requests.post(
-                        '{}/agent-nym-send'.format(trust_anchor_base_url),
-                        json=json.loads(j % (ag.did, ag.verkey)))
-                    r.raise_for_status()
-                except Exception:
-                    raise ServerError('Agent {} requires Trust Anchor agent, but it is not responding'.format(profile))
+        if role == 'org-book':
+            # set master secret
+            if master_secret is None:
+                # append pid to avoid re-using a master secret on restart of HolderProver agent; indy-sdk library
+                # is shared, so it remembers and forbids it unless we shut down all processes
+                master_secret = cfg['Agent']['master.secret'] + '.' + str(getpid())
+            start = monotonic()
+            do(ag.create_master_secret(master_secret))
+            BootSequence.phases['master.secret'] = monotonic() - start
+            registry.master_secret = master_secret
 
-            # get endpoint: if not present, send it
-            if not json.loads(do(ag.get_endpoint(ag.did))):
-                do(ag.send_endpoint())
+        registry.agent = ag
+        return ag
 
-            if role in ('bc-registrar', 'sri'):
-                # originate schemata if need be
-                do(BootSequence.originate(ag, cfg))
+    def go_worker():
+        """
+        Boot agent in one of several sanic worker processes for the same agent profile.
 
-            if role in ('org-book'):
-                # set master secret
-                from os import getpid
-                # append pid to avoid re-using a master secret on restart of HolderProver agent; indy-sdk library 
-                # is shared, so it remembers and forbids it unless we shut down all processes
-                do(ag.create_master_secret(cfg['Agent']['master.secret'] + '.' + str(getpid())))
+        Workers boot one at a time under an exclusive lock file: the first to boot under the current
+        sanic master process leads, writing to ledger as need be and stamping its master secret label
+        to file; later workers only open their own pool handles and agents on the shared wallet,
+        adopting the leader's master secret so that all workers prove on claims any of them stored.
 
-        else:
-            raise ServerError('Agent profile {} configured for unsupported role {}'.format(profile, role))
+        Workers recognize the current master by the random boot token that they inherit from it, not by
+        its pid: in a container, a restarted master typically gets the same pid as the one before.
+        """
 
-        assert ag is not None
+        logger = logging.getLogger(__name__)
 
-        do(mem_cache.set('agent', ag))
+        profile = environ.get('AGENT_PROFILE').lower().replace(' ', '')
+        makedirs(BootSequence.dir_run, exist_ok=True)
+        path_stamp = pjoin(BootSequence.dir_run, '{}.boot.json'.format(profile))
+
+        with open(pjoin(BootSequence.dir_run, '{}.boot.lock'.format(profile)), 'w') as lock_f:
+            flock(lock_f, LOCK_EX)  # released on close
+            stamp = {}
+            if isfile(path_stamp):
+                with open(path_stamp, 'r') as stamp_f:
+                    stamp = codec.loads(stamp_f.read() or '{}')
+
+            if stamp.get('boot.token', None) == BootSequence.boot_token:
+                logger.info('Worker {} following boot leader {}'.format(getpid(), stamp['pid']))
+                BootSequence.go(False, stamp['master.secret'])
+            else:
+                logger.info('Worker {} leading boot'.format(getpid()))
+                cfg = do(mem_cache.get('config'))
+                master_secret = None
+                if 'master.secret' in cfg['Agent']:
+                    master_secret = cfg['Agent']['master.secret'] + '.' + str(getpid())
+                BootSequence.go(True, master_secret)
+                with open(path_stamp, 'w') as stamp_f:
+                    stamp_f.write(codec.dumps({
+                        'boot.token': BootSequence.boot_token,
+                        'pid': getpid(),
+                        'master.secret': master_secret
+                    }))
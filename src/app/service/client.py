@@ -0,0 +1,114 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from app import codec
+from random import uniform
+
+import aiohttp
+import asyncio
+import logging
+
+
+class HTTPClient:
+    """
+    Async HTTP client on a keep-alive connection pool, retrying with exponential backoff and full jitter.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize on configuration; open no connections.
+
+        :param cfg: HTTP Client configuration section dict, e.g., {
+                'timeout': '10',
+                'connections.per.host': '8',
+                'backoff.base': '0.5',
+                'backoff.max': '10',
+                'keepalive.timeout': '15'
+            }
+        """
+
+        self._timeout = float(cfg.get('timeout', 10))
+        self._limit_per_host = int(cfg.get('connections.per.host', 8))
+        self._backoff_base = float(cfg.get('backoff.base', 0.5))
+        self._backoff_max = float(cfg.get('backoff.max', 10))
+        self._keepalive_timeout = float(cfg.get('keepalive.timeout', 15))
+        self._session = None
+
+    def session(self):
+        """
+        Return session, creating it on current event loop if need be.
+
+        :return: aiohttp client session
+        """
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self._limit_per_host,
+                    keepalive_timeout=self._keepalive_timeout),
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+                json_serialize=codec.dumps)
+        return self._session
+
+    def backoff(self, attempt):
+        """
+        Return seconds to wait before retrying after input (0-based) attempt: uniformly random up to
+        exponentially growing, capped bound.
+
+        :param attempt: attempt number
+        :return: seconds to wait
+        """
+
+        return uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+
+    async def request(self, method, url, json=None, attempts=1, raw=False, headers=None):
+        """
+        Send request and return its decoded json response. Retry on connection failure, timeout,
+        or HTTP 5xx, up to input number of attempts; raise the last such error on exhausting them,
+        or aiohttp.ClientResponseError at once on HTTP 4xx.
+
+        :param method: HTTP method
+        :param url: URL
+        :param json: body to json-encode, None for none
+        :param attempts: maximum number of attempts
+        :param raw: whether to return response body as text, without decoding json
+        :param headers: dict of extra request headers, None for none
+        :return: decoded json response, or response text if raw
+        """
+
+        logger = logging.getLogger(__name__)
+
+        for attempt in range(attempts):
+            try:
+                async with self.session().request(method, url, json=json, headers=headers) as resp:
+                    if resp.status < 500 or attempt == attempts - 1:
+                        resp.raise_for_status()
+                        return await (resp.text() if raw else resp.json(loads=codec.loads))
+                    logger.info('%s %s got HTTP %s on attempt %s/%s', method, url, resp.status, attempt + 1, attempts)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == attempts - 1:
+                    raise
+                logger.info('%s %s failed on attempt %s/%s: %r', method, url, attempt + 1, attempts, e)
+            await asyncio.sleep(self.backoff(attempt))
+
+    async def close(self):
+        """
+        Close session and its connections.
+        """
+
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,181 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+
+
+class LimitExceeded(Exception):
+    """
+    Admission control turned message away: caller should retry later.
+    """
+
+    def __init__(self, status, message, retry_after):
+        """
+        Initialize on HTTP status to report (429 for a message type at its limit, 503 for a server at capacity),
+        message, and seconds to advise caller to wait.
+
+        :param status: HTTP status
+        :param message: message
+        :param retry_after: retry-after seconds
+        """
+
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Gate:
+    """
+    Concurrency bound and queue on one message type.
+    """
+
+    def __init__(self, concurrency, queue):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+
+class _Slot:
+    """
+    Async context manager holding a place under limits for one message.
+    """
+
+    def __init__(self, limits, msg_type):
+        self._limits = limits
+        self._msg_type = msg_type
+
+    async def __aenter__(self):
+        await self._limits.acquire(self._msg_type)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._limits.release(self._msg_type)
+
+
+class Limits:
+    """
+    Admission control on POST message types: per-type concurrency bounds with bounded queues,
+    and a bound on all messages in process or queued. Messages beyond a bound fail fast rather than
+    pile up on the agent and wallet. GET routes (DID, health, stats) never take a place: rather than reserve
+    a share of the total for them, admission control leaves them out, so no POST load can crowd them out.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize on configuration.
+
+        :param cfg: Limits configuration section dict, e.g., {
+                'total': '256',
+                'default.concurrency': '32',
+                'default.queue': '128',
+                'verification-request.concurrency': '4',
+                'verification-request.queue': '32',
+                'retry.after': '1'
+            }
+        """
+
+        self._cfg = cfg
+        self._total = int(cfg.get('total', 256))
+        self._retry_after = int(cfg.get('retry.after', 1))
+        self._gates = {}  # built on first use, on the event loop that serves
+        self._pending = 0
+
+    def _gate(self, msg_type):
+        if msg_type not in self._gates:
+            self._gates[msg_type] = _Gate(
+                int(self._cfg.get('{}.concurrency'.format(msg_type), self._cfg.get('default.concurrency', 32))),
+                int(self._cfg.get('{}.queue'.format(msg_type), self._cfg.get('default.queue', 128))))
+        return self._gates[msg_type]
+
+    def slot(self, msg_type):
+        """
+        Return async context manager holding a place for message of input type, raising LimitExceeded on entry
+        if there is none.
+
+        :param msg_type: message type
+        :return: async context manager
+        """
+
+        return _Slot(self, msg_type)
+
+    async def acquire(self, msg_type):
+        """
+        Take place for message of input type, waiting in its queue if its type is at its concurrency bound;
+        raise LimitExceeded if the server is at capacity or the type's queue is full.
+
+        :param msg_type: message type
+        """
+
+        gate = self._gate(msg_type)
+        if self._pending >= self._total:
+            gate.rejected += 1
+            raise LimitExceeded(
+                503,
+                'Server at capacity ({} messages pending)'.format(self._pending),
+                self._retry_after)
+        if gate.semaphore.locked() and gate.waiting >= gate.queue:
+            gate.rejected += 1
+            raise LimitExceeded(
+                429,
+                'Too many {} messages ({} in process, {} queued)'.format(msg_type, gate.active, gate.waiting),
+                self._retry_after)
+
+        self._pending += 1
+        gate.waiting += 1
+        try:
+            await gate.semaphore.acquire()
+        except BaseException:
+            self._pending -= 1
+            raise
+        finally:
+            gate.waiting -= 1
+        gate.active += 1
+
+    def release(self, msg_type):
+        """
+        Give up place that acquire() took for message of input type.
+
+        :param msg_type: message type
+        """
+
+        gate = self._gates[msg_type]
+        gate.active -= 1
+        self._pending -= 1
+        gate.semaphore.release()
+
+    def stats(self):
+        """
+        Return total pending, and per-message-type bounds, counts in process and queued, and rejections.
+
+        :return: dict with total pending and dict mapping message type to stats
+        """
+
+        return {
+            'pending': self._pending,
+            'total': self._total,
+            'msg.types': {
+                t: {
+                    'concurrency': g.concurrency,
+                    'queue': g.queue,
+                    'active': g.active,
+                    'waiting': g.waiting,
+                    'rejected': g.rejected
+                } for (t, g) in self._gates.items()
+            }
+        }
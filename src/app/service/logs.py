@@ -0,0 +1,170 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from app import codec
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from multiprocessing import current_process
+from os import getpid
+from os.path import join as pjoin
+from queue import Queue
+from time import gmtime, strftime
+from weakref import WeakKeyDictionary
+
+import asyncio
+import logging
+
+
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+_context = WeakKeyDictionary()  # task to dict of fields for its log records
+
+CONTEXT_FIELDS = ('request_id', 'msg_type', 'status', 'duration')
+
+
+def bind(**fields):
+    """
+    Attach fields (from CONTEXT_FIELDS) to log records of current task from now on, e.g., request_id.
+
+    :param fields: fields and values
+    """
+
+    task = _current_task()
+    if task is not None:
+        _context.setdefault(task, {}).update(fields)
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Filter copying fields bound to current task into each log record, where the record does not set them
+    itself (as per logger call extra argument).
+    """
+
+    def filter(self, record):
+        try:
+            task = _current_task()
+        except RuntimeError:  # no event loop in this thread
+            task = None
+        for (k, v) in (_context.get(task, {}) if task is not None else {}).items():
+            if not hasattr(record, k):
+                setattr(record, k, v)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatter rendering each record as one json object per line: time, level, logger, pid, message,
+    and any context fields.
+    """
+
+    def format(self, record):
+        rv = {
+            'time': '{}.{:03d}Z'.format(strftime('%Y-%m-%dT%H:%M:%S', gmtime(record.created)), int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            rv['exc'] = record.exc_text
+        for field in CONTEXT_FIELDS:
+            if hasattr(record, field):
+                rv[field] = getattr(record, field)
+        return codec.dumps(rv)
+
+
+class _ProcessQueueHandler(QueueHandler):
+    """
+    Queue handler feeding a file handler on a background thread, so that callers only enqueue records and
+    never wait on disk. Threads do not survive fork: in a process forked after setup, the handler starts
+    its own queue and thread on first record, writing to a file of its own.
+    """
+
+    def __init__(self, open_target):
+        super().__init__(Queue())
+        self._open_target = open_target
+        self._pid = None
+        self._listener = None
+        self.start()
+
+    def start(self):
+        if self._listener is not None:
+            self._listener.stop()
+        self._pid = getpid()
+        self.queue = Queue()
+        self._listener = QueueListener(self.queue, self._open_target(), respect_handler_level=True)
+        self._listener.start()
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None  # tracebacks hold frames: keep text only
+        return record
+
+    def enqueue(self, record):
+        if self._pid != getpid():
+            self._listener = None  # parent's thread and file stay with parent
+            self.start()
+        super().enqueue(record)
+
+    def close(self):
+        if self._listener is not None and self._pid == getpid():
+            self._listener.stop()
+            self._listener = None
+        super().close()
+
+
+def init(dir_log, profile, cfg):
+    """
+    Set up logging to rotating file under input directory, through a queue drained on a background thread.
+    The main process logs to <profile>.log, any other (e.g., offload worker, forked web worker) to
+    <profile>.<pid>.log, so that no two processes rotate the same file.
+
+    :param dir_log: log directory
+    :param profile: agent profile
+    :param cfg: Logging configuration section dict, e.g., {
+            'level': 'INFO',
+            'format': 'json',
+            'max.bytes': '10485760',
+            'backups': '5'
+        }
+    """
+
+    root = logging.getLogger()
+    if any(isinstance(h, _ProcessQueueHandler) for h in root.handlers):
+        return
+
+    setup_pid = getpid()
+
+    def open_target():
+        rv = RotatingFileHandler(
+            pjoin(dir_log, '{}.log'.format(
+                profile if getpid() == setup_pid and current_process().name == 'MainProcess' else '{}.{}'.format(
+                    profile,
+                    getpid()))),
+            maxBytes=int(cfg.get('max.bytes', 10485760)),
+            backupCount=int(cfg.get('backups', 5)))
+        rv.setFormatter(JsonFormatter() if cfg.get('format', 'json') == 'json' else logging.Formatter(
+            '%(asctime)-15s | %(levelname)-8s | %(name)-12s | %(message)s',
+            '%Y-%m-%d %H:%M:%S'))
+        return rv
+
+    handler = _ProcessQueueHandler(open_target)
+    handler.addFilter(_ContextFilter())
+    root.addHandler(handler)
+    root.setLevel(cfg.get('level', 'INFO').upper())
@@ -0,0 +1,237 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bisect import bisect_left
+from time import monotonic
+
+import asyncio
+
+
+PREFIX = 'von_conx'
+
+
+def _labels(**labels):
+    """
+    Return Prometheus label set text for input labels, in sorted order.
+
+    :param labels: label names and values
+    :return: label set text, e.g., '{mode="native",msg_type="schema-lookup"}', empty for no labels
+    """
+
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for (k, v) in sorted(labels.items())))
+
+
+class Histogram:
+    """
+    Latency histogram: counts per bucket (upper bounds in seconds, overflow last), sum, and count.
+    """
+
+    def __init__(self, bounds):
+        """
+        Initialize on bucket upper bounds.
+
+        :param bounds: sorted list of bucket upper bounds
+        """
+
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Count value in its bucket.
+
+        :param value: value
+        """
+
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name, **labels):
+        """
+        Return Prometheus exposition lines for histogram, cumulative per bucket.
+
+        :param name: metric name
+        :param labels: labels
+        :return: list of lines
+        """
+
+        rv = []
+        cumulative = 0
+        for (bound, count) in zip([str(b) for b in self.bounds] + ['+Inf'], self.counts):
+            cumulative += count
+            rv.append('{}_bucket{} {}'.format(name, _labels(le=bound, **labels), cumulative))
+        rv.append('{}_sum{} {}'.format(name, _labels(**labels), self.sum))
+        rv.append('{}_count{} {}'.format(name, _labels(**labels), cumulative))
+        return rv
+
+
+class _Timer:
+    """
+    Context manager timing one message into metrics; caller may set mode and error code along the way.
+    """
+
+    def __init__(self, metrics, msg_type):
+        self._metrics = metrics
+        self.msg_type = msg_type
+        self.mode = 'native'
+        self.error_code = None
+
+    def __enter__(self):
+        self._start = monotonic()
+        self._metrics.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.in_flight -= 1
+        self._metrics.observe(self.msg_type, self.mode, monotonic() - self._start, self.error_code)
+
+
+class Metrics:
+    """
+    Process-local service metrics for export in Prometheus text format: message counts, error counts
+    by error code, latency histograms by message type and mode (native or by proxy), messages
+    in flight, and event loop lag. Recording costs a few dict operations per message.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize on configuration.
+
+        :param cfg: Metrics configuration section dict, e.g., {
+                'latency.buckets': '0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10',
+                'loop.interval': '1'
+            }
+        """
+
+        self._bounds = sorted(float(b) for b in cfg.get('latency.buckets', '0.01, 0.1, 1, 10').split(','))
+        self._loop_interval = float(cfg.get('loop.interval', 1))
+        self._requests = {}  # (msg_type, mode) to count
+        self._errors = {}  # (msg_type, error code) to count
+        self._latency = {}  # (msg_type, mode) to Histogram
+        self._loop_lag = Histogram(self._bounds)
+        self._loop_lag_last = 0.0
+        self._watch = None
+        self.in_flight = 0
+
+    def timer(self, msg_type):
+        """
+        Return context manager timing one message of input type.
+
+        :param msg_type: message type
+        :return: context manager, with settable mode ('native' or 'proxy') and error_code
+        """
+
+        return _Timer(self, msg_type)
+
+    def observe(self, msg_type, mode, elapsed, error_code=None):
+        """
+        Record one message.
+
+        :param msg_type: message type
+        :param mode: 'native' or 'proxy'
+        :param elapsed: seconds to respond
+        :param error_code: error code of response, None for success
+        """
+
+        key = (msg_type, mode)
+        self._requests[key] = self._requests.get(key, 0) + 1
+        if key not in self._latency:
+            self._latency[key] = Histogram(self._bounds)
+        self._latency[key].observe(elapsed)
+        if error_code is not None:
+            e_key = (msg_type, int(error_code))
+            self._errors[e_key] = self._errors.get(e_key, 0) + 1
+
+    def start(self):
+        """
+        Start watching event loop lag: how late a periodic sleep wakes up.
+        """
+
+        if self._watch is None:
+            self._watch = asyncio.ensure_future(self._watch_loop())
+
+    async def _watch_loop(self):
+        while True:
+            start = monotonic()
+            await asyncio.sleep(self._loop_interval)
+            self._loop_lag_last = max(0.0, monotonic() - start - self._loop_interval)
+            self._loop_lag.observe(self._loop_lag_last)
+
+    def close(self):
+        """
+        Stop watching event loop lag.
+        """
+
+        if self._watch is not None:
+            self._watch.cancel()
+            self._watch = None
+
+    def render(self, boot_phases=None):
+        """
+        Return metrics in Prometheus text exposition format.
+
+        :param boot_phases: dict mapping boot phase to its duration in seconds
+        :return: metrics text
+        """
+
+        lines = [
+            '# HELP {}_requests_total Messages processed, by message type and mode'.format(PREFIX),
+            '# TYPE {}_requests_total counter'.format(PREFIX)
+        ]
+        for ((msg_type, mode), count) in sorted(self._requests.items()):
+            lines.append('{}_requests_total{} {}'.format(PREFIX, _labels(msg_type=msg_type, mode=mode), count))
+
+        lines.extend([
+            '# HELP {}_errors_total Messages failed, by message type and error code'.format(PREFIX),
+            '# TYPE {}_errors_total counter'.format(PREFIX)
+        ])
+        for ((msg_type, error_code), count) in sorted(self._errors.items()):
+            lines.append('{}_errors_total{} {}'.format(
+                PREFIX,
+                _labels(msg_type=msg_type, error_code=error_code),
+                count))
+
+        lines.extend([
+            '# HELP {}_request_seconds Message latency, by message type and mode'.format(PREFIX),
+            '# TYPE {}_request_seconds histogram'.format(PREFIX)
+        ])
+        for ((msg_type, mode), histogram) in sorted(self._latency.items()):
+            lines.extend(histogram.lines('{}_request_seconds'.format(PREFIX), msg_type=msg_type, mode=mode))
+
+        lines.extend([
+            '# HELP {}_in_flight Messages in process'.format(PREFIX),
+            '# TYPE {}_in_flight gauge'.format(PREFIX),
+            '{}_in_flight {}'.format(PREFIX, self.in_flight),
+            '# HELP {}_event_loop_lag_last_seconds Event loop lag at last check'.format(PREFIX),
+            '# TYPE {}_event_loop_lag_last_seconds gauge'.format(PREFIX),
+            '{}_event_loop_lag_last_seconds {}'.format(PREFIX, self._loop_lag_last),
+            '# HELP {}_event_loop_lag_seconds Event loop lag over all checks'.format(PREFIX),
+            '# TYPE {}_event_loop_lag_seconds histogram'.format(PREFIX)
+        ])
+        lines.extend(self._loop_lag.lines('{}_event_loop_lag_seconds'.format(PREFIX)))
+
+        lines.extend([
+            '# HELP {}_boot_phase_seconds Boot sequence phase durations'.format(PREFIX),
+            '# TYPE {}_boot_phase_seconds gauge'.format(PREFIX)
+        ])
+        for (phase, seconds) in (boot_phases or {}).items():
+            lines.append('{}_boot_phase_seconds{} {}'.format(PREFIX, _labels(phase=phase), seconds))
+
+        return '\n'.join(lines) + '\n'
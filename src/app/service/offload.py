@@ -0,0 +1,345 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from indy.error import IndyError
+from itertools import count
+from multiprocessing import current_process, get_context
+from os import getpid
+from threading import Thread
+from time import time
+from von_agent.error import VonAgentError
+
+import asyncio
+import logging
+
+
+PROCESS_NAME = 'von_conx-offload'
+
+
+def is_offload_process():
+    """
+    Return whether current process is an offload worker; such processes import the app package
+    for its modules but boot their own agents and serve no HTTP.
+
+    :return: whether current process is an offload worker
+    """
+
+    return current_process().name.startswith(PROCESS_NAME)
+
+
+class OffloadFull(Exception):
+    """
+    Offload queue is full: caller should retry later.
+    """
+
+    pass
+
+
+class OffloadError(VonAgentError):
+    """
+    Agent in offload worker process raised an error, relayed by code and message.
+    """
+
+    def __str__(self):
+        return self.message
+
+
+def _serve(tasks, results, master_secret):
+    """
+    Offload worker process loop: open own pool and agent, then process forms until told to stop.
+
+    :param tasks: queue of (task id, form) pairs, None to stop
+    :param results: queue for (pid, task id) pairs on taking a task, then (task id, response json, error code,
+        error message) tuples on finishing it
+    :param master_secret: master secret label that parent agent uses, for HolderProver
+    """
+
+    from app import cfg
+    from app.cache import registry
+    from app.service.bootseq import BootSequence
+    from app.service.eventloop import do
+
+    logger = logging.getLogger(__name__)
+
+    cfg.init_config()
+    BootSequence.go(False, master_secret)
+    ag = registry.agent
+    logger.info('Offload worker {} serving'.format(current_process().name))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        (task_id, form) = task
+        results.put((getpid(), task_id))  # parent fails task if this process dies on it
+        try:
+            results.put((task_id, do(ag.process_post(form)), None, None))
+        except Exception as e:
+            logger.exception('Exception in offload worker on {}: {}'.format(form.get('type', None), e))
+            results.put((
+                task_id,
+                None,
+                int(e.error_code) if isinstance(e, (IndyError, VonAgentError)) else 400,
+                e.message if isinstance(e, VonAgentError) else str(e)))  # von_agent errors keep message off args
+
+    do(ag.close())
+    do(registry.pool.close())
+
+
+class Offload:
+    """
+    Bounded pool of worker processes, each with its own pool handle and agent, processing
+    the CPU-heavy message types that would otherwise stall the event loop.
+
+    Worker processes are spawned, not forked: libindy state does not survive fork. The event loop watches
+    each worker's sentinel: if a worker dies (e.g., on a crash in libindy, or an out-of-memory kill), its task
+    fails and a replacement spawns. A task that outlasts the configured timeout fails, and its worker, stuck
+    on it, is terminated and replaced.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize on configuration; do not start worker processes.
+
+        :param cfg: Offload configuration section dict, e.g., {
+                'processes': '2',
+                'msg.types': 'proof-request, verification-request',
+                'queue.max': '64',
+                'retry.after': '1',
+                'timeout': '120'
+            }
+        """
+
+        self._processes = int(cfg.get('processes', 0))
+        self._msg_types = {t.strip() for t in cfg.get('msg.types', '').split(',') if t.strip()}
+        self._queue_max = int(cfg.get('queue.max', 64))
+        self._retry_after = int(cfg.get('retry.after', 1))
+        self._timeout = float(cfg.get('timeout', 120))
+
+        self._ctx = None
+        self._master_secret = None
+        self._closed = False
+        self._procs = {}  # pid to (worker index, process)
+        self._taken = {}  # pid to task id it is processing
+        self._tasks = None
+        self._results = None
+        self._collector = None
+        self._loop = None
+        self._task_ids = count()
+        self._futures = {}  # task id to (future, msg_type, start time)
+        self._stats = {t: {'pending': 0, 'count': 0, 'errors': 0, 'rejected': 0, 'latency.total': 0.0,
+            'latency.max': 0.0} for t in self._msg_types}
+
+    @property
+    def retry_after(self):
+        """
+        Accessor for seconds to advise clients to wait when queue is full.
+
+        :return: retry-after seconds
+        """
+
+        return self._retry_after
+
+    def handles(self, msg_type):
+        """
+        Return whether offload is running and takes input message type.
+
+        :param msg_type: message type
+        :return: whether offload processes message type
+        """
+
+        return bool(self._procs) and msg_type in self._msg_types
+
+    def start(self, master_secret=None):
+        """
+        Spawn worker processes, if so configured, and start result collector thread.
+
+        :param master_secret: master secret label of parent agent, for HolderProver
+        """
+
+        logger = logging.getLogger(__name__)
+
+        if not (self._processes and self._msg_types) or self._procs:
+            return
+
+        self._ctx = get_context('spawn')
+        self._master_secret = master_secret
+        self._loop = asyncio.get_event_loop()
+        self._tasks = self._ctx.Queue()
+        self._results = self._ctx.SimpleQueue()  # writes synchronously: a notice is out before its task runs
+        for i in range(self._processes):
+            self._spawn(i)
+
+        self._collector = Thread(target=self._collect, name='{}-collector'.format(PROCESS_NAME), daemon=True)
+        self._collector.start()
+        logger.info('Offloading {} to {} worker processes'.format(', '.join(sorted(self._msg_types)), self._processes))
+
+    def _spawn(self, index):
+        """
+        Spawn worker process and watch for its exit.
+
+        :param index: worker index, for process name
+        """
+
+        if self._closed:
+            return
+        proc = self._ctx.Process(
+            target=_serve,
+            args=(self._tasks, self._results, self._master_secret),
+            name='{}-{}'.format(PROCESS_NAME, index),
+            daemon=True)
+        proc.start()
+        self._procs[proc.pid] = (index, proc)
+        self._loop.add_reader(proc.sentinel, self._exited, proc.pid)
+
+    def _exited(self, pid):
+        """
+        Fail task of worker process that exited, and spawn its replacement.
+
+        :param pid: process id of worker that exited
+        """
+
+        logger = logging.getLogger(__name__)
+
+        (index, proc) = self._procs.pop(pid)
+        self._loop.remove_reader(proc.sentinel)
+        proc.join()
+        task_id = self._taken.pop(pid, None)
+        logger.error('Offload worker {} (pid {}) exited with code {}{}'.format(
+            proc.name,
+            pid,
+            proc.exitcode,
+            '' if task_id is None else ' on task {}'.format(task_id)))
+        if task_id is not None:
+            self._resolve(task_id, None, 500, 'Offload worker exited with code {}'.format(proc.exitcode))
+        self._loop.call_later(self._retry_after, self._spawn, index)  # pace replacements of a worker that cannot boot
+
+    def _collect(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+            self._loop.call_soon_threadsafe(self._receive, result)
+
+    def _receive(self, result):
+        """
+        Record worker's taking a task, or resolve task on its result.
+
+        :param result: (pid, task id) pair on taking, (task id, response json, error code, message) tuple on result
+        """
+
+        if len(result) == 2:
+            (pid, task_id) = result
+            if pid in self._procs:
+                self._taken[pid] = task_id
+            else:  # worker died before its notice arrived
+                self._resolve(task_id, None, 500, 'Offload worker exited')
+            return
+        task_id = result[0]
+        for (pid, taken) in list(self._taken.items()):
+            if taken == task_id:
+                del self._taken[pid]
+        self._resolve(*result)
+
+    def _resolve(self, task_id, rv_json, error_code, message):
+        if task_id not in self._futures:
+            return  # timed out or failed already
+        (fut, msg_type, start) = self._futures.pop(task_id)
+        stats = self._stats[msg_type]
+        elapsed = time() - start
+        stats['pending'] -= 1
+        stats['count'] += 1
+        stats['latency.total'] += elapsed
+        stats['latency.max'] = max(stats['latency.max'], elapsed)
+        if fut.cancelled():
+            return
+        if error_code is None:
+            fut.set_result(rv_json)
+        else:
+            stats['errors'] += 1
+            fut.set_exception(OffloadError(error_code, message))
+
+    async def process_post(self, form):
+        """
+        Process form in a worker process and return its json response.
+
+        Raise OffloadFull if queue is full, OffloadError if worker's agent raises an error, or if the worker
+        dies or does not respond within the configured timeout (error code 500 or 504).
+
+        :param form: request form
+        :return: json response
+        """
+
+        stats = self._stats[form['type']]
+        if len(self._futures) >= self._queue_max:
+            stats['rejected'] += 1
+            raise OffloadFull('Offload queue is full ({} pending)'.format(len(self._futures)))
+
+        task_id = next(self._task_ids)
+        fut = self._loop.create_future()
+        self._futures[task_id] = (fut, form['type'], time())
+        stats['pending'] += 1
+        self._tasks.put((task_id, form))
+        try:
+            return await asyncio.wait_for(fut, self._timeout)
+        except asyncio.TimeoutError:
+            message = 'Offload worker did not respond within {} seconds'.format(self._timeout)
+            stats['errors'] += 1
+            self._resolve(task_id, None, 504, message)  # future is cancelled: only settles stats
+            for (pid, taken) in list(self._taken.items()):
+                if taken == task_id:
+                    self._procs[pid][1].terminate()  # stuck on task: sentinel watch replaces it
+            raise OffloadError(504, message)
+
+    def stats(self):
+        """
+        Return per-message-type queue depth and latency statistics.
+
+        :return: dict mapping message type to stats
+        """
+
+        return {
+            t: {
+                'pending': s['pending'],
+                'count': s['count'],
+                'errors': s['errors'],
+                'rejected': s['rejected'],
+                'latency.mean': s['latency.total'] / s['count'] if s['count'] else 0.0,
+                'latency.max': s['latency.max']
+            } for (t, s) in self._stats.items()
+        }
+
+    def close(self):
+        """
+        Stop worker processes and result collector.
+        """
+
+        if not self._procs:
+            return
+
+        self._closed = True
+        procs = [proc for (_, proc) in self._procs.values()]
+        for proc in procs:
+            self._loop.remove_reader(proc.sentinel)  # stop replacing workers
+        self._procs = {}
+        for _ in procs:
+            self._tasks.put(None)
+        for proc in procs:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+        self._results.put(None)
+        self._collector.join()
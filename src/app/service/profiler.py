@@ -0,0 +1,168 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from io import StringIO
+from os.path import basename
+
+import asyncio
+import cProfile
+import pstats
+import sys
+import threading
+
+
+class ProfilerBusy(Exception):
+    """
+    Profiler is already running a session.
+    """
+
+    pass
+
+
+class _Profiled:
+    """
+    Awaitable running a coroutine with a cProfile profile enabled only while the coroutine itself runs,
+    step by step, so that other coroutines interleaving on the event loop stay out of its stats.
+    """
+
+    def __init__(self, coro, profile):
+        self._coro = coro
+        self._profile = profile
+
+    def __await__(self):
+        it = self._coro.__await__()
+        (value, exc) = (None, None)
+        while True:
+            self._profile.enable()
+            try:
+                yielded = it.send(value) if exc is None else it.throw(exc)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self._profile.disable()
+            try:
+                (value, exc) = ((yield yielded), None)
+            except BaseException as e:
+                (value, exc) = (None, e)
+
+
+class Profiler:
+    """
+    On-demand profiling of the running process, one session at a time: a sampling profiler on the event loop
+    thread, reporting collapsed stacks (as flamegraph.pl and speedscope read), and cProfile stats over the
+    processing of one message type. Off a session, profiling costs a dict lookup per message.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize on configuration.
+
+        :param cfg: Profiler configuration section dict, e.g., {
+                'enabled': 'false',
+                'interval': '0.005',
+                'seconds.max': '60'
+            }
+        """
+
+        self.enabled = cfg.get('enabled', 'false').lower() in ('true', '1', 'yes')
+        self._interval = float(cfg.get('interval', 0.005))
+        self.seconds_max = float(cfg.get('seconds.max', 60))
+        self._busy = False
+        self._profiles = {}  # message type to cProfile profile, while in session
+
+    def _start(self):
+        if self._busy:
+            raise ProfilerBusy('Profiler is busy: try again when current session ends')
+        self._busy = True
+
+    async def sample(self, seconds):
+        """
+        Sample stacks of the event loop thread for input number of seconds and return them collapsed:
+        one line per distinct stack, frames root first separated by semicolons, then a space and sample count.
+
+        :param seconds: seconds to sample
+        :return: collapsed stacks text
+        """
+
+        self._start()
+        try:
+            loop_thread_id = threading.get_ident()
+            counts = {}
+            done = threading.Event()
+
+            def run():
+                while not done.wait(self._interval):
+                    frame = sys._current_frames().get(loop_thread_id, None)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append('{} ({}:{})'.format(code.co_name, basename(code.co_filename), code.co_firstlineno))
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
+
+            sampler = threading.Thread(target=run, name='profiler-sampler', daemon=True)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                done.set()
+                sampler.join()
+            return ''.join('{} {}\n'.format(stack, count) for (stack, count) in sorted(counts.items()))
+        finally:
+            self._busy = False
+
+    async def cprofile(self, msg_type, seconds, limit=50):
+        """
+        Profile processing of messages of input type with cProfile for input number of seconds and return
+        stats text, by cumulative time.
+
+        :param msg_type: message type
+        :param seconds: seconds to profile
+        :param limit: most functions to report
+        :return: stats text
+        """
+
+        self._start()
+        try:
+            profile = cProfile.Profile()
+            self._profiles[msg_type] = profile
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                self._profiles.pop(msg_type, None)
+
+            out = StringIO()
+            try:
+                pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(limit)
+            except TypeError:  # no message of the type arrived: stats are empty
+                out.write('No {} messages processed in {} seconds\n'.format(msg_type, seconds))
+            return out.getvalue()
+        finally:
+            self._busy = False
+
+    def run(self, msg_type, coro):
+        """
+        Return awaitable on input coroutine, processing message of input type: profiled if a session
+        is profiling its type, the coroutine itself otherwise.
+
+        :param msg_type: message type
+        :param coro: coroutine
+        :return: awaitable
+        """
+
+        profile = self._profiles.get(msg_type, None)
+        return coro if profile is None else _Profiled(coro, profile)
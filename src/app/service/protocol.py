@@ -0,0 +1,120 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from functools import lru_cache
+from os import walk
+from os.path import abspath, dirname, join as pjoin, relpath, splitext
+
+import json
+import re
+
+
+DIR_PROTO = pjoin(dirname(dirname(abspath(__file__))), 'protocol')
+
+_SLOT = re.compile('"%s"|%s')
+_SENTINEL = '\u0000slot:'
+
+
+class Template:
+    """
+    Protocol message template, compiled once from its json text with %s placeholders: "%s" for a string slot,
+    bare %s for a json value slot. Building fills slots positionally, from python values, into a fresh structure:
+    no text interpolation and no parse per message. Uses only the standard library, for test clients to load.
+    """
+
+    def __init__(self, text):
+        """
+        Compile template text.
+
+        :param text: template json text with %s placeholders
+        """
+
+        slots = []
+
+        def mark(m):
+            slots.append('str' if m.group(0) == '"%s"' else 'json')
+            return json.dumps('{}{}'.format(_SENTINEL, len(slots) - 1))
+
+        self._build = Template._compile(json.loads(_SLOT.sub(mark, text)))
+        self.slots = tuple(slots)
+
+    @staticmethod
+    def _compile(node):
+        """
+        Return function building fresh copy of input parsed template node from slot values.
+
+        :param node: parsed template node
+        :return: function on tuple of slot values
+        """
+
+        if isinstance(node, dict):
+            items = [(k, Template._compile(v)) for (k, v) in node.items()]
+            return lambda args: {k: build(args) for (k, build) in items}
+        if isinstance(node, list):
+            builds = [Template._compile(v) for v in node]
+            return lambda args: [build(args) for build in builds]
+        if isinstance(node, str) and node.startswith(_SENTINEL):
+            index = int(node[len(_SENTINEL):])
+            return lambda args: args[index]
+        return lambda args: node
+
+    def build(self, *args):
+        """
+        Return structure on template, filling slots with input values in order: strings for string slots,
+        any json-serializable values for json slots.
+
+        :param args: slot values
+        :return: structure, e.g., dict for protocol message form
+        """
+
+        if len(args) != len(self.slots):
+            raise ValueError('Template has {} slots but got {} values'.format(len(self.slots), len(args)))
+        return self._build(args)
+
+
+@lru_cache(maxsize=1)
+def templates():
+    """
+    Return registry of all protocol templates (app/protocol/**/*.json), loaded and compiled on first call.
+
+    :return: dict mapping template name (path from protocol directory, less .json), e.g., 'schema-lookup'
+        or 'schema-send/bc-reg/1.0/attr-names', to Template
+    """
+
+    rv = {}
+    for (dir_path, _, file_names) in walk(DIR_PROTO):
+        for file_name in file_names:
+            (name, ext) = splitext(file_name)
+            if ext == '.json':
+                with open(pjoin(dir_path, file_name), 'r') as proto_f:
+                    rv[relpath(pjoin(dir_path, name), DIR_PROTO).replace('\\', '/')] = Template(proto_f.read())
+    return rv
+
+
+def form(name, *args, proxy_did=None):
+    """
+    Return protocol message form (or other structure) on named template, filling its slots with input values.
+
+    :param name: template name, e.g., 'schema-lookup'
+    :param args: slot values
+    :param proxy_did: proxy DID to set on form data, None for none
+    :return: structure on template
+    """
+
+    rv = templates()[name].build(*args)
+    if proxy_did:
+        rv['data']['proxy-did'] = proxy_did
+    return rv
@@ -0,0 +1,169 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from app import codec
+from app.service.client import HTTPClient
+from bisect import bisect_left
+from collections import OrderedDict
+from time import monotonic
+from urllib.parse import urlsplit
+from von_agent.error import ProxyHop
+
+import aiohttp
+import asyncio
+import logging
+import re
+
+
+class Relay:
+    """
+    Relay of protocol messages to other agents by proxy DID, in place of von_agent's own relay, which
+    blocks the event loop on a fresh connection per hop. Relay requests go over keep-alive connection
+    pools per peer endpoint; relay keeps a latency histogram per peer, and passes trace context on to the peer.
+    """
+
+    def __init__(self, cfg, ledger_cache, tracer):
+        """
+        Initialize on configuration, ledger cache to resolve endpoints through, and tracer; open no connections.
+
+        :param cfg: Relay configuration section dict, e.g., {
+                'timeout': '30',
+                'connections.per.host': '16',
+                'keepalive.timeout': '60',
+                'latency.buckets': '0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30'
+            }
+        :param ledger_cache: LedgerCache
+        :param tracer: Tracer
+        """
+
+        self._client = HTTPClient(cfg)
+        self._ledger_cache = ledger_cache
+        self._tracer = tracer
+        self._buckets = sorted(float(b) for b in cfg.get('latency.buckets', '0.01, 0.1, 1, 10').split(','))
+        self._peers = {}  # peer netloc to counts per bucket (last for overflow), errors, latency total
+
+    @staticmethod
+    def proxied(ag, form):
+        """
+        Return whether form's proxy DID names another agent, for relay.
+
+        :param ag: agent
+        :param form: request form
+        :return: whether to relay form
+        """
+
+        data = form.get('data', None)
+        return isinstance(data, dict) and data.get('proxy-did', ag.did) != ag.did
+
+    async def endpoint(self, ag, did):
+        """
+        Return endpoint for agent with input DID; raise ProxyHop if it has none over HTTP.
+
+        :param ag: agent to look up endpoint
+        :param did: DID of agent
+        :return: endpoint URL
+        """
+
+        endpoint = codec.loads(await self._ledger_cache.process_post(
+            {
+                'type': 'agent-endpoint-lookup',
+                'data': {
+                    'agent-endpoint': {
+                        'did': did
+                    }
+                }
+            },
+            ag.process_post))
+        if not re.match('^http[s]?://.*', endpoint.get('endpoint', ''), re.IGNORECASE):
+            raise ProxyHop('No agent on the ledger has DID {} at an HTTP endpoint'.format(did))
+        return endpoint['endpoint']
+
+    async def post(self, ag, form, parent=None):
+        """
+        Relay form to agent with its proxy DID, less proxy DID, and return its json response as is.
+        If tracing, send trace context in traceparent header for the peer to continue the trace.
+
+        :param ag: relaying agent
+        :param form: form with proxy DID
+        :param parent: span to relay under, e.g., request's span where ledger cache runs relay in a task of its own;
+            None for current span of current task
+        :return: json response
+        """
+
+        logger = logging.getLogger(__name__)
+
+        data = dict(form['data'])
+        proxy_did = data.pop('proxy-did')
+        with self._tracer.span('relay', parent=parent) as span:
+            url = '{}/{}'.format(await self.endpoint(ag, proxy_did), form['type'])
+            peer = urlsplit(url).netloc
+            span.set('peer', peer)
+            start = monotonic()
+            try:
+                rv = await self._client.request(
+                    'POST',
+                    url,
+                    json=dict(form, data=data),
+                    raw=True,
+                    headers=span.headers())
+                self._observe(peer, monotonic() - start, False)
+                return rv
+            except aiohttp.ClientResponseError as e:
+                self._observe(peer, monotonic() - start, True)
+                raise ProxyHop('Proxy {} got HTTP {}'.format(url, e.status))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._observe(peer, monotonic() - start, True)
+                logger.warning('Relay to %s failed: %r', url, e)
+                raise ProxyHop('Proxy {} unreachable: {}'.format(url, repr(e)))
+
+    def _observe(self, peer, elapsed, error):
+        if peer not in self._peers:
+            self._peers[peer] = {'buckets': [0] * (len(self._buckets) + 1), 'errors': 0, 'latency.total': 0.0}
+        stats = self._peers[peer]
+        stats['buckets'][bisect_left(self._buckets, elapsed)] += 1
+        stats['latency.total'] += elapsed
+        if error:
+            stats['errors'] += 1
+
+    def stats(self):
+        """
+        Return per-peer relay statistics: count, errors, total latency, and cumulative latency histogram
+        mapping each bucket upper bound in seconds ('+Inf' last) to count of relays within it.
+
+        :return: dict mapping peer netloc to stats
+        """
+
+        rv = {}
+        for (peer, stats) in self._peers.items():
+            cumulative = 0
+            histogram = OrderedDict()
+            for (bound, count) in zip([str(b) for b in self._buckets] + ['+Inf'], stats['buckets']):
+                cumulative += count
+                histogram[bound] = cumulative
+            rv[peer] = {
+                'count': cumulative,
+                'errors': stats['errors'],
+                'latency.total': stats['latency.total'],
+                'latency.histogram': histogram
+            }
+        return rv
+
+    async def close(self):
+        """
+        Close HTTP client and its connections.
+        """
+
+        await self._client.close()
@@ -0,0 +1,244 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from app import codec
+from binascii import hexlify
+from os import environ, getpid, makedirs, urandom
+from os.path import abspath, dirname, join as pjoin
+from queue import Full, Queue
+from random import random
+from threading import Thread
+from time import monotonic, time
+from weakref import WeakKeyDictionary
+
+import asyncio
+import re
+import sys
+
+
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+
+def _hex_id(n_bytes):
+    return hexlify(urandom(n_bytes)).decode()
+
+
+class _NoSpan:
+    """
+    Span that records nothing, for untraced requests.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def set(self, key, value):
+        pass
+
+    def headers(self):
+        return {}
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    """
+    Timed, named operation in a trace; current span of its task while open.
+    """
+
+    def __init__(self, tracer, name, trace_id, parent_id):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _hex_id(8)
+        self.parent_id = parent_id
+        self.attrs = {}
+
+    def __enter__(self):
+        self._task = _current_task()
+        self._outer = self._tracer._active.get(self._task, None) if self._task else None
+        if self._task:
+            self._tracer._active[self._task] = self
+        self.start = time()
+        self._t0 = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = monotonic() - self._t0
+        if exc_type is not None:
+            self.attrs['error'] = repr(exc)
+        if self._task:
+            if self._outer is None:
+                self._tracer._active.pop(self._task, None)
+            else:
+                self._tracer._active[self._task] = self._outer
+        self._tracer._export(self)
+
+    def set(self, key, value):
+        """
+        Set span attribute.
+
+        :param key: attribute name
+        :param value: attribute value, json-serializable
+        """
+
+        self.attrs[key] = value
+
+    def headers(self):
+        """
+        Return HTTP headers propagating trace, with this span as parent, to a downstream agent.
+
+        :return: dict with W3C traceparent header
+        """
+
+        return {'traceparent': '00-{}-{}-01'.format(self.trace_id, self.span_id)}
+
+
+class Tracer:
+    """
+    Opt-in request tracing: a root span per request, child spans around the work under it, trace context
+    propagated to other agents on relay by the W3C traceparent header, and finished spans written as json lines
+    to a local file or stdout, to follow one request across the proxy hop by its trace id.
+
+    Finished spans go through a bounded queue to a writer thread, which encodes and writes them, so the event
+    loop never waits on the file; spans finishing while the queue is full are dropped and counted. As with
+    logging, the thread does not survive fork: each process starts its own on its first span.
+
+    Disabled, span() returns a shared no-op span.
+    """
+
+    QUEUE_MAX = 8192
+
+    TRACEPARENT = re.compile('^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+    def __init__(self, cfg):
+        """
+        Initialize on configuration.
+
+        :param cfg: Tracing configuration section dict, e.g., {
+                'enabled': 'true',
+                'sample': '0.1',
+                'export': 'file'
+            }; export 'file' writes to app/log/<profile>.trace.jsonl, 'stdout' to standard output
+        """
+
+        self.enabled = cfg.get('enabled', 'false').lower() in ('true', '1', 'yes')
+        self._sample = float(cfg.get('sample', 1))
+        self._export_to = cfg.get('export', 'file')
+        self._queue = None
+        self._writer = None
+        self._pid = None
+        self.dropped = 0  # spans dropped on full queue
+        self._active = WeakKeyDictionary()  # task to its current span
+
+    def current(self):
+        """
+        Return current span of current task, no-op span for none: for a task that the current task spawns
+        (e.g., a single-flight lookup) to pass as parent to span(), since spans follow tasks.
+
+        :return: span or no-op span
+        """
+
+        task = _current_task() if self.enabled else None
+        return self._active.get(task, NO_SPAN) if task else NO_SPAN
+
+    def span(self, name, root=False, traceparent=None, parent=None):
+        """
+        Return span to open (as context manager) under parent span, by default the current span of current task.
+        With none, start a trace only for a root span: continuing input traceparent if it is sampled, otherwise
+        by sample rate.
+
+        :param name: span name
+        :param root: whether span may start a trace
+        :param traceparent: traceparent header from upstream agent, None for none
+        :param parent: parent span, e.g., from current() in another task; None for current span of current task
+        :return: span, or no-op span if not tracing
+        """
+
+        if not self.enabled:
+            return NO_SPAN
+        if parent is None:
+            task = _current_task()
+            parent = self._active.get(task, None) if task else None
+        if parent is not None and parent is not NO_SPAN:
+            return _Span(self, name, parent.trace_id, parent.span_id)
+        if not root:
+            return NO_SPAN
+
+        m = Tracer.TRACEPARENT.match(traceparent or '')
+        if m:
+            return _Span(self, name, m.group(1), m.group(2)) if int(m.group(3), 16) & 1 else NO_SPAN
+        return _Span(self, name, _hex_id(16), None) if random() < self._sample else NO_SPAN
+
+    def _open(self):
+        if self._export_to == 'stdout':
+            return sys.stdout
+        dir_log = pjoin(dirname(dirname(abspath(__file__))), 'log')
+        makedirs(dir_log, exist_ok=True)
+        return open(
+            pjoin(dir_log, '{}.trace.jsonl'.format(environ.get('AGENT_PROFILE', 'trust-anchor'))),
+            'a',
+            buffering=1)
+
+    def _write(self, queue):
+        """
+        Writer thread: open output and write spans from queue as json lines until None.
+
+        :param queue: queue of span record dicts, then None
+        """
+
+        out = self._open()
+        try:
+            for record in iter(queue.get, None):
+                out.write(codec.dumps(record) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+    def _export(self, span):
+        if self._pid != getpid():  # first span in this process: parent's writer thread, if any, stays with parent
+            self._pid = getpid()
+            self._queue = Queue(Tracer.QUEUE_MAX)
+            self._writer = Thread(target=self._write, args=(self._queue,), name='trace-writer', daemon=True)
+            self._writer.start()
+        try:
+            self._queue.put_nowait({
+                'trace': span.trace_id,
+                'span': span.span_id,
+                'parent': span.parent_id,
+                'name': span.name,
+                'start': span.start,
+                'duration': span.duration,
+                'pid': self._pid,
+                'attrs': span.attrs
+            })
+        except Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Write out queued spans, stop writer thread, and close trace file, if any.
+        """
+
+        if self._writer is not None and self._pid == getpid():
+            self._queue.put(None)
+            self._writer.join()
+        self._queue = None
+        self._writer = None
+        self._pid = None
@@ -0,0 +1,308 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from os import makedirs
+from os.path import abspath, dirname, join as pjoin
+from time import time
+
+import sqlite3
+
+
+class LedgerStore:
+    """
+    Persistent local store of ledger artifacts that the boot sequence needs: nyms and endpoints by DID,
+    schemata by schema key, claim defs by schema sequence number and issuer DID. Each artifact
+    is the json that the agent got from (or wrote to) the ledger. Callers may pass the store between
+    threads (e.g., boot opens it, verification hands it to an executor), using it from one at a time.
+    """
+
+    dir_store = pjoin(dirname(abspath(__file__)), 'store')
+
+    def __init__(self, name):
+        """
+        Open (creating as need be) store file for input name.
+
+        :param name: store name, e.g., pool name
+        """
+
+        makedirs(LedgerStore.dir_store, exist_ok=True)
+        self._conn = sqlite3.connect(
+            pjoin(LedgerStore.dir_store, '{}.sqlite'.format(name)),
+            timeout=30,
+            check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS artifact ('
+                'kind TEXT NOT NULL, key TEXT NOT NULL, json TEXT NOT NULL, updated REAL NOT NULL, '
+                'PRIMARY KEY (kind, key))')
+
+    @staticmethod
+    def schema_key(origin_did, name, version):
+        """
+        Return store key for schema.
+
+        :param origin_did: origin DID
+        :param name: schema name
+        :param version: schema version
+        :return: store key
+        """
+
+        return '{}:{}:{}'.format(origin_did, name, version)
+
+    @staticmethod
+    def claim_def_key(schema_seq_no, issuer_did):
+        """
+        Return store key for claim def.
+
+        :param schema_seq_no: schema sequence number
+        :param issuer_did: issuer DID
+        :return: store key
+        """
+
+        return '{}:{}'.format(schema_seq_no, issuer_did)
+
+    def get(self, kind, key):
+        """
+        Return stored json for artifact kind ('nym', 'endpoint', 'schema', 'claim-def') and key, None for none.
+
+        :param kind: artifact kind
+        :param key: artifact key
+        :return: artifact json or None
+        """
+
+        row = self._conn.execute('SELECT json FROM artifact WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return row[0] if row else None
+
+    def put(self, kind, key, value_json):
+        """
+        Store json for artifact kind and key.
+
+        :param kind: artifact kind
+        :param key: artifact key
+        :param value_json: artifact json
+        """
+
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO artifact (kind, key, json, updated) VALUES (?, ?, ?, ?)',
+                (kind, key, value_json, time()))
+
+    def items(self, kind):
+        """
+        Return list of (key, json) pairs stored for artifact kind.
+
+        :param kind: artifact kind
+        :return: list of (key, json) pairs
+        """
+
+        return self._conn.execute('SELECT key, json FROM artifact WHERE kind = ?', (kind,)).fetchall()
+
+    def clear(self):
+        """
+        Remove all stored artifacts.
+        """
+
+        with self._conn:
+            self._conn.execute('DELETE FROM artifact')
+
+    def close(self):
+        """
+        Close store file.
+        """
+
+        self._conn.close()
+
+
+class IssueStore:
+    """
+    Persistent store of bulk issuance jobs, for progress reports and resumption after a crash: per job,
+    its schema, holder DID, claim request (once the holder returns it), status, and owning process id;
+    per item, its claim attributes and, once processed, its status, error code, and message. Open it in the
+    process (and on the thread) that uses it.
+    """
+
+    def __init__(self, name):
+        """
+        Open (creating as need be) store file for input name.
+
+        :param name: store name, e.g., agent profile
+        """
+
+        makedirs(LedgerStore.dir_store, exist_ok=True)
+        self._conn = sqlite3.connect(pjoin(LedgerStore.dir_store, '{}.issue.sqlite'.format(name)), timeout=30)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS job ('
+                'id TEXT PRIMARY KEY, schema TEXT NOT NULL, holder_did TEXT NOT NULL, claim_req TEXT, '
+                'status TEXT NOT NULL, message TEXT, owner INTEGER, created REAL NOT NULL, updated REAL NOT NULL)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS item ('
+                'job_id TEXT NOT NULL, idx INTEGER NOT NULL, attrs TEXT NOT NULL, '
+                'status INTEGER, error_code INTEGER, message TEXT, PRIMARY KEY (job_id, idx))')
+
+    def create(self, job_id, schema_json, holder_did, attrs_jsons, owner):
+        """
+        Store new running job and its pending items; return False if job id is taken.
+
+        :param job_id: job id
+        :param schema_json: schema key specifier json
+        :param holder_did: holder DID
+        :param attrs_jsons: claim attributes json per item, in order
+        :param owner: process id to run job
+        :return: whether job is new
+        """
+
+        now = time()
+        try:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT INTO job (id, schema, holder_did, status, owner, created, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, schema_json, holder_did, 'running', owner, now, now))
+                self._conn.executemany(
+                    'INSERT INTO item (job_id, idx, attrs) VALUES (?, ?, ?)',
+                    ((job_id, idx, attrs_json) for (idx, attrs_json) in enumerate(attrs_jsons)))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def job(self, job_id):
+        """
+        Return job row as dict, None for no such job.
+
+        :param job_id: job id
+        :return: dict on keys id, schema, holder_did, claim_req, status, message, owner, created, updated
+        """
+
+        cursor = self._conn.execute('SELECT * FROM job WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        return dict(zip((d[0] for d in cursor.description), row)) if row else None
+
+    def running(self):
+        """
+        Return list of (job id, owner process id) pairs for running jobs.
+
+        :return: list of (job id, owner) pairs
+        """
+
+        return self._conn.execute(
+            'SELECT id, owner FROM job WHERE status = ? ORDER BY created',
+            ('running',)).fetchall()
+
+    def adopt(self, job_id, owner, new_owner):
+        """
+        Take over running job from its (defunct) owner; return False if another process took it first.
+
+        :param job_id: job id
+        :param owner: owner process id as caller read it
+        :param new_owner: process id to take over
+        :return: whether new owner has the job
+        """
+
+        with self._conn:
+            return self._conn.execute(
+                'UPDATE job SET owner = ?, updated = ? WHERE id = ? AND owner IS ? AND status = ?',
+                (new_owner, time(), job_id, owner, 'running')).rowcount == 1
+
+    def set_claim_req(self, job_id, claim_req_json):
+        """
+        Store claim request that the holder returned for the job's claim offer.
+
+        :param job_id: job id
+        :param claim_req_json: claim request json
+        """
+
+        with self._conn:
+            self._conn.execute(
+                'UPDATE job SET claim_req = ?, updated = ? WHERE id = ?',
+                (claim_req_json, time(), job_id))
+
+    def finish(self, job_id, status, message=None):
+        """
+        Set final job status.
+
+        :param job_id: job id
+        :param status: 'done' or 'failed'
+        :param message: failure message, None for none
+        """
+
+        with self._conn:
+            self._conn.execute(
+                'UPDATE job SET status = ?, message = ?, updated = ? WHERE id = ?',
+                (status, message, time(), job_id))
+
+    def pending(self, job_id):
+        """
+        Return list of (index, attributes json) pairs for job items not yet processed, in order.
+
+        :param job_id: job id
+        :return: list of (index, attributes json) pairs
+        """
+
+        return self._conn.execute(
+            'SELECT idx, attrs FROM item WHERE job_id = ? AND status IS NULL ORDER BY idx',
+            (job_id,)).fetchall()
+
+    def record(self, job_id, idx, status, error_code=None, message=None):
+        """
+        Record result of processing job item.
+
+        :param job_id: job id
+        :param idx: item index
+        :param status: HTTP status, 200 for success
+        :param error_code: error code on failure
+        :param message: error message on failure
+        """
+
+        with self._conn:
+            self._conn.execute(
+                'UPDATE item SET status = ?, error_code = ?, message = ? WHERE job_id = ? AND idx = ?',
+                (status, error_code, message, job_id, idx))
+
+    def counts(self, job_id):
+        """
+        Return item counts for job: total, succeeded, failed.
+
+        :param job_id: job id
+        :return: (total, succeeded, failed) tuple
+        """
+
+        return self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(status = 200), 0), COALESCE(SUM(status != 200), 0) '
+            'FROM item WHERE job_id = ?',
+            (job_id,)).fetchone()
+
+    def results(self, job_id, start=0, limit=-1):
+        """
+        Return list of (index, status, error code, message) tuples for processed job items, in order.
+
+        :param job_id: job id
+        :param start: least item index to report
+        :param limit: most items to report, -1 for all
+        :return: list of (index, status, error code, message) tuples
+        """
+
+        return self._conn.execute(
+            'SELECT idx, status, error_code, message FROM item '
+            'WHERE job_id = ? AND idx >= ? AND status IS NOT NULL ORDER BY idx LIMIT ?',
+            (job_id, start, limit)).fetchall()
+
+    def close(self):
+        """
+        Close store file.
+        """
+
+        self._conn.close()
@@ -0,0 +1,56 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from copy import deepcopy
+from functools import lru_cache
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match
+from von_agent.error import JSONValidation
+from von_agent.proto.validate import PROTO_MSG_JSON_SCHEMA
+
+
+@lru_cache(maxsize=None)
+def validator(msg_type):
+    """
+    Return validator for protocol message type, on its schema checked and compiled once. The schema for
+    claim-request also admits the claim selection ('select') that von_conx applies itself.
+
+    :param msg_type: message type
+    :return: jsonschema Draft4Validator
+    """
+
+    schema = PROTO_MSG_JSON_SCHEMA[msg_type]
+    if msg_type == 'claim-request':
+        schema = deepcopy(schema)
+        schema['properties']['select'] = {'type': 'object'}  # ClaimSelection checks its content
+    Draft4Validator.check_schema(schema)
+    return Draft4Validator(schema)
+
+
+def validate(form):
+    """
+    Raise JSONValidation, naming path to offending value, if form does not comply with protocol message schema
+    for its type (which caller has checked). Von_agent validates again, but rechecks its schema on every call:
+    this way, a bad form fails fast without touching the agent.
+
+    :param form: request form
+    """
+
+    error = best_match(validator(form['type']).iter_errors(form))
+    if error is not None:
+        raise JSONValidation('JSON validation error at {}: {}'.format(
+            '/'.join(str(p) for p in error.absolute_path) or '(form)',
+            error.message))
@@ -15,25 +15,37 @@ limitations under the License.
 """
 
 
-import json
+import asyncio
 import logging
 
-from app import app
-from app.cache import mem_cache
-from app.model import is_native, offers, openapi_model
+from app import app, claim_index, codec, ledger_cache, limits, metrics, offload, profiler, relay, tracer
+from app.admission import READ_ONLY, Rejection, admit, msg_type_of, readiness
+from app.cache import mem_cache, registry
+from app.claims import ClaimSelection
+from app.issue import BulkIssue
+from app.model import capabilities, openapi_model
+from app.service.bootseq import BootSequence
+from app.service import logs
 from app.service.eventloop import do
+from app.service.limits import LimitExceeded
+from app.service.offload import OffloadFull
+from app.service.profiler import ProfilerBusy
+from app.service.relay import Relay
+from app.validate import validate, validator
+from functools import lru_cache, partial
 from indy.error import IndyError
 from os import environ
-from von_agent.agents import AgentRegistrar, Origin, Issuer, HolderProver, Verifier
-from von_agent.error import VonAgentError
+from time import monotonic
+from uuid import uuid4
+from von_agent.agents import HolderProver
+from von_agent.error import ErrorCode, JSONValidation, VonAgentError
 from sanic import response
-from sanic_openapi import doc, openapi_blueprint, swagger_blueprint
+from sanic_openapi import doc, openapi, swagger_blueprint
 
 
 logger = logging.getLogger(__name__)
 
 
-app.blueprint(openapi_blueprint)
 app.blueprint(swagger_blueprint)
 app.config.API_VERSION = '1.0.0'
 app.config.API_TITLE = 'von_conx'
@@ -42,8 +54,43 @@ app.config.API_PRODUCES_CONTENT_TYPES = ['application/json']
 app.config.API_CONTACT_EMAIL = 'stephen.klump@becker-carroll.com'
 app.config.API_LICENSE_URL = 'http://www.apache.org/licenses/LICENSE-2.0'
 
-agent = do(mem_cache.get('agent'))
+agent_cls = registry.agent_class
 profile = environ.get('AGENT_PROFILE', 'trust-anchor')
+matrix = capabilities(agent_cls)
+for msg_type in (t for t in matrix if matrix[t]['offered']):
+    validator(msg_type)  # compile schema validators once, up front
+
+INDEXED = ('claim-request', 'proof-request')  # HolderProver serves on claim index, unless offloaded
+
+batch_cfg = do(mem_cache.get('config')).get('Batch', {})
+batch_concurrency = int(batch_cfg.get('concurrency', 8))
+batch_size_max = int(batch_cfg.get('size.max', 1000))
+
+
+def json_response(rv_json, status=200):
+    """
+    Return response writing agent's (already serialized) JSON straight to body, without re-parsing it.
+
+    Agent output is json.dumps() output or relayed proxy output, so only check its leading token;
+    anything unexpected takes the old decode-and-encode path, which raises on invalid JSON.
+
+    :param rv_json: JSON string from agent
+    :param status: HTTP status code
+    :return: sanic response
+    """
+
+    return response.HTTPResponse(json_body(rv_json), status=status, content_type='application/json')
+
+
+def json_body(rv_json):
+    """
+    Return agent's JSON as is if it starts with a JSON object, array, or string token, re-encoded otherwise.
+
+    :param rv_json: JSON string from agent
+    :return: JSON string
+    """
+
+    return rv_json if rv_json[:1] in ('{', '[', '"') else codec.dumps(codec.loads(rv_json))
 
 
 @app.get('/api/v0/did')
@@ -51,10 +98,27 @@ profile = environ.get('AGENT_PROFILE', 'trust-anchor')
 @doc.produces(str)
 @doc.tag('{} as Base Agent'.format(profile))
 async def did(request):
-    logger.debug('Processing GET {}'.format(request.url))
-    ag = await mem_cache.get('agent')
+    logger.debug('Processing GET %s', request.url)
+    ag = registry.agent
     rv_json = await ag.process_get_did()
-    return response.json(json.loads(rv_json))
+    return json_response(rv_json)
+
+
+@app.get('/api/v0/live')
+@doc.summary('Returns whether service is up, whether or not agent has completed registration')
+@doc.produces(dict)
+@doc.tag('{} as Base Agent'.format(profile))
+async def live(request):
+    return response.json({'live': True}, dumps=codec.dumps)
+
+
+@app.get('/api/v0/ready')
+@doc.summary('Returns whether agent has completed registration and serves all routes (HTTP 503 if not)')
+@doc.produces(dict)
+@doc.tag('{} as Base Agent'.format(profile))
+async def ready(request):
+    (body, status) = readiness(registry.status)
+    return response.json(body, status=status, dumps=codec.dumps)
 
 
 @app.get('/api/v0/txn/<seq_no:int>')
@@ -62,223 +126,579 @@ async def did(request):
 @doc.produces(dict)
 @doc.tag('{} as Base Agent'.format(profile))
 async def txn(request, seq_no):
-    logger.debug('Processing GET {}'.format(request.url))
-    ag = await mem_cache.get('agent')
+    logger.debug('Processing GET %s', request.url)
+    ag = registry.agent
     rv_json = await ag.process_get_txn(seq_no)
-    return response.json(json.loads(rv_json))
+    return json_response(rv_json)
 
 
-def cond_deco(deco, cond):
-    def rd(f):
-        return deco(f) if cond else f
-    return rd
+@app.get('/api/v0/offload')
+@doc.summary('Returns queue depth and latency for message types offloaded to worker processes')
+@doc.produces(dict)
+@doc.tag('{} as Base Agent'.format(profile))
+async def offload_stats(request):
+    return response.json(offload.stats(), dumps=codec.dumps)
 
 
-async def _process_post(request):
-    logger.debug('Processing POST {}, request body {}'.format(request.url, request.body))
-    ag = await mem_cache.get('agent')
-    try:
-        form = request.json
-        rv_json = await ag.process_post(form)
-        return response.json(json.loads(rv_json))
-    except Exception as e:
-        logger.exception('Exception on {}: {}'.format(request.path, e))
-        # import traceback
-        # traceback.print_exc()
-        return response.json(
-            {
-                'error-code': int(e.error_code) if isinstance(e, (IndyError, VonAgentError)) else 400,
-                'message': str(e)
-            },
-            status=400)
-    finally:
-        await mem_cache.set('agent', ag)  #  in case agent state changes over process_post
-
-
-@app.post('/api/v0/agent-nym-lookup')
-@doc.summary('Lookup agent nym on ledger by DID')
-@doc.consumes(openapi_model(agent, 'agent-nym-lookup'), location='body')
+@app.get('/api/v0/ledger-cache')
+@doc.summary('Returns hit and miss counts for ledger lookup read-through cache')
 @doc.produces(dict)
 @doc.tag('{} as Base Agent'.format(profile))
-async def process_post_agent_nym_lookup(request):
-    return await _process_post(request)
-
+async def ledger_cache_stats(request):
+    return response.json(ledger_cache.stats(), dumps=codec.dumps)
 
-@cond_deco(app.post('/api/v0/agent-nym-send'), offers(agent, 'agent-nym-send'))
-@cond_deco(doc.summary('Send agent nym to ledger'), offers(agent, 'agent-nym-send'))
-@cond_deco(doc.consumes(openapi_model(agent, 'agent-nym-send'), location='body'), offers(agent, 'agent-nym-send'))
-@cond_deco(doc.produces(dict), offers(agent, 'agent-nym-send'))
-@cond_deco(
-    doc.tag('{} as Trust Anchor{}'.format(profile, '' if is_native(agent, 'agent-nym-send') else ' by Proxy')),
-    offers(agent, 'agent-nym-send'))
-async def process_post_agent_nym_send(request):
-    return await _process_post(request)
 
+@app.get('/metrics')
+@doc.summary('Returns service metrics in Prometheus text format')
+@doc.produces(str)
+@doc.tag('{} as Base Agent'.format(profile))
+async def metrics_text(request):
+    return response.text(
+        metrics.render(BootSequence.phases),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
-@app.post('/api/v0/agent-endpoint-lookup')
-@doc.summary('Lookup agent endpoint on ledger by DID')
-@doc.consumes(openapi_model(agent, 'agent-endpoint-lookup'), location='body')
+@app.get('/api/v0/limits')
+@doc.summary('Returns admission control bounds, and messages in process, queued, and rejected per message type')
 @doc.produces(dict)
 @doc.tag('{} as Base Agent'.format(profile))
-async def process_post_agent_endpoint_lookup(request):
-    return await _process_post(request)
+async def limits_stats(request):
+    return response.json(limits.stats(), dumps=codec.dumps)
 
 
-
-@app.post('/api/v0/agent-endpoint-send')
-@doc.summary('Send agent endpoint to ledger')
-@doc.consumes(openapi_model(agent, 'agent-endpoint-send'), location='body')
+@app.get('/api/v0/relay')
+@doc.summary('Returns per-peer counts, errors, and latency histograms for messages relayed by proxy')
 @doc.produces(dict)
 @doc.tag('{} as Base Agent'.format(profile))
-async def process_post_agent_endpoint_send(request):
-    return await _process_post(request)
+async def relay_stats(request):
+    return response.json(relay.stats(), dumps=codec.dumps)
 
 
-@app.post('/api/v0/schema-lookup')
-@doc.summary('Lookup schema on ledger')
-@doc.consumes(openapi_model(agent, 'schema-lookup'), location='body')
+@app.get('/api/v0/capabilities')
+@doc.summary('Returns message types that agent offers, and which it relays only by proxy')
 @doc.produces(dict)
 @doc.tag('{} as Base Agent'.format(profile))
-async def process_post_schema_lookup(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/schema-send'), offers(agent, 'schema-send'))
-@cond_deco(doc.summary('Send schema to ledger'), offers(agent, 'schema-send'))
-@cond_deco(doc.consumes(openapi_model(agent, 'schema-send'), location='body'), offers(agent, 'schema-send'))
-@cond_deco(doc.produces(dict), offers(agent, 'schema-send'))
-@cond_deco(
-    doc.tag('{} as Origin{}'.format(profile, '' if is_native(agent, 'schema-send') else ' by Proxy')),
-    offers(agent, 'schema-send'))
-async def process_post_schema_send(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/claim-def-send'), offers(agent, 'claim-def-send'))
-@cond_deco(doc.summary('Send claim definition to ledger'), offers(agent, 'claim-def-send'))
-@cond_deco(doc.consumes(openapi_model(agent, 'claim-def-send'), location='body'), offers(agent, 'claim-def-send'))
-@cond_deco(doc.produces(dict), offers(agent, 'claim-def-send'))
-@cond_deco(
-    doc.tag('{} as Issuer{}'.format(profile, '' if is_native(agent, 'claim-def-send') else ' by Proxy')),
-    offers(agent, 'claim-def-send'))
-async def process_post_claim_def_send(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/master-secret-set'), offers(agent, 'master-secret-set'))
-@cond_deco(doc.summary('Set master secret (label)'), offers(agent, 'master-secret-set'))
-@cond_deco(doc.consumes(openapi_model(agent, 'master-secret-set'), location='body'), offers(agent, 'master-secret-set'))
-@cond_deco(doc.produces(dict), offers(agent, 'master-secret-set'))
-@cond_deco(
-    doc.tag('{} as Holder-Prover{}'.format(profile, '' if is_native(agent, 'master-secret-set') else ' by Proxy')),
-    offers(agent, 'master-secret-set'))
-async def process_post_master_secret_set(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/claim-offer-create'), offers(agent, 'claim-offer-create'))
-@cond_deco(doc.summary('Create claim offer for holder-prover'), offers(agent, 'claim-offer-create'))
-@cond_deco(
-    doc.consumes(openapi_model(agent, 'claim-offer-create'), location='body'),
-    offers(agent, 'claim-offer-create'))
-@cond_deco(doc.produces(dict), offers(agent, 'claim-offer-create'))
-@cond_deco(
-    doc.tag('{} as Issuer{}'.format(profile, '' if is_native(agent, 'claim-offer-create') else ' by Proxy')),
-    offers(agent, 'claim-offer-create'))
-async def process_post_claim_offer_create(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/claim-offer-store'), offers(agent, 'claim-offer-store'))
-@cond_deco(doc.summary('Store claim offer'), offers(agent, 'claim-offer-store'))
-@cond_deco(doc.consumes(openapi_model(agent, 'claim-offer-store'), location='body'), offers(agent, 'claim-offer-store'))
-@cond_deco(doc.produces(dict), offers(agent, 'claim-offer-store'))
-@cond_deco(
-    doc.tag('{} as Holder-Prover{}'.format(profile, '' if is_native(agent, 'claim-offer-store') else ' by Proxy')),
-    offers(agent, 'claim-offer-store'))
-async def process_post_claim_offer_store(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/claim-create'), offers(agent, 'claim-create'))
-@cond_deco(doc.summary('Create claim'), offers(agent, 'claim-create'))
-@cond_deco(doc.consumes(openapi_model(agent, 'claim-create'), location='body'), offers(agent, 'claim-create'))
-@cond_deco(doc.produces(dict), offers(agent, 'claim-create'))
-@cond_deco(
-    doc.tag('{} as Issuer{}'.format(profile, '' if is_native(agent, 'claim-create') else ' by Proxy')),
-    offers(agent, 'claim-create'))
-async def process_post_claim_create(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/claim-store'), offers(agent, 'claim-store'))
-@cond_deco(doc.summary('Store claim'), offers(agent, 'claim-store'))
-@cond_deco(doc.consumes(openapi_model(agent, 'claim-store'), location='body'), offers(agent, 'claim-store'))
-@cond_deco(doc.produces(dict), offers(agent, 'claim-store'))
-@cond_deco(
-    doc.tag('{} as Holder-Prover{}'.format(profile, '' if is_native(agent, 'claim-store') else ' by Proxy')),
-    offers(agent, 'claim-store'))
-async def process_post_claim_store(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/claim-request'), offers(agent, 'claim-request'))
-@cond_deco(doc.summary('Request claim'), offers(agent, 'claim-request'))
-@cond_deco(doc.consumes(openapi_model(agent, 'claim-request'), location='body'), offers(agent, 'claim-request'))
-@cond_deco(doc.produces(dict), offers(agent, 'claim-request'))
-@cond_deco(
-    doc.tag('{} as Holder-Prover{}'.format(profile, '' if is_native(agent, 'claim-request') else ' by Proxy')),
-    offers(agent, 'claim-request'))
-async def process_post_claim_request(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/claims-reset'), offers(agent, 'claims-reset'))
-@cond_deco(doc.summary('Reset wallet'), offers(agent, 'claims-reset'))
-@cond_deco(doc.consumes(openapi_model(agent, 'claims-reset'), location='body'), offers(agent, 'claims-reset'))
-@cond_deco(doc.produces(dict), offers(agent, 'claims-reset'))
-@cond_deco(
-    doc.tag('{} as Holder-Prover{}'.format(profile, '' if is_native(agent, 'claims-reset') else ' by Proxy')),
-    offers(agent, 'claims-reset'))
-async def process_post_claims_reset(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/proof-request'), offers(agent, 'proof-request'))
-@cond_deco(doc.summary('Request proof'), offers('agent', 'proof-request'))
-@cond_deco(doc.consumes(openapi_model(agent, 'proof-request'), location='body'), offers('agent', 'proof-request'))
-@cond_deco(doc.produces(dict), offers('agent', 'proof-request'))
-@cond_deco(
-    doc.tag('{} as Holder-Prover{}'.format(profile, '' if is_native(agent, 'proof-request') else ' by Proxy')),
-    offers('agent', 'proof-request'))
-async def process_post_proof_request(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/proof-request-by-referent'), offers(agent, 'proof-request-by-referent'))
-@cond_deco(doc.summary('Request proof by referent'), offers(agent, 'proof-request-by-referent'))
-@cond_deco(
-    doc.consumes(openapi_model(agent, 'proof-request-by-referent'), location='body'),
-    offers(agent, 'proof-request-by-referent'))
-@cond_deco(doc.produces(dict), offers(agent, 'proof-request-by-referent'))
-@cond_deco(
-    doc.tag('{} as Holder-Prover{}'.format(
-        profile,
-        '' if is_native(agent, 'proof-request-by-referent') else ' by Proxy')),
-    offers(agent, 'proof-request-by-referent'))
-async def process_post_proof_request_by_referent(request):
-    return await _process_post(request)
-
-
-@cond_deco(app.post('/api/v0/verification-request'), offers(agent, 'verification-request'))
-@cond_deco(doc.summary('Request verification'), offers(agent, 'verification-request'))
-@cond_deco(
-    doc.consumes(openapi_model(agent, 'verification-request'), location='body'),
-    offers(agent, 'verification-request'))
-@cond_deco(doc.produces(dict), offers(agent, 'verification-request'))
-@cond_deco(
-    doc.tag('{} as Verifier{}'.format(profile, '' if is_native(agent, 'verification-request') else ' by Proxy')),
-    offers(agent, 'verification-request'))
-async def process_post_verification_request(request):
-    return await _process_post(request)
+async def capabilities_matrix(request):
+    return response.json(matrix, headers={'Cache-Control': 'max-age=86400'}, dumps=codec.dumps)
+
+
+def error_response(error_code, message, status=400, headers=None):
+    """
+    Return error response in the form that all POST routes use.
+
+    :param error_code: error code, e.g., indy-sdk or von_agent error code, or HTTP status
+    :param message: error message
+    :param status: HTTP status code
+    :param headers: additional HTTP headers
+    :return: sanic response
+    """
+
+    return response.json(
+        {'error-code': int(error_code), 'message': message},
+        status=status,
+        headers=headers,
+        dumps=codec.dumps)
+
+
+async def process(form):
+    """
+    Process admitted form through ledger cache, then relay to proxy, offload worker, or agent,
+    and return its json response.
+
+    :param form: request form
+    :return: json response
+    """
+
+    if form['type'] == 'claim-request' and 'select' in form:
+        return await select_claims(form)
+    ag = registry.agent
+    if Relay.proxied(ag, form):
+        # ledger cache runs relay in a task of its own (single flight): relay span joins request's trace explicitly
+        return await ledger_cache.process_post(form, partial(relay.post, ag, parent=tracer.current()))
+    elif offload.handles(form['type']):
+        (processor, name) = (offload.process_post, 'offload.process_post')
+    elif indexed(ag, form):
+        (processor, name) = (partial(claim_index.process_post, ag), 'claim_index.process_post')
+    else:
+        (processor, name) = (ag.process_post, 'agent.process_post')
+    with tracer.span(name):
+        rv_json = await ledger_cache.process_post(form, processor)
+    if form['type'] == 'claim-store':
+        await claim_index.touch()  # wallet assigns the referent: rebuild index on next lookup
+    elif form['type'] == 'claims-reset':
+        await claim_index.clear()
+    return rv_json
+
+
+def indexed(ag, form):
+    """
+    Return whether claim index serves form in this process: a claim-request or proof-request without claim
+    selection, for a HolderProver agent, neither relayed nor offloaded.
+
+    :param ag: agent
+    :param form: admitted form
+    :return: whether to process form on claim index
+    """
+
+    return (claim_index.enabled and form['type'] in INDEXED and 'select' not in form and isinstance(ag, HolderProver)
+        and not Relay.proxied(ag, form) and not offload.handles(form['type']))
+
+
+async def select_claims(form):
+    """
+    Process claim-request form with claim selection, which von_agent's protocol does not admit:
+    relay it whole to the proxy DID's agent to select there, or strip it for the agent and apply it
+    to the agent's response.
+
+    :param form: claim-request form with 'select' property
+    :return: json response on selected claims
+    """
+
+    selection = ClaimSelection(form['select'])
+    ag = registry.agent
+    if Relay.proxied(ag, form):
+        return await relay.post(ag, form)
+    return selection.apply(await process({'type': form['type'], 'data': form['data']}))
+
+
+def failure(e, where):
+    """
+    Log exception from processing a message and return what to report for it.
+
+    :param e: exception
+    :param where: description of message for log, e.g., request path
+    :return: (error code, message, HTTP status, HTTP headers) tuple
+    """
+
+    if isinstance(e, Rejection):
+        return (e.error_code, e.message, e.status, e.headers)
+    if isinstance(e, LimitExceeded):
+        logger.warning('Rejecting %s: %s', where, e)
+        return (e.status, e.message, e.status, {'Retry-After': str(e.retry_after)})
+    if isinstance(e, OffloadFull):
+        logger.warning('Rejecting %s: %s', where, e)
+        return (503, str(e), 503, {'Retry-After': str(offload.retry_after)})
+    if isinstance(e, ProfilerBusy):
+        return (409, str(e), 409, None)
+    if isinstance(e, JSONValidation):
+        logger.info('Rejecting %s: %s', where, e.message)
+        return (e.error_code, e.message, 400, None)
+    logger.exception('Exception on %s: %s', where, e)
+    # import traceback
+    # traceback.print_exc()
+    return (
+        e.error_code if isinstance(e, (IndyError, VonAgentError)) else 400,
+        e.message if isinstance(e, VonAgentError) else str(e),  # von_agent errors keep message off args
+        400,
+        None)
+
+
+async def dispatch(request, msg_type):
+    """
+    Process POST for message type. Reject it, before parsing its body or touching the agent,
+    if the agent does not offer the message type or needs a proxy DID to relay it and the body has none.
+
+    :param request: request
+    :param msg_type: message type that route serves
+    :return: sanic response
+    """
+
+    logger.debug('Processing POST %s, request body %s', request.url, request.body)
+    span = tracer.span('POST {}'.format(msg_type), root=True, traceparent=request.headers.get('traceparent', None))
+    with metrics.timer(msg_type) as timer, span:
+        try:
+            admit(matrix, msg_type, b'"proxy-did"' in request.body)  # no such bytes, no proxy DID: reject unparsed
+            async with limits.slot(msg_type):
+                form = codec.loads(request.body)
+                if not isinstance(form, dict) or form.get('type', None) != msg_type:
+                    raise Rejection(ErrorCode.TokenType, 'Form type does not match route type {}'.format(msg_type))
+                validate(form)
+                admit(matrix, msg_type, 'proxy-did' in form['data'])  # bytes may match inside a value or nested key
+                timer.mode = 'proxy' if Relay.proxied(registry.agent, form) else 'native'
+                if msg_type == 'claim-request' and wants_ndjson(request) and indexed(registry.agent, form):
+                    with tracer.span('claim_index.iter_claims'):
+                        (proof_req, found) = await claim_index.iter_claims(registry.agent, form)
+                    return ndjson_claims_response(proof_req, found)  # resolves claims as it streams them
+                rv_json = await profiler.run(msg_type, process(form))
+            if msg_type == 'claim-request' and wants_ndjson(request):
+                return ndjson_claims_response(*claims_of(rv_json))
+            return json_response(rv_json)
+        except Exception as e:
+            failed = failure(e, request.path)
+            timer.error_code = failed[0]
+            span.set('error-code', int(failed[0]))
+            return error_response(*failed)
+
+
+def wants_ndjson(request):
+    """
+    Return whether request opts into an NDJSON response, by Accept header or by query parameter stream=ndjson.
+
+    :param request: request
+    :return: whether to stream response as NDJSON
+    """
+
+    return 'application/x-ndjson' in request.headers.get('accept', '') or request.args.get('stream', '') == 'ndjson'
+
+
+def claims_of(rv_json):
+    """
+    Return proof request, iterator over claims found, and any next cursor line from claim-request
+    response json. The iterator gives ('attrs', attribute uuid, claims) then ('predicates', predicate uuid, claims)
+    tuples, popping each off the decoded response as it goes, so that streamed claims do not stay in memory.
+
+    :param rv_json: claim-request response json from agent or proxy
+    :return: (proof request, iterator, {'next-cursor': ...} if claim-request selected a page else None) tuple
+    """
+
+    rv = codec.loads(rv_json)
+    claims = rv.pop('claims')
+
+    def found():
+        for key in ('attrs', 'predicates'):
+            by_uuid = claims.pop(key, None) or {}
+            for uuid in list(by_uuid):
+                yield (key, uuid, by_uuid.pop(uuid))
+
+    return (rv['proof-req'], found(), {'next-cursor': rv['next-cursor']} if 'next-cursor' in rv else None)
+
+
+def ndjson_claims_response(proof_req, found, tail=None):
+    """
+    Return response streaming claim-request response as NDJSON, one line per claim found, for
+    client to consume incrementally rather than as one document: first {"proof-req": ...},
+    then {"attr": <attr uuid>, "claim": ...} per claim on each requested attribute, then
+    {"predicate": <predicate uuid>, "claim": ...} per claim on each requested predicate, then
+    {"next-cursor": ...} if claim-request selected a page. Lines go out as the iterator yields claims.
+
+    :param proof_req: proof request
+    :param found: iterator over ('attrs' or 'predicates', uuid, claims) tuples
+    :param tail: last line, e.g., {'next-cursor': ...} from claim selection, None for none
+    :return: sanic streaming response
+    """
+
+    async def stream(resp):
+        resp.write('{}\n'.format(codec.dumps({'proof-req': proof_req})))
+        for (key, uuid, claims) in found:
+            kind = 'attr' if key == 'attrs' else 'predicate'
+            for claim in claims:
+                resp.write('{}\n'.format(codec.dumps({kind: uuid, 'claim': claim})))
+            await asyncio.sleep(0)  # let other requests run between attributes' claims
+        if tail is not None:
+            resp.write('{}\n'.format(codec.dumps(tail)))
+
+    return response.stream(stream, content_type='application/x-ndjson')
+
+
+POST_ROUTES = (  # message type, summary, role that processes it natively
+    ('agent-nym-lookup', 'Lookup agent nym on ledger by DID', 'Base Agent'),
+    ('agent-nym-send', 'Send agent nym to ledger', 'Trust Anchor'),
+    ('agent-endpoint-lookup', 'Lookup agent endpoint on ledger by DID', 'Base Agent'),
+    ('agent-endpoint-send', 'Send agent endpoint to ledger', 'Base Agent'),
+    ('schema-lookup', 'Lookup schema on ledger', 'Base Agent'),
+    ('schema-send', 'Send schema to ledger', 'Origin'),
+    ('claim-def-send', 'Send claim definition to ledger', 'Issuer'),
+    ('master-secret-set', 'Set master secret (label)', 'Holder-Prover'),
+    ('claim-offer-create', 'Create claim offer for holder-prover', 'Issuer'),
+    ('claim-offer-store', 'Store claim offer', 'Holder-Prover'),
+    ('claim-create', 'Create claim', 'Issuer'),
+    ('claim-store', 'Store claim', 'Holder-Prover'),
+    ('claim-request', 'Request claim', 'Holder-Prover'),
+    ('claims-reset', 'Reset wallet', 'Holder-Prover'),
+    ('proof-request', 'Request proof', 'Holder-Prover'),
+    ('proof-request-by-referent', 'Request proof by referent', 'Holder-Prover'),
+    ('verification-request', 'Request verification', 'Verifier')
+)
+
+post_handlers = {}  # message type to route handler, for models to document on first spec request
+
+
+def post_route(msg_type, summary, role):
+    """
+    Register POST route for message type, documenting all but its body model.
+
+    :param msg_type: message type
+    :param summary: route summary for OpenAPI spec
+    :param role: role that processes message type natively
+    """
+
+    async def handler(request):
+        start = monotonic()
+        request_id = request.headers.get('x-request-id', None) or uuid4().hex
+        logs.bind(request_id=request_id, msg_type=msg_type)
+        rv = await dispatch(request, msg_type)
+        logger.info(
+            'POST %s: HTTP %s',
+            msg_type,
+            rv.status,
+            extra={'status': rv.status, 'duration': monotonic() - start})
+        rv.headers['X-Request-Id'] = request_id
+        return rv
+
+    handler.__name__ = 'process_post_{}'.format(msg_type.replace('-', '_'))
+    doc.summary(summary)(handler)
+    doc.produces(dict)(handler)
+    doc.tag('{} as {}{}'.format(profile, role, '' if matrix[msg_type]['native'] else ' by Proxy'))(handler)
+    app.post('/api/v0/{}'.format(msg_type))(handler)
+    post_handlers[msg_type] = handler
+
+
+for (msg_type, summary, role) in POST_ROUTES:
+    if matrix[msg_type]['offered']:
+        post_route(msg_type, summary, role)
+
+
+@app.post('/api/v0/batch')
+@doc.summary('Process array of protocol messages; stream array of results in order, with status per message')
+@doc.consumes(doc.List(items=[doc.Dictionary()]), location='body')
+@doc.produces(doc.List(items=[doc.Dictionary()]))  # sanic_openapi 0.4.0 chokes on empty items
+@doc.tag('{} as Base Agent'.format(profile))
+async def batch(request):
+    """
+    Process protocol messages in batch, up to configured number at a time, and stream back results
+    in input order as they complete: {"status": 200, "response": ...} for success,
+    {"status": ..., "error-code": ..., "message": ...} for failure. With query parameter dedupe=true,
+    process identical read-only messages once and report the same result for each.
+    """
+
+    logger.debug('Processing POST %s', request.url)
+    try:
+        forms = codec.loads(request.body)
+    except Exception as e:
+        return error_response(*failure(e, request.path))
+    if not isinstance(forms, list):
+        return error_response(400, 'Batch must be an array of protocol messages')
+    if len(forms) > batch_size_max:
+        return error_response(413, 'Batch exceeds {} messages'.format(batch_size_max), status=413)
+
+    semaphore = asyncio.Semaphore(batch_concurrency)
+    batch_id = request.headers.get('x-request-id', None) or uuid4().hex
+    traceparent = request.headers.get('traceparent', None)  # items trace separately, under any upstream trace
+
+    async def item(index, form):
+        msg_type = msg_type_of(form)  # None for a type that is no string, e.g., unhashable list or object
+        logs.bind(request_id='{}/{}'.format(batch_id, index), msg_type=msg_type)
+        async with semaphore:
+            span = tracer.span('POST batch item {} {}'.format(index, msg_type), root=True, traceparent=traceparent)
+            with metrics.timer(msg_type if msg_type in matrix else 'unknown') as timer, span:
+                try:
+                    if msg_type is None:
+                        raise Rejection(ErrorCode.TokenType, 'Batch item is not a protocol message')
+                    admit(matrix, msg_type, 'proxy-did' in (form.get('data', None) or {}))
+                    validate(form)
+                    async with limits.slot(msg_type):
+                        timer.mode = 'proxy' if Relay.proxied(registry.agent, form) else 'native'
+                        rv_json = await profiler.run(msg_type, process(form))
+                    return '{{"status": 200, "response": {}}}'.format(json_body(rv_json))
+                except Exception as e:
+                    (error_code, message, status, _) = failure(e, '{} item {}'.format(request.path, index))
+                    timer.error_code = error_code
+                    span.set('error-code', int(error_code))
+                    return codec.dumps({'status': status, 'error-code': int(error_code), 'message': message})
+
+    dedupe = request.args.get('dedupe', 'false').lower() in ('true', '1', 'yes')
+    tasks = []
+    read_only_tasks = {}  # canonical form json to task
+    for (index, form) in enumerate(forms):
+        if dedupe and msg_type_of(form) in READ_ONLY:
+            key = codec.dumps(form, sort_keys=True)
+            if key not in read_only_tasks:
+                read_only_tasks[key] = asyncio.ensure_future(item(index, form))
+            tasks.append(read_only_tasks[key])
+        else:
+            tasks.append(asyncio.ensure_future(item(index, form)))
+
+    async def stream(resp):
+        try:
+            resp.write('[')
+            for (index, task) in enumerate(tasks):
+                resp.write('{}{}'.format(',' if index else '', await task))
+            resp.write(']')
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return response.stream(stream, content_type='application/json')
+
+
+async def process_step(form, where):
+    """
+    Process protocol message form that von_conx composes itself, e.g., in a bulk issue job, as POST routes
+    would: admit, validate, and process it under admission control, with metrics and a trace.
+
+    :param form: protocol message form
+    :param where: description of message for log
+    :return: (json response, None) on success, (None, (error code, message, HTTP status, HTTP headers)) on failure
+    """
+
+    msg_type = form['type']
+    with metrics.timer(msg_type) as timer, tracer.span('bulk-issue {}'.format(msg_type), root=True) as span:
+        try:
+            admit(matrix, msg_type, 'proxy-did' in form['data'])
+            validate(form)
+            async with limits.slot(msg_type):
+                timer.mode = 'proxy' if Relay.proxied(registry.agent, form) else 'native'
+                return (await process(form), None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            failed = failure(e, where)
+            timer.error_code = failed[0]
+            span.set('error-code', int(failed[0]))
+            return (None, failed)
+
+
+bulk_issue = None
+if matrix['claim-create']['native']:  # Issuer agent
+    bulk_issue = BulkIssue(do(mem_cache.get('config')).get('Bulk Issue', {}), process_step)
+
+    @app.listener('before_server_start')
+    async def open_bulk_issue(app, loop):  # in each server process: sanic forks workers after importing views
+        await bulk_issue.open(profile)
+
+        async def resume():
+            while registry.status != 'ready':
+                if registry.status.startswith('failed'):
+                    return
+                await asyncio.sleep(1)
+            await bulk_issue.resume()
+        loop.create_task(resume())
+
+    @app.listener('before_server_stop')
+    async def close_bulk_issue(app, loop):
+        bulk_issue.close()
+
+    @app.post('/api/v0/bulk-issue')
+    @doc.summary('Start job to issue claims on one schema to one holder-prover (by proxy); returns job id (HTTP 202)')
+    @doc.consumes(doc.Dictionary(), location='body')
+    @doc.produces(dict)
+    @doc.tag('{} as Issuer'.format(profile))
+    async def bulk_issue_start(request):
+        """
+        Start bulk issue job on body {"schema": {"origin-did": ..., "name": ..., "version": ...},
+        "holder-did": ..., "claims": [{<attr>: <value>, ...}, ...]}, with optional "job-id" to submit
+        idempotently, and return its status: HTTP 202 for a new job, 200 for an existing one.
+        """
+
+        logger.debug('Processing POST %s', request.url)
+        try:
+            body = codec.loads(request.body)
+            if not isinstance(body, dict):
+                raise Rejection(400, 'Bulk issue job must be an object')
+            (schema, holder_did, claims) = (body.get('schema', None), body.get('holder-did', None), body.get('claims'))
+            if not (isinstance(schema, dict) and set(schema) == {'origin-did', 'name', 'version'}
+                    and all(isinstance(v, str) for v in schema.values())):
+                raise Rejection(400, 'Bulk issue job needs schema with origin-did, name, and version')
+            if not isinstance(holder_did, str) or not holder_did:
+                raise Rejection(400, 'Bulk issue job needs holder-did')
+            if not (isinstance(claims, list) and claims and all(isinstance(c, dict) for c in claims)):
+                raise Rejection(400, 'Bulk issue job needs non-empty claims array of attribute objects')
+            if len(claims) > bulk_issue.claims_max:
+                raise Rejection(413, 'Bulk issue job exceeds {} claims'.format(bulk_issue.claims_max), 413)
+            job_id = body.get('job-id', None)
+            if job_id is not None and not isinstance(job_id, str):
+                raise Rejection(400, 'Bulk issue job-id must be a string')
+            admit(matrix, 'claim-create', False)
+            (job_id, created) = await bulk_issue.submit(schema, holder_did, claims, job_id)
+            return response.json(
+                await bulk_issue.status(job_id, 0, 0),
+                status=202 if created else 200,
+                dumps=codec.dumps)
+        except Exception as e:
+            return error_response(*failure(e, request.path))
+
+    @app.get('/api/v0/bulk-issue/<job_id>')
+    @doc.summary('Returns bulk issue job status, item counts, and per-item results from query parameter start')
+    @doc.produces(dict)
+    @doc.tag('{} as Issuer'.format(profile))
+    async def bulk_issue_status(request, job_id):
+        """
+        Return bulk issue job status, with item results from index query parameter start (default 0),
+        up to query parameter limit (default all).
+        """
+
+        try:
+            try:
+                (start, limit) = (int(request.args.get('start', 0)), int(request.args.get('limit', -1)))
+            except ValueError:
+                raise Rejection(400, 'Query parameters start and limit must be integers')
+            rv = await bulk_issue.status(job_id, start, limit)
+            if rv is None:
+                raise Rejection(404, 'No such bulk issue job {}'.format(job_id), 404)
+            return response.json(rv, dumps=codec.dumps)
+        except Exception as e:
+            return error_response(*failure(e, request.path))
+
+
+def admin_seconds(request):
+    """
+    Return seconds to profile from query parameter, raising Rejection (HTTP 403) unless request comes
+    from localhost, or (HTTP 400) if seconds are missing or out of configured bounds.
+
+    :param request: request
+    :return: seconds to profile
+    """
+
+    if request.ip not in ('127.0.0.1', '::1'):
+        raise Rejection(403, 'Profiler admits requests from localhost only', 403)
+    try:
+        seconds = float(request.args.get('seconds', ''))
+    except ValueError:
+        seconds = 0
+    if not 0 < seconds <= profiler.seconds_max:
+        raise Rejection(400, 'Query parameter seconds must be in (0, {}]'.format(profiler.seconds_max))
+    return seconds
+
+
+if profiler.enabled:  # admin routes: off the OpenAPI spec, off altogether by default
+
+    @app.get('/admin/profile/sample')
+    @doc.exclude(True)
+    async def profile_sample(request):
+        """
+        Sample event loop thread stacks over query parameter seconds, and return them in collapsed stack format.
+        """
+
+        try:
+            return response.text(await profiler.sample(admin_seconds(request)))
+        except Exception as e:
+            return error_response(*failure(e, request.path))
+
+    @app.get('/admin/profile/cprofile/<msg_type>')
+    @doc.exclude(True)
+    async def profile_cprofile(request, msg_type):
+        """
+        Profile processing of messages of path type with cProfile over query parameter seconds, and return
+        stats by cumulative time.
+        """
+
+        try:
+            seconds = admin_seconds(request)
+            if msg_type not in matrix:
+                raise Rejection(ErrorCode.TokenType, 'No such message type {}'.format(msg_type))
+            return response.text(await profiler.cprofile(msg_type, seconds))
+        except Exception as e:
+            return error_response(*failure(e, request.path))
+
+
+@lru_cache(maxsize=1)
+def build_openapi_spec():
+    """
+    Attach message type models (built on first use, per app.model.openapi_model) to POST route docs and build
+    OpenAPI spec, once per process.
+    """
+
+    for (msg_type, handler) in post_handlers.items():
+        doc.consumes(openapi_model(agent_cls, msg_type), location='body')(handler)
+    openapi.build_spec(app, None)
+
+
+@app.get('/openapi/spec.json')
+async def openapi_spec(request):
+    """
+    Return OpenAPI spec, building it (and the message type models it documents) on first request
+    rather than at startup.
+    """
+
+    build_openapi_spec()
+    return openapi.spec(request)
@@ -0,0 +1,36 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from importlib import import_module
+from os.path import abspath, dirname, join as pjoin
+from types import ModuleType
+
+import sys
+
+
+def load_app_module(name):
+    """
+    Import an app module without running the app package initializer, which boots an agent.
+
+    :param name: dotted module name under app, e.g., 'cache' or 'service.bootseq'
+    :return: module
+    """
+
+    if 'app' not in sys.modules:
+        pkg = ModuleType('app')
+        pkg.__path__ = [pjoin(dirname(dirname(abspath(__file__))), 'app')]
+        sys.modules['app'] = pkg
+    return import_module('app.{}'.format(name))
@@ -0,0 +1,100 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from tempfile import mkdtemp
+from time import perf_counter
+from von_agent.agents import Issuer
+from von_agent.cache import CLAIM_DEF_CACHE
+
+import asyncio
+import json
+
+
+BootSequence = load_app_module('service.bootseq').BootSequence
+LedgerStore = load_app_module('store').LedgerStore
+
+LATENCY = 0.25  # seconds per ledger round trip
+CFG_ORIGIN = {'sri': '1.0, 1.1', 'green': '1.0'}  # as per SRI profile
+
+
+class StubWallet:
+    name = 'stub'
+
+
+class StubIssuer(Issuer):
+    """
+    Issuer answering boot sequence calls after a simulated ledger round trip, as on restart with
+    schemata and claim defs already on ledger.
+    """
+
+    def __init__(self):
+        self._seq_no = 0
+
+    @property
+    def did(self):
+        return 'FaBAq1W5QTVDpAZtep6h19'
+
+    @property
+    def wallet(self):
+        return StubWallet()
+
+    async def process_post(self, form):
+        await asyncio.sleep(LATENCY)
+        self._seq_no += 1
+        return json.dumps({
+            'seqNo': self._seq_no,
+            'dest': self.did,
+            'data': {
+                'name': form['data']['schema']['name'],
+                'version': form['data']['schema']['version'],
+                'attr_names': ['id', 'name']
+            }
+        })
+
+    async def send_claim_def(self, schema_json):
+        return await self.get_claim_def(json.loads(schema_json)['seqNo'], self.did)  # wallet already has it
+
+    async def get_claim_def(self, schema_seq_no, issuer_did):
+        if (schema_seq_no, issuer_did) in CLAIM_DEF_CACHE:
+            return json.dumps(CLAIM_DEF_CACHE[(schema_seq_no, issuer_did)])
+        await asyncio.sleep(LATENCY)
+        return json.dumps({'ref': schema_seq_no, 'origin': issuer_did, 'data': {}})
+
+
+def boot_time(concurrency, store):
+    cfg = {'Origin': CFG_ORIGIN, 'Boot': {'originate.concurrency': str(concurrency)}}
+    start = perf_counter()
+    asyncio.get_event_loop().run_until_complete(BootSequence.originate(StubIssuer(), cfg, store))
+    return perf_counter() - start
+
+
+def main():
+    LedgerStore.dir_store = mkdtemp()
+    n_schemata = sum(len(v.split(',')) for v in CFG_ORIGIN.values())
+    print('Originating {} schemata with claim defs, {:.0f} ms per ledger round trip'.format(
+        n_schemata,
+        LATENCY * 1000))
+    for concurrency in (1, 2, 4):
+        CLAIM_DEF_CACHE.clear()
+        store = LedgerStore('bench.{}'.format(concurrency))
+        print('  concurrency {}, cold store: {:>8.3f} s'.format(concurrency, boot_time(concurrency, store)))
+        print('  concurrency {}, warm store: {:>8.3f} s'.format(concurrency, boot_time(concurrency, store)))
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter
+from von_agent.schemakey import schema_key_for
+
+
+claims = load_app_module('claims')
+
+SCHEMA_KEY = {'did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'}
+S_KEY = schema_key_for(SCHEMA_KEY)
+
+FILTERS = (  # label, filter on schema key as von_agent takes it
+    ('attr-match', {'attr-match': {'legalName': 'Org 77'}}),
+    ('pred-match', {'pred-match': [{'attr': 'orgTypeId', 'pred-type': '>=', 'value': 99}]}),
+    ('both', {'attr-match': {'jurisdictionId': '3'}, 'pred-match': [{'attr': 'id', 'pred-type': '>=', 'value': 9990}]})
+)
+
+
+def wallet(n, rng):
+    """
+    Return n claim infos as indy-sdk reports them, on one schema.
+    """
+
+    return [
+        {
+            'referent': 'claim::{:032x}'.format(rng.getrandbits(128)),
+            'attrs': {
+                'id': str(i),
+                'legalName': 'Org {}'.format(i % 1000),
+                'orgTypeId': str(rng.randrange(100)),
+                'jurisdictionId': str(rng.randrange(10)),
+                'effectiveDate': '2010-10-10'
+            },
+            'schema_key': SCHEMA_KEY,
+            'issuer_did': 'Q4zqM7aXqm7gDQkUVLng9h',
+            'revoc_reg_seq_no': None
+        } for i in range(n)
+    ]
+
+
+def scan(wallet_claims, filt):
+    """
+    Previous path: filter every claim in the wallet, as von_agent HolderProver.get_claims() does
+    (after indy-sdk lists them all, which this leaves out).
+    """
+
+    rv = []
+    for candidate in wallet_claims:
+        if not {k: str(v) for (k, v) in filt.get('attr-match', {}).items()}.items() <= candidate['attrs'].items():
+            continue
+        try:
+            if any(p['attr'] not in candidate['attrs'] or int(candidate['attrs'][p['attr']]) < p['value']
+                    for p in filt.get('pred-match', [])):
+                continue
+        except ValueError:
+            continue
+        rv.append(candidate)
+    return rv
+
+
+def measure(fn, iterations):
+    start = perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (perf_counter() - start) / iterations
+
+
+def main(sizes=(1000, 10000, 50000), iterations=20):
+    rng = Random(0)
+    print('{:>8} {:>12} {:>10} {:>12} {:>12} {:>8}'.format(
+        'claims', 'filter', 'found', 'scan us', 'index us', 'speedup'))
+    for n in sizes:
+        wallet_claims = wallet(n, rng)
+        index = claims.ClaimIndex({'enabled': 'true'}, mkdtemp(), 'bench')
+        start = perf_counter()
+        index.load(wallet_claims)
+        t_build = perf_counter() - start
+        for (label, filt) in FILTERS:
+            found = index.candidates(S_KEY, filt)
+            assert found == scan(wallet_claims, filt)
+            t_scan = measure(lambda: scan(wallet_claims, filt), iterations)
+            t_index = measure(lambda: index.candidates(S_KEY, filt), iterations)
+            print('{:>8} {:>12} {:>10} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(
+                n, label, len(found), t_scan * 1e6, t_index * 1e6, t_scan / t_index))
+        print('{:>8} {:>12} {:>10} {:>12} {:>12.1f}'.format(n, '(rebuild)', n, '', t_build * 1e6))
+
+
+if __name__ == '__main__':
+    main()
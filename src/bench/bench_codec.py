@@ -0,0 +1,166 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from random import Random
+from time import perf_counter
+
+import json
+
+
+codec = load_app_module('codec')
+
+ATTRS = ('id', 'busId', 'orgTypeId', 'jurisdictionId', 'legalName', 'effectiveDate', 'endDate')
+SCHEMA_KEY = {'did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'}
+
+
+def big(rng, digits=300):
+    """
+    Return decimal string of a big number, as indy-sdk renders group elements and signatures.
+    """
+
+    return str(rng.randrange(10 ** (digits - 1), 10 ** digits))
+
+
+def claim(rng):
+    """
+    Return claim as claim-store takes it: raw and encoded values, primary signature.
+    """
+
+    return {
+        'values': {a: ['value {}'.format(a), big(rng, 40)] for a in ATTRS},
+        'signature': {
+            'primary_claim': {'m2': big(rng), 'a': big(rng, 600), 'e': big(rng, 100), 'v': big(rng, 700)},
+            'non_revocation_claim': None
+        },
+        'schema_key': SCHEMA_KEY,
+        'issuer_did': 'Q4zqM7aXqm7gDQkUVLng9h',
+        'signature_correctness_proof': {'se': big(rng, 600), 'c': big(rng, 80)},
+        'rev_reg_seq_no': None
+    }
+
+
+def proof(rng):
+    """
+    Return proof-request response: proof request and proof revealing every attribute of one claim.
+    """
+
+    uuids = ['{:032x}'.format(rng.getrandbits(128)) for _ in ATTRS]
+    return {
+        'proof-req': {
+            'nonce': big(rng, 30),
+            'name': 'proof_req',
+            'version': '0',
+            'requested_attrs': {
+                u: {'name': a, 'restrictions': [{'schema_key': SCHEMA_KEY}]} for (u, a) in zip(uuids, ATTRS)
+            },
+            'requested_predicates': {}
+        },
+        'proof': {
+            'proof': {
+                'proofs': {
+                    'claim::{:032x}'.format(rng.getrandbits(128)): {
+                        'proof': {
+                            'primary_proof': {
+                                'eq_proof': {
+                                    'revealed_attrs': {a: big(rng, 40) for a in ATTRS},
+                                    'a_prime': big(rng, 600),
+                                    'e': big(rng, 150),
+                                    'v': big(rng, 800),
+                                    'm': {'master_secret': big(rng, 180)},
+                                    'm1': big(rng, 180),
+                                    'm2': big(rng, 180)
+                                },
+                                'ge_proofs': []
+                            },
+                            'non_revoc_proof': None
+                        },
+                        'schema_seq_no': 21,
+                        'issuer_did': 'Q4zqM7aXqm7gDQkUVLng9h'
+                    }
+                },
+                'aggregated_proof': {'c_hash': big(rng, 80), 'c_list': [[rng.randrange(256) for _ in range(256)]]}
+            },
+            'requested_proof': {
+                'revealed_attrs': {u: ['claim::x', 'value {}'.format(a), big(rng, 40)] for (u, a) in zip(uuids, ATTRS)},
+                'unrevealed_attrs': {},
+                'self_attested_attrs': {},
+                'predicates': {}
+            },
+            'identifiers': {'claim::x': {'issuer_did': 'Q4zqM7aXqm7gDQkUVLng9h', 'schema_key': SCHEMA_KEY}}
+        }
+    }
+
+
+def verification(rng):
+    """
+    Return verification-request form on a proof.
+    """
+
+    rv = proof(rng)
+    return {'type': 'verification-request', 'data': {'proof-req': rv['proof-req'], 'proof': rv['proof']}}
+
+
+def claims_found(rng, n=50):
+    """
+    Return claim-request response finding n claims on each of two requested attributes.
+    """
+
+    def found():
+        return {
+            'referent': 'claim::{:032x}'.format(rng.getrandbits(128)),
+            'attrs': {a: 'value {}'.format(a) for a in ATTRS},
+            'schema_key': SCHEMA_KEY,
+            'issuer_did': 'Q4zqM7aXqm7gDQkUVLng9h',
+            'revoc_reg_seq_no': None
+        }
+
+    return {
+        'proof-req': {'nonce': big(rng, 30), 'name': 'proof_req', 'version': '0'},
+        'claims': {'attrs': {'{:032x}'.format(rng.getrandbits(128)): [found() for _ in range(n)] for _ in range(2)}}
+    }
+
+
+PAYLOADS = (('claim', claim), ('proof', proof), ('verification', verification), ('claims found', claims_found))
+
+
+def measure(fn, arg, iterations):
+    start = perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (perf_counter() - start) / iterations
+
+
+def main(iterations=500):
+    rng = Random(0)
+    print('codec backend (encode/decode): {}\n'.format(codec.BACKEND))
+    print('{:>14} {:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'payload', 'bytes', 'json dump us', 'codec us', 'json load us', 'codec us'))
+    for (label, make) in PAYLOADS:
+        obj = make(rng)
+        text = json.dumps(obj)
+        assert codec.loads(codec.dumps(obj)) == obj == codec.loads(text)
+        print('{:>14} {:>8} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+            label,
+            len(text),
+            measure(json.dumps, obj, iterations) * 1e6,
+            measure(codec.dumps, obj, iterations) * 1e6,
+            measure(json.loads, text, iterations) * 1e6,
+            measure(codec.loads, text, iterations) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
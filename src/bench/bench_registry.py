@@ -0,0 +1,88 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from time import perf_counter
+from von_agent.agents import _BaseAgent
+
+import asyncio
+import json
+
+
+cache = load_app_module('cache')
+mem_cache = cache.mem_cache
+
+
+class StubAgent(_BaseAgent):
+    """
+    Agent answering process_get_did() without a wallet, to isolate agent resolution cost.
+    """
+
+    def __init__(self):
+        pass
+
+    async def process_get_did(self):
+        return json.dumps('V4SGRU86Z58d6TV7PBUe6f')
+
+
+async def did_mem_cache(request):
+    """
+    Former /api/v0/did handler body: resolve agent through aiocache, write it back after.
+    """
+
+    ag = await mem_cache.get('agent')
+    try:
+        return await ag.process_get_did()
+    finally:
+        await mem_cache.set('agent', ag)
+
+
+def did_registry_for(registry):
+    async def did_registry(request):
+        """
+        Current /api/v0/did handler body: resolve agent from process-local registry.
+        """
+
+        ag = registry.agent
+        return await ag.process_get_did()
+    return did_registry
+
+
+async def rps(handler, n_requests):
+    start = perf_counter()
+    for _ in range(n_requests):
+        await handler(None)
+    return n_requests / (perf_counter() - start)
+
+
+def main():
+    n_requests = 100000
+    loop = asyncio.get_event_loop()
+    ag = StubAgent()
+    registry = cache.Registry()
+    registry.agent = ag
+    loop.run_until_complete(mem_cache.set('agent', ag))
+
+    before = loop.run_until_complete(rps(did_mem_cache, n_requests))
+    after = loop.run_until_complete(rps(did_registry_for(registry), n_requests))
+    print('/api/v0/did handler, {} requests'.format(n_requests))
+    print('  mem_cache get/set: {:>12.0f} req/s'.format(before))
+    print('  registry:          {:>12.0f} req/s'.format(after))
+    print('  speedup:           {:>12.1f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from timeit import timeit
+
+import json
+import tracemalloc
+
+
+def proof_json(n_claims):
+    """
+    Return JSON string shaped like a von_agent proof-request response on n_claims claims.
+
+    :param n_claims: number of claims in proof
+    :return: JSON proof response
+    """
+
+    attrs = ['legalName', 'jurisdictionId', 'address', 'city', 'province', 'postalCode', 'effectiveDate']
+    proof = {
+        'proof': {
+            'proofs': {},
+            'aggregated_proof': {'c_hash': '9' * 77, 'c_list': [[n % 256 for n in range(256)] for _ in range(4)]},
+            'requested_proof': {'revealed_attrs': {}, 'unrevealed_attrs': {}, 'self_attested_attrs': {}, 'predicates': {}}
+        },
+        'proof-req': {'nonce': '1234567890', 'name': 'proof_req', 'version': '0.0', 'requested_attrs': {}},
+    }
+    for i in range(n_claims):
+        claim_uuid = 'claim::{:032x}'.format(i)
+        proof['proof']['proofs'][claim_uuid] = {
+            'proof': {
+                'primary_proof': {
+                    'eq_proof': {
+                        'revealed_attrs': {a: str(i * 7919 + len(a)) for a in attrs},
+                        'a_prime': '7' * 600,
+                        'e': '3' * 150,
+                        'v': '5' * 1200,
+                        'm': {a: '1' * 230 for a in attrs},
+                        'm1': '2' * 230,
+                        'm2': '4' * 230
+                    },
+                    'ge_proofs': []
+                },
+                'non_revoc_proof': None
+            },
+            'issuer_did': 'Q4zqM7aXqm7gDQkUVLng9h',
+            'schema_seq_no': 18 + i
+        }
+        for a in attrs:
+            referent = '{}.{}'.format(i, a)
+            proof['proof']['requested_proof']['revealed_attrs'][referent] = [claim_uuid, 'value', '12345']
+            proof['proof-req']['requested_attrs'][referent] = {'name': a, 'restrictions': [{'schema_key': {}}]}
+    return json.dumps(proof)
+
+
+def reparse(rv_json):
+    return json.dumps(json.loads(rv_json)).encode()
+
+
+def passthrough(rv_json):
+    return rv_json.encode() if rv_json[:1] in ('{', '[', '"') else reparse(rv_json)
+
+
+def peak_alloc(fn, arg):
+    tracemalloc.start()
+    fn(arg)
+    rv = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rv
+
+
+def main():
+    print('{:>8} {:>10} {:>14} {:>14} {:>14} {:>14}'.format(
+        'claims',
+        'bytes',
+        'reparse us',
+        'pass us',
+        'reparse peak',
+        'pass peak'))
+    for n_claims in (1, 8, 64, 256):
+        rv_json = proof_json(n_claims)
+        number = max(5, 2000 // n_claims)
+        t_reparse = timeit(lambda: reparse(rv_json), number=number) / number
+        t_pass = timeit(lambda: passthrough(rv_json), number=number) / number
+        print('{:>8} {:>10} {:>14.1f} {:>14.1f} {:>14} {:>14}'.format(
+            n_claims,
+            len(rv_json),
+            t_reparse * 1e6,
+            t_pass * 1e6,
+            peak_alloc(reparse, rv_json),
+            peak_alloc(passthrough, rv_json)))
+
+
+if __name__ == '__main__':
+    main()
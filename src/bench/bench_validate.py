@@ -0,0 +1,117 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from time import perf_counter
+from von_agent.error import JSONValidation
+from von_agent.proto.validate import validate as validate_form
+
+
+validate = load_app_module('validate')
+
+FORMS = (  # label, form
+    ('schema-lookup ok', {
+        'type': 'schema-lookup',
+        'data': {
+            'schema': {
+                'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h',
+                'name': 'bc-reg',
+                'version': '1.0'
+            }
+        }
+    }),
+    ('schema-lookup bad', {
+        'type': 'schema-lookup',
+        'data': {
+            'schema': {
+                'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h',
+                'name': 'bc-reg',
+                'version': 1.0
+            }
+        }
+    }),
+    ('claim-request ok', {
+        'type': 'claim-request',
+        'data': {
+            'schemata': [{'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'}],
+            'claim-filter': {
+                'attr-match': [{
+                    'schema': {'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'},
+                    'match': {'legalName': 'Tart City'}
+                }],
+                'pred-match': []
+            },
+            'requested-attrs': []
+        }
+    }),
+    ('claim-request bad', {
+        'type': 'claim-request',
+        'data': {
+            'schemata': [{'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg'}],
+            'claim-filter': {
+                'attr-match': [],
+                'pred-match': []
+            },
+            'requested-attrs': []
+        }
+    })
+)
+
+
+def old(form):
+    """
+    Previous path: von_agent validation, rechecking schema against the meta-schema on every call.
+    """
+
+    try:
+        validate_form(form, True)
+    except JSONValidation:
+        pass
+
+
+def new(form):
+    """
+    Current path: edge validation on validator compiled once.
+    """
+
+    try:
+        validate.validate(form)
+    except JSONValidation:
+        pass
+
+
+def measure(fn, form, iterations):
+    fn(form)  # warm caches
+    start = perf_counter()
+    for _ in range(iterations):
+        fn(form)
+    return (perf_counter() - start) / iterations
+
+
+def main(iterations=2000):
+    print('{:>20} {:>12} {:>12} {:>8}'.format('form', 'old us', 'new us', 'speedup'))
+    for (label, form) in FORMS:
+        t_old = measure(old, form, iterations)
+        t_new = measure(new, form, iterations)
+        print('{:>20} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(label, t_old * 1e6, t_new * 1e6, t_old / t_new))
+    try:
+        validate.validate(FORMS[1][1])
+    except JSONValidation as e:
+        print('\nsample rejection: {}'.format(e.message))
+
+
+if __name__ == '__main__':
+    main()
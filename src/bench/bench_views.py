@@ -0,0 +1,94 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from time import perf_counter
+from von_agent.agents import AgentRegistrar, Origin, Issuer, HolderProver, Verifier
+
+import tracemalloc
+
+
+model = load_app_module('model')
+
+MSG_TYPES = (
+    'agent-nym-lookup',
+    'agent-nym-send',
+    'agent-endpoint-lookup',
+    'agent-endpoint-send',
+    'schema-lookup',
+    'schema-send',
+    'claim-def-send',
+    'master-secret-set',
+    'claim-offer-create',
+    'claim-offer-store',
+    'claim-create',
+    'claim-store',
+    'claim-request',
+    'claims-reset',
+    'proof-request',
+    'proof-request-by-referent',
+    'verification-request')
+
+
+def eager(agent_cls):
+    """
+    Views import building OpenAPI models up front: capability matrix, then one model per route.
+    """
+
+    model.capabilities(agent_cls)
+    for t in MSG_TYPES:
+        model.openapi_model(agent_cls, t)
+
+
+def lazy(agent_cls):
+    """
+    Current views import: one capability matrix; models wait for the first spec request.
+    """
+
+    model.capabilities(agent_cls)
+
+
+def clear():
+    for fn in (model.openapi_model, model.capabilities):
+        fn.cache_clear()
+
+
+def measure(fn, agent_cls):
+    clear()
+    tracemalloc.start()
+    start = perf_counter()
+    fn(agent_cls)
+    elapsed = perf_counter() - start
+    rv = (elapsed, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return rv
+
+
+def main():
+    print('{:>14} {:>12} {:>12} {:>12} {:>12}'.format('agent class', 'eager us', 'lazy us', 'eager peak', 'lazy peak'))
+    for agent_cls in (AgentRegistrar, Origin, Issuer, HolderProver, Verifier):
+        (t_eager, m_eager) = measure(eager, agent_cls)
+        (t_lazy, m_lazy) = measure(lazy, agent_cls)
+        print('{:>14} {:>12.1f} {:>12.1f} {:>12} {:>12}'.format(
+            agent_cls.__name__,
+            t_eager * 1e6,
+            t_lazy * 1e6,
+            m_eager,
+            m_lazy))
+
+
+if __name__ == '__main__':
+    main()
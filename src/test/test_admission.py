@@ -0,0 +1,99 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from von_agent.error import ErrorCode
+
+import json
+import pytest
+
+
+admission = load_app_module('admission')
+cache = load_app_module('cache')
+
+MATRIX = {
+    'agent-nym-lookup': {'offered': True, 'native': True, 'proxy-required': False},
+    'claim-create': {'offered': True, 'native': False, 'proxy-required': True},
+    'claim-store': {'offered': False, 'native': False, 'proxy-required': False}
+}
+
+
+@pytest.fixture
+def ready(monkeypatch):
+    monkeypatch.setattr(cache.registry, 'status', 'ready')
+
+
+@pytest.mark.parametrize('form', [
+    {'type': ['agent-nym-lookup']},
+    {'type': {}},
+    {'type': 1},
+    {'type': None},
+    {'data': {}},
+    ['agent-nym-lookup'],
+    'agent-nym-lookup',
+    None
+])
+def test_msg_type_of_not_a_type(form, ready):
+    assert admission.msg_type_of(form) is None
+    with pytest.raises(admission.Rejection) as x_info:  # batch item errors alone, rather than raising TypeError
+        admission.admit(MATRIX, admission.msg_type_of(form), False)
+    assert x_info.value.error_code == ErrorCode.TokenType and x_info.value.status == 400
+
+
+def test_msg_type_of():
+    assert admission.msg_type_of({'type': 'agent-nym-lookup', 'data': {}}) == 'agent-nym-lookup'
+    assert admission.msg_type_of({'type': 'no-such-type'}) == 'no-such-type'
+
+
+def test_admit(ready):
+    admission.admit(MATRIX, 'agent-nym-lookup', False)
+    admission.admit(MATRIX, 'claim-create', True)
+    with pytest.raises(admission.Rejection) as x_info:
+        admission.admit(MATRIX, 'claim-create', False)
+    assert x_info.value.error_code == ErrorCode.ProxyRelayConfig
+    for msg_type in ('claim-store', 'no-such-type'):
+        with pytest.raises(admission.Rejection) as x_info:
+            admission.admit(MATRIX, msg_type, True)
+        assert x_info.value.error_code == ErrorCode.TokenType
+
+
+def test_admit_proxy_did_nested_only(ready):
+    body = b'{"type": "claim-create", "data": {"claim-attrs": {"proxy-did": "x"}, "claim-req": {}}}'
+    form = json.loads(body.decode())
+    admission.admit(MATRIX, 'claim-create', b'"proxy-did"' in body)  # bytes match on a nested key
+    with pytest.raises(admission.Rejection) as x_info:
+        admission.admit(MATRIX, 'claim-create', 'proxy-did' in form['data'])
+    assert x_info.value.error_code == ErrorCode.ProxyRelayConfig
+
+
+@pytest.mark.parametrize('status', ['booting', 'registering', 'failed: no pool'])
+def test_admit_not_ready(monkeypatch, status):
+    monkeypatch.setattr(cache.registry, 'status', status)
+    admission.admit(MATRIX, 'agent-nym-lookup', False)  # read-only types pass the gate while agent boots
+    with pytest.raises(admission.Rejection) as x:
+        admission.admit(MATRIX, 'claim-create', True)
+    assert (x.value.error_code, x.value.status, x.value.headers) == (503, 503, {'Retry-After': '5'})
+    assert status in x.value.message
+
+
+@pytest.mark.parametrize('status,http_status', [
+    ('booting', 503),
+    ('registering', 503),
+    ('failed: no pool', 503),
+    ('ready', 200)
+])
+def test_readiness(status, http_status):
+    assert admission.readiness(status) == ({'ready': http_status == 200, 'status': status}, http_status)
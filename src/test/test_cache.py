@@ -0,0 +1,299 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+
+import asyncio
+import pytest
+
+
+cache = load_app_module('cache')
+
+CFG = {
+    'schema-lookup.ttl': '86400',
+    'schema-lookup.ttl.negative': '30',
+    'schema-lookup.size': '2',
+    'agent-nym-lookup.ttl': '600',
+    'agent-nym-lookup.ttl.negative': '0',
+    'agent-nym-lookup.size': '4'
+}
+
+
+class Processor:
+    """
+    Stub process_post: count calls per form, answer '{}' for unknown schema names, optionally hold at a gate.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.gate = None
+
+    async def __call__(self, form):
+        self.calls.append(form)
+        if self.gate is not None:
+            await self.gate.wait()
+        name = form['data'].get('name', None)
+        if name == 'boom':
+            raise ValueError('boom')
+        return '{}' if name == 'missing' else '{{"name": "{}", "n": {}}}'.format(name, len(self.calls))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    rv = Clock()
+    monkeypatch.setattr(cache, 'monotonic', rv)
+    return rv
+
+
+async def settle():
+    for _ in range(3):  # let waiters start and the shared lookup reach its processor
+        await asyncio.sleep(0)
+
+
+def schema(name):
+    return {'type': 'schema-lookup', 'data': {'name': name}}
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    proc.gate = asyncio.Event()
+    waiters = [asyncio.ensure_future(lc.process_post(schema('bc-reg'), proc)) for _ in range(5)]
+    await settle()
+    assert len(proc.calls) == 1
+    proc.gate.set()
+    results = await asyncio.gather(*waiters)
+    assert len(set(results)) == 1 and len(proc.calls) == 1
+    assert lc.stats()['schema-lookup']['coalesced'] == 4
+
+
+@pytest.mark.asyncio
+async def test_single_flight_uncached_type():
+    lc = cache.LedgerCache({})  # nothing cached, lookups still coalesce
+    proc = Processor()
+    proc.gate = asyncio.Event()
+    waiters = [asyncio.ensure_future(lc.process_post(schema('bc-reg'), proc)) for _ in range(3)]
+    await settle()
+    proc.gate.set()
+    await asyncio.gather(*waiters)
+    assert len(proc.calls) == 1
+    await lc.process_post(schema('bc-reg'), proc)
+    assert len(proc.calls) == 2  # not cached once landed
+
+
+@pytest.mark.asyncio
+async def test_single_flight_error_shared_not_cached():
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    proc.gate = asyncio.Event()
+    waiters = [asyncio.ensure_future(lc.process_post(schema('boom'), proc)) for _ in range(2)]
+    await settle()
+    proc.gate.set()
+    for outcome in await asyncio.gather(*waiters, return_exceptions=True):
+        assert isinstance(outcome, ValueError)
+    assert len(proc.calls) == 1
+    with pytest.raises(ValueError):
+        await lc.process_post(schema('boom'), proc)
+    assert len(proc.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_leaves_flight():
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    proc.gate = asyncio.Event()
+    first = asyncio.ensure_future(lc.process_post(schema('bc-reg'), proc))
+    second = asyncio.ensure_future(lc.process_post(schema('bc-reg'), proc))
+    await settle()
+    first.cancel()
+    proc.gate.set()
+    assert '"bc-reg"' in await second
+    assert first.cancelled() and len(proc.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_generation_blocks_caching_after_invalidation():
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    proc.gate = asyncio.Event()
+    in_flight = asyncio.ensure_future(lc.process_post(schema('bc-reg'), proc))
+    await settle()
+    await lc.process_post({'type': 'schema-send', 'data': {'name': 'bc-reg'}}, Processor())  # send lands first
+    proc.gate.set()
+    stale = await in_flight
+    assert '"n": 1' in stale
+    proc.gate = None
+    fresh = await lc.process_post(schema('bc-reg'), proc)
+    assert fresh != stale and len(proc.calls) == 2  # stale lookup did not go into cache
+
+
+@pytest.mark.asyncio
+async def test_negative_ttl(clock):
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    assert await lc.process_post(schema('missing'), proc) == '{}'
+    clock.now += 29
+    assert await lc.process_post(schema('missing'), proc) == '{}'
+    assert len(proc.calls) == 1
+    clock.now += 2
+    await lc.process_post(schema('missing'), proc)
+    assert len(proc.calls) == 2  # negative TTL 30 expired, positive TTL would not have
+
+
+@pytest.mark.asyncio
+async def test_negative_ttl_zero_not_cached(clock):
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    form = {'type': 'agent-nym-lookup', 'data': {'name': 'missing'}}
+    await lc.process_post(form, proc)
+    await lc.process_post(form, proc)
+    assert len(proc.calls) == 2
+    assert lc.stats()['agent-nym-lookup']['size'] == 0
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction(clock):
+    lc = cache.LedgerCache(CFG)  # schema-lookup size 2
+    proc = Processor()
+    await lc.process_post(schema('a'), proc)
+    await lc.process_post(schema('b'), proc)
+    await lc.process_post(schema('a'), proc)  # hit: a now most recently used
+    await lc.process_post(schema('c'), proc)  # evicts b
+    assert len(proc.calls) == 3
+    await lc.process_post(schema('a'), proc)
+    assert len(proc.calls) == 3
+    await lc.process_post(schema('b'), proc)
+    assert len(proc.calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_send_invalidates_lookup_type(clock):
+    lc = cache.LedgerCache(dict(CFG, **{'agent-endpoint-lookup.ttl': '600', 'agent-endpoint-lookup.size': '4'}))
+    proc = Processor()
+    lookups = {t: {'type': t, 'data': {'name': 'x'}} for t in cache.LedgerCache.LOOKUP_FOR_SEND.values()}
+    for form in lookups.values():
+        await lc.process_post(form, proc)
+    for (send, lookup_type) in cache.LedgerCache.LOOKUP_FOR_SEND.items():
+        await lc.process_post({'type': send, 'data': {'name': 'x'}}, proc)
+        for (t, form) in lookups.items():
+            calls = len(proc.calls)
+            await lc.process_post(form, proc)
+            assert len(proc.calls) == calls + (1 if t == lookup_type else 0)  # only the sent type refetches
+
+
+@pytest.mark.asyncio
+async def test_key_ignores_data_key_order(clock):
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    await lc.process_post({'type': 'schema-lookup', 'data': {'name': 'a', 'version': '1.0'}}, proc)
+    await lc.process_post({'type': 'schema-lookup', 'data': {'version': '1.0', 'name': 'a'}}, proc)
+    assert len(proc.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl_per_type(clock):
+    lc = cache.LedgerCache(CFG)  # schema-lookup 86400 s, agent-nym-lookup 600 s
+    proc = Processor()
+    forms = [{'type': t, 'data': {'name': 'x'}} for t in ('schema-lookup', 'agent-nym-lookup')]
+    for form in forms:
+        await lc.process_post(form, proc)
+    clock.now += 599
+    for form in forms:
+        await lc.process_post(form, proc)
+    assert len(proc.calls) == 2
+    clock.now += 2
+    for form in forms:
+        await lc.process_post(form, proc)
+    assert [f['type'] for f in proc.calls[2:]] == ['agent-nym-lookup']
+    clock.now += 86400
+    await lc.process_post(forms[0], proc)
+    assert len(proc.calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_size_per_type(clock):
+    lc = cache.LedgerCache(CFG)  # schema-lookup size 2, agent-nym-lookup size 4
+    proc = Processor()
+    for i in range(6):
+        await lc.process_post(schema(str(i)), proc)
+        await lc.process_post({'type': 'agent-nym-lookup', 'data': {'name': str(i)}}, proc)
+    stats = lc.stats()
+    assert stats['schema-lookup']['size'] == 2 and stats['schema-lookup']['evictions'] == 4
+    assert stats['agent-nym-lookup']['size'] == 4 and stats['agent-nym-lookup']['evictions'] == 2
+
+
+def test_unconfigured_type_not_cached():
+    lc = cache.LedgerCache(dict(CFG, **{'agent-endpoint-lookup.ttl': '600'}))  # no size
+    assert lc.stats()['agent-endpoint-lookup'] == {
+        'hits': 0,
+        'misses': 0,
+        'evictions': 0,
+        'invalidations': 0,
+        'coalesced': 0,
+        'size': 0
+    }
+    lc.invalidate('agent-endpoint-lookup')
+    assert lc.stats()['agent-endpoint-lookup']['invalidations'] == 0  # nothing to invalidate
+
+
+@pytest.mark.asyncio
+async def test_stats(clock):
+    lc = cache.LedgerCache(CFG)
+    proc = Processor()
+    await lc.process_post(schema('a'), proc)  # miss
+    await lc.process_post(schema('a'), proc)  # hit
+    await lc.process_post(schema('b'), proc)  # miss
+    await lc.process_post(schema('c'), proc)  # miss, evicts a
+    await lc.process_post(schema('c'), proc)  # hit
+    proc.gate = asyncio.Event()
+    waiters = [asyncio.ensure_future(lc.process_post(schema('d'), proc)) for _ in range(3)]  # miss, 2 coalesced
+    await settle()
+    proc.gate.set()
+    await asyncio.gather(*waiters)  # evicts b
+    proc.gate = None
+    await lc.process_post({'type': 'schema-send', 'data': {'name': 'e'}}, proc)  # invalidation
+    await lc.process_post(schema('d'), proc)  # miss
+    await lc.process_post({'type': 'agent-nym-lookup', 'data': {'name': 'a'}}, proc)  # miss, other type
+    stats = lc.stats()
+    assert stats['schema-lookup'] == {
+        'hits': 2,
+        'misses': 5,
+        'evictions': 2,
+        'invalidations': 1,
+        'coalesced': 2,
+        'size': 1
+    }
+    assert stats['agent-nym-lookup'] == {
+        'hits': 0,
+        'misses': 1,
+        'evictions': 0,
+        'invalidations': 0,
+        'coalesced': 0,
+        'size': 1
+    }
+    assert stats['agent-endpoint-lookup']['misses'] == 0
+    clock.now += 86401
+    await lc.process_post(schema('d'), proc)  # expired entry: miss, not hit
+    assert lc.stats()['schema-lookup']['misses'] == 6 and lc.stats()['schema-lookup']['hits'] == 2
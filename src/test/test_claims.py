@@ -0,0 +1,334 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from von_agent.error import JSONValidation
+
+import json
+import pytest
+
+
+claims = load_app_module('claims')
+
+BC = {'did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'}
+SRI = {'did': 'Xx2Y6RkV3SrPzWRjvUWsHR', 'name': 'sri', 'version': '1.0'}
+
+
+def claim_info(n, schema_key=BC, **attrs):
+    return {
+        'referent': 'claim::{:04d}'.format(n),
+        'attrs': dict(
+            {'id': str(n), 'legalName': 'Org {}'.format(n), 'effectiveDate': '201{}-01-01'.format(n % 10)},
+            **attrs),
+        'schema_key': schema_key,
+        'issuer_did': schema_key['did'],
+        'revoc_reg_seq_no': None
+    }
+
+
+def found_json(infos):
+    """
+    Return claim-request response json finding input claim infos on two requested attributes.
+    """
+
+    return json.dumps({
+        'proof-req': {'nonce': '1', 'name': 'find_req_0', 'version': '1.0'},
+        'claims': {
+            'attrs': {'21_id_uuid': infos, '21_legalName_uuid': infos},
+            'predicates': {}
+        }
+    })
+
+
+def referents(rv_json):
+    rv = json.loads(rv_json)
+    return sorted({c['referent'] for c in rv['claims']['attrs']['21_id_uuid']})
+
+
+def test_select_page_limit_next_cursor():
+    rv = json.loads(claims.ClaimSelection({'limit': 3}).apply(found_json([claim_info(n) for n in range(7, 0, -1)])))
+    assert [c['referent'] for c in rv['claims']['attrs']['21_id_uuid']] == [  # agent order kept within page
+        'claim::0003', 'claim::0002', 'claim::0001']
+    assert rv['claims']['attrs']['21_legalName_uuid'] == rv['claims']['attrs']['21_id_uuid']
+    assert rv['next-cursor'] == 'claim::0003'
+
+
+def test_select_cursor_round_trip():
+    infos = [claim_info(n) for n in range(1, 8)]
+    seen = []
+    cursor = None
+    while True:
+        spec = {'limit': 3} if cursor is None else {'limit': 3, 'cursor': cursor}
+        rv_json = claims.ClaimSelection(spec).apply(found_json(infos))
+        seen.extend(referents(rv_json))
+        cursor = json.loads(rv_json)['next-cursor']
+        if cursor is None:
+            break
+    assert seen == ['claim::{:04d}'.format(n) for n in range(1, 8)]  # each claim once, in order
+
+
+def test_select_last_page_exact_fit():
+    rv = json.loads(claims.ClaimSelection({'limit': 2, 'cursor': 'claim::0002'}).apply(
+        found_json([claim_info(n) for n in range(1, 5)])))
+    assert referents(json.dumps(rv)) == ['claim::0003', 'claim::0004']
+    assert rv['next-cursor'] is None
+
+
+def test_select_empty_page():
+    rv = json.loads(claims.ClaimSelection({'limit': 3, 'cursor': 'claim::0009'}).apply(
+        found_json([claim_info(n) for n in range(1, 4)])))
+    assert rv['claims']['attrs'] == {'21_id_uuid': [], '21_legalName_uuid': []}
+    assert rv['next-cursor'] is None
+
+    rv = json.loads(claims.ClaimSelection({'attr-eq': {'legalName': 'nobody'}}).apply(found_json([claim_info(1)])))
+    assert rv['claims']['attrs']['21_id_uuid'] == []
+    assert rv['next-cursor'] is None
+
+
+def test_select_filters():
+    infos = [claim_info(n) for n in range(1, 6)] + [claim_info(6, SRI)]
+    spec = {
+        'schemata': [{'origin-did': BC['did'], 'name': BC['name'], 'version': BC['version']}],
+        'attr-range': {'id': {'min': 2, 'max': 4}}
+    }
+    assert referents(claims.ClaimSelection(spec).apply(found_json(infos))) == [
+        'claim::0002', 'claim::0003', 'claim::0004']
+    assert referents(claims.ClaimSelection({'attr-eq': {'id': 5}}).apply(found_json(infos))) == ['claim::0005']
+    assert referents(claims.ClaimSelection({'referents': ['claim::0001', 'claim::0006', 'claim::0099']}).apply(
+        found_json(infos))) == ['claim::0001', 'claim::0006']
+
+
+def test_select_range_numeric_and_not():
+    infos = [claim_info(n, id=v) for (n, v) in ((1, '9'), (2, '10'), (3, '100'), (4, 'n/a'))]
+    # numbers compare numerically (9 < 10 <= 100, where as strings '9' > '10'); 'n/a' compares as string, >= '10'
+    assert referents(claims.ClaimSelection({'attr-range': {'id': {'min': '10'}}}).apply(found_json(infos))) == [
+        'claim::0002', 'claim::0003', 'claim::0004']
+    assert referents(claims.ClaimSelection({'attr-range': {'id': {'max': 50}}}).apply(found_json(infos))) == [
+        'claim::0001', 'claim::0002']
+    # date strings compare as strings
+    dates = {'effectiveDate': {'min': '2012-06-01', 'max': '2014-01-01'}}
+    assert referents(claims.ClaimSelection({'attr-range': dates}).apply(
+        found_json([claim_info(n) for n in range(1, 6)]))) == ['claim::0003', 'claim::0004']
+    # attribute absent: no match
+    assert referents(claims.ClaimSelection({'attr-range': {'absent': {'min': 0}}}).apply(found_json(infos))) == []
+
+
+@pytest.mark.parametrize('spec', [
+    [],
+    {'page': 1},
+    {'limit': 0},
+    {'limit': 'many'},
+    {'schemata': [{'name': 'bc-reg'}]},
+    {'attr-range': {'id': 5}}
+])
+def test_select_bad_spec(spec):
+    with pytest.raises(JSONValidation):
+        claims.ClaimSelection(spec)
+
+
+class FakeWallet:
+    """
+    Wallet holding fixture claim infos, answering as indy-sdk: all claims, or claims per proof request.
+    """
+
+    def __init__(self, infos):
+        self.handle = 1
+        self.infos = list(infos)
+        self.scans = 0
+
+    async def prover_get_claims(self, wallet_handle, filter_json):
+        self.scans += 1
+        return json.dumps(self.infos)
+
+    async def prover_get_claims_for_proof_req(self, wallet_handle, proof_req_json):
+        proof_req = json.loads(proof_req_json)
+
+        def on_schema(req):
+            return [c for c in self.infos if c['schema_key'] == req['restrictions'][0]['schema_key']]
+
+        def at_least(c, req):
+            try:
+                return int(c['attrs'][req['attr_name']]) >= req['value']
+            except (KeyError, ValueError):
+                return False
+
+        return json.dumps({
+            'attrs': {
+                uuid: [c for c in on_schema(req) if req['name'] in c['attrs']]
+                for (uuid, req) in proof_req['requested_attrs'].items()
+            },
+            'predicates': {
+                uuid: [c for c in on_schema(req) if at_least(c, req)]
+                for (uuid, req) in proof_req['requested_predicates'].items()
+            }
+        })
+
+
+class FakeHolderProver:
+    """
+    Just enough HolderProver for ClaimIndex, and for von_agent's HolderProver.get_claims() to filter as reference.
+    """
+
+    ATTR_NAMES = {'bc-reg': ['id', 'legalName', 'orgTypeId', 'effectiveDate'], 'sri': ['id', 'legalName']}
+
+    def __init__(self, wallet):
+        self.wallet = wallet
+
+    async def get_schema(self, s_key):
+        return json.dumps({'seqNo': 21 if s_key.name == 'bc-reg' else 22, 'data': {
+            'name': s_key.name,
+            'version': s_key.version,
+            'attr_names': FakeHolderProver.ATTR_NAMES[s_key.name]}})
+
+    async def create_proof(self, proof_req, claims_found, requested_claims):
+        return json.dumps({'requested': requested_claims})
+
+
+def spec(schema_key):
+    return {'origin-did': schema_key['did'], 'name': schema_key['name'], 'version': schema_key['version']}
+
+
+def claim_request(attr_match=(), pred_match=(), requested_attrs=(), msg_type='claim-request'):
+    return {
+        'type': msg_type,
+        'data': {
+            'schemata': [spec(BC)],
+            'claim-filter': {
+                'attr-match': [{'schema': spec(s), 'match': m} for (s, m) in attr_match],
+                'pred-match': [
+                    {'schema': spec(s), 'match': [{'attr': a, 'pred-type': '>=', 'value': v} for (a, v) in m]}
+                    for (s, m) in pred_match
+                ]
+            },
+            'requested-attrs': [{'schema': spec(s), 'names': n} for (s, n) in requested_attrs]
+        }
+    }
+
+
+def wallet_infos():
+    return ([claim_info(n, orgTypeId=str(n % 3)) for n in range(1, 13)] +
+        [claim_info(13, orgTypeId='n/a'), claim_info(14, SRI), claim_info(15, SRI)])
+
+
+@pytest.fixture
+def holder(monkeypatch, tmpdir):
+    from von_agent import agents
+
+    wallet = FakeWallet(wallet_infos())
+    monkeypatch.setattr(claims, 'anoncreds', wallet)
+    monkeypatch.setattr(agents, 'anoncreds', wallet)
+    return (FakeHolderProver(wallet), claims.ClaimIndex({'enabled': 'true'}, str(tmpdir), 'test'))
+
+
+async def reference(ag, form, proof_req):
+    """
+    Return claims found as von_agent's HolderProver filters them, scanning the wallet, on proof request from index.
+    """
+
+    from von_agent.agents import HolderProver
+    from von_agent.schemakey import schema_key_for
+
+    claim_filter = form['data']['claim-filter']
+    filt = {schema_key_for(m['schema']): {'attr-match': m['match']} for m in claim_filter['attr-match']}
+    for pred_match in claim_filter['pred-match']:
+        filt.setdefault(schema_key_for(pred_match['schema']), {})['pred-match'] = pred_match['match']
+    (_, claims_json) = await HolderProver.get_claims(ag, json.dumps(proof_req), filt)
+    return json.loads(claims_json)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('form', [
+    claim_request(),
+    claim_request(attr_match=[(BC, {'legalName': 'Org 7'})]),
+    claim_request(attr_match=[(BC, {'orgTypeId': 1, 'effectiveDate': '2014-01-01'})]),
+    claim_request(attr_match=[(BC, {'legalName': 'nobody'})]),
+    claim_request(pred_match=[(BC, [('id', 10)])]),
+    claim_request(pred_match=[(BC, [('orgTypeId', 1)])]),
+    claim_request(attr_match=[(BC, {'orgTypeId': 2})], pred_match=[(BC, [('id', 6)])]),
+    claim_request(attr_match=[(SRI, {'id': 14})], requested_attrs=[(SRI, []), (BC, ['legalName'])]),
+    claim_request(requested_attrs=[(BC, ['id', 'legalName'])], pred_match=[(BC, [('id', 12)])])
+])
+async def test_index_matches_von_agent(holder, form):
+    (ag, index) = holder
+    rv = json.loads(await index.process_post(ag, form))
+    assert rv['claims'] == await reference(ag, form, rv['proof-req'])
+
+
+@pytest.mark.asyncio
+async def test_index_iter_claims_lazy(holder, monkeypatch):
+    (ag, index) = holder
+    form = claim_request(attr_match=[(BC, {'orgTypeId': 1})], pred_match=[(BC, [('id', 10)])])
+    (proof_req, claims_found) = await index.find_claims(ag, form)
+
+    calls = []
+    candidates = index.candidates
+    monkeypatch.setattr(index, 'candidates', lambda *args: calls.append(args) or candidates(*args))
+    (iter_req, found) = await index.iter_claims(ag, form)
+    assert iter_req['requested_attrs'] == proof_req['requested_attrs']
+    assert not calls  # nothing resolved before caller advances
+    first = next(found)
+    assert len(calls) == 1 and first == ('attrs',) + next(iter(claims_found['attrs'].items()))
+    rest = list(found)
+    assert len(calls) == 1 + len(rest)
+    assert {(k, uuid): claims for (k, uuid, claims) in [first] + rest} == {
+        (k, uuid): claims for k in ('attrs', 'predicates') for (uuid, claims) in claims_found[k].items()}
+
+
+@pytest.mark.asyncio
+async def test_index_proof_request(holder):
+    (ag, index) = holder
+    form = claim_request(attr_match=[(BC, {'legalName': 'Org 7'})], msg_type='proof-request')
+    rv = json.loads(await index.process_post(ag, form))
+    requested_attrs = rv['proof']['requested']['requested_attrs']
+    assert sorted(requested_attrs) == ['21_{}_uuid'.format(a) for a in sorted(FakeHolderProver.ATTR_NAMES['bc-reg'])]
+    assert all(r == ['claim::0007', True] for r in requested_attrs.values())
+
+    with pytest.raises(claims.ClaimsFocus):  # many claims per attribute
+        await index.process_post(ag, claim_request(attr_match=[(BC, {'orgTypeId': 1})], msg_type='proof-request'))
+
+
+@pytest.mark.asyncio
+async def test_index_stale_on_touch_and_clear(holder, tmpdir):
+    (ag, index) = holder
+    form = claim_request(attr_match=[(BC, {'legalName': 'Org 77'})])
+
+    def found(rv_json):
+        return {c['referent'] for cs in json.loads(rv_json)['claims']['attrs'].values() for c in cs}
+
+    assert found(await index.process_post(ag, form)) == set()
+    assert ag.wallet.scans == 1
+    await index.process_post(ag, form)
+    assert ag.wallet.scans == 1  # fresh: no scan
+
+    ag.wallet.infos.append(claim_info(77))  # as claim-store would
+    assert found(await index.process_post(ag, form)) == set()  # not stamped stale yet
+    await index.touch()
+    assert found(await index.process_post(ag, form)) == {'claim::0077'}
+    assert ag.wallet.scans == 2
+
+    other = claims.ClaimIndex({'enabled': 'true'}, str(tmpdir), 'test')  # another worker process on the shared wallet
+    await other.process_post(ag, form)
+    assert ag.wallet.scans == 3
+    ag.wallet.infos = []  # as claims-reset would
+    await other.clear()
+    assert found(await other.process_post(ag, form)) == set()
+    assert found(await index.process_post(ag, form)) == set()  # sees other's stamp
+    assert ag.wallet.scans == 5
+
+
+def test_index_off_by_default(tmpdir):
+    assert not claims.ClaimIndex({}, str(tmpdir), 'test').enabled
+    assert claims.ClaimIndex({'enabled': 'true'}, str(tmpdir), 'test').enabled
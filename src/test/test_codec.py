@@ -0,0 +1,120 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from importlib import import_module, reload
+from os import environ
+
+import json
+import pytest
+
+
+codec = load_app_module('codec')
+
+DOC = {
+    'zeta': [1, -2, 2 ** 64, 10 ** 30],
+    'alpha': {'path': 'a/b/c', 'name': 'Société Générale ☃', 'quote': '"\n\t'},
+    'float': [0.1, 0.30000000000000004, -0.0, 123456.789],
+    'flags': [None, True, False],
+    'empty': [{}, []]
+}
+
+
+def backend_available(name):
+    if name == 'json':
+        return True
+    try:
+        import_module(name)
+        return True
+    except ImportError:
+        return False
+
+
+@pytest.fixture(params=['orjson', 'ujson', 'json'])
+def pinned(request):
+    """
+    Yield codec module reloaded with JSON_CODEC pinned to backend parameter; restore on teardown.
+    """
+
+    if not backend_available(request.param):
+        pytest.skip('{} not installed'.format(request.param))
+    prior = environ.get('JSON_CODEC', None)
+    environ['JSON_CODEC'] = request.param
+    try:
+        yield (request.param, reload(codec))
+    finally:
+        if prior is None:
+            environ.pop('JSON_CODEC')
+        else:
+            environ['JSON_CODEC'] = prior
+        reload(codec)
+
+
+def test_pin(pinned):
+    (name, mod) = pinned
+    (enc, dec) = mod.BACKEND.split('/')
+    assert {enc, dec} <= {name, 'json'}
+    if name == 'json':
+        assert mod.BACKEND == 'json/json'
+    else:
+        assert enc == name  # every installed backend encodes the probe canonically
+
+
+def test_canonical(pinned):
+    (_, mod) = pinned
+    assert mod.dumps(DOC, sort_keys=True) == json.dumps(
+        DOC,
+        ensure_ascii=False,
+        separators=(',', ':'),
+        sort_keys=True)
+    assert mod.loads(mod.dumps(DOC)) == DOC
+
+
+def test_sort_keys(pinned):
+    (_, mod) = pinned
+    doc = {'b': 1, 'a': {'d': 1, 'c': 2}}
+    assert mod.dumps(doc, sort_keys=True) == '{"a":{"c":2,"d":1},"b":1}'
+    assert mod.dumps(doc) == '{"b":1,"a":{"d":1,"c":2}}'  # insertion order
+
+
+def test_ensure_ascii_false(pinned):
+    (_, mod) = pinned
+    assert mod.dumps({'name': 'é☃', 'url': 'http://x/y'}) == '{"name":"é☃","url":"http://x/y"}'
+    assert mod.loads('{"name":"\\u00e9\\u2603"}') == {'name': 'é☃'}
+    assert mod.loads('{"name":"é☃"}'.encode('utf-8')) == {'name': 'é☃'}
+
+
+def test_fallback(pinned):
+    (_, mod) = pinned
+    assert mod.dumps([2 ** 64, -(10 ** 30)]) == '[18446744073709551616,-1000000000000000000000000000000]'
+    rv = mod.loads('[18446744073709551616]')
+    assert rv == [2 ** 64] and isinstance(rv[0], int)  # not decoded to float
+    with pytest.raises(ValueError):
+        mod.loads('{"unterminated": ')
+    with pytest.raises(TypeError):
+        mod.dumps({'not': object()})
+
+
+def test_with_fallback():
+    calls = []
+
+    def failing(obj, sort_keys=False):
+        calls.append(obj)
+        raise OverflowError()
+
+    dumps = codec._with_fallback(failing, codec._std_dumps, (OverflowError,))
+    assert dumps({'b': 'é', 'a': 1}, sort_keys=True) == '{"a":1,"b":"é"}'
+    assert len(calls) == 1
@@ -0,0 +1,162 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from os import getpid, getppid
+from subprocess import Popen
+
+import asyncio
+import json
+import pytest
+
+
+issue = load_app_module('issue')
+store = load_app_module('store')
+
+SCHEMA = {'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'}
+HOLDER_DID = 'Xx2Y6RkV3SrPzWRjvUWsHR'
+BUSY = (429, 'Too many pending claim-create messages', 429, {'Retry-After': '0'})
+NOT_READY = (503, 'Agent is not ready (registering)', 503, {'Retry-After': '0'})
+
+
+class Step:
+    """
+    Message processing stand-in: answers each form in turn with the next of the configured failures for its type,
+    then succeeds; records message types as processed.
+    """
+
+    RESPONSES = {
+        'claim-offer-create': '{"offer": 1}',
+        'claim-offer-store': '{"claim-req": 1}',
+        'claim-create': '{"claim": 1}',
+        'claim-store': '{}'
+    }
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.processed = []
+
+    async def __call__(self, form, where):
+        self.processed.append(form['type'])
+        pending = self.failures.get(form['type'], [])
+        if pending:
+            return (None, pending.pop(0))
+        return (Step.RESPONSES[form['type']], None)
+
+
+def dead_pid():
+    proc = Popen(['true'])
+    proc.wait()
+    return proc.pid
+
+
+@pytest.fixture
+def dir_store(monkeypatch, tmpdir):
+    monkeypatch.setattr(store.LedgerStore, 'dir_store', str(tmpdir))
+    return str(tmpdir)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('failures,calls,status', [
+    ([], 1, None),
+    ([BUSY, NOT_READY], 3, None),
+    ([BUSY, NOT_READY, BUSY], 3, 429),  # retries exhausted: report last rejection
+    ([(400, 'Bad claim attributes', 400, None), BUSY], 1, 400)  # no retry on other failures
+])
+async def test_process_retry_limit(failures, calls, status):
+    step = Step({'claim-create': list(failures)})
+    bulk = issue.BulkIssue({'retry.max': '2'}, step)
+    (rv_json, failed) = await bulk._process({'type': 'claim-create'}, 'test')
+    assert len(step.processed) == calls
+    if status is None:
+        assert (rv_json, failed) == (Step.RESPONSES['claim-create'], None)
+    else:
+        assert rv_json is None and failed[2] == status
+
+
+async def run(bulk):
+    """
+    Wait for jobs running in bulk issue instance to finish.
+    """
+
+    while bulk._tasks:
+        await asyncio.gather(*bulk._tasks.values())
+
+
+@pytest.mark.asyncio
+async def test_submit_runs_job(dir_store):
+    step = Step({'claim-store': [BUSY]})
+    bulk = issue.BulkIssue({'concurrency': '2'}, step)
+    await bulk.open('test')
+    try:
+        (job_id, created) = await bulk.submit(SCHEMA, HOLDER_DID, [{'id': i} for i in range(3)])
+        assert created
+        assert await bulk.submit(SCHEMA, HOLDER_DID, [], job_id) == (job_id, False)
+        await run(bulk)
+        status = await bulk.status(job_id)
+        assert (status['status'], status['succeeded'], status['failed'], status['pending']) == ('done', 3, 0, 0)
+        assert step.processed.count('claim-offer-create') == 1 and step.processed.count('claim-store') == 4
+    finally:
+        bulk.close()
+
+
+@pytest.mark.asyncio
+async def test_resume_adopts_orphaned_jobs(dir_store):
+    jobs = {'dead': dead_pid(), 'mine': getpid(), 'live': getppid()}  # job id to owner process id
+    db = store.IssueStore('test')
+    for (job_id, owner) in jobs.items():
+        db.create(job_id, json.dumps(SCHEMA), HOLDER_DID, [json.dumps({'id': job_id})], owner)
+    db.set_claim_req('mine', '{"claim-req": 1}')
+    db.close()
+
+    step = Step()
+    bulk = issue.BulkIssue({}, step)
+    await bulk.open('test')
+    try:
+        await bulk.resume()
+        assert set(bulk._tasks) == {'dead', 'mine'}  # live owner keeps its job
+        await run(bulk)
+        assert [(await bulk.status(job_id))['status'] for job_id in ('dead', 'mine', 'live')] == [
+            'done',
+            'done',
+            'running']
+        assert step.processed.count('claim-offer-create') == 1  # resumed job keeps its stored claim request
+
+        await bulk.resume()
+        assert not bulk._tasks
+    finally:
+        bulk.close()
+
+    check = store.IssueStore('test')
+    try:
+        assert [check.job(job_id)['owner'] for job_id in ('dead', 'mine', 'live')] == [getpid(), getpid(), getppid()]
+    finally:
+        check.close()
+
+
+@pytest.mark.asyncio
+async def test_job_fails_on_offer_rejection(dir_store):
+    step = Step({'claim-offer-create': [(400, 'No such schema', 400, None)]})
+    bulk = issue.BulkIssue({}, step)
+    await bulk.open('test')
+    try:
+        (job_id, _) = await bulk.submit(SCHEMA, HOLDER_DID, [{'id': 0}])
+        await run(bulk)
+        status = await bulk.status(job_id)
+        assert (status['status'], status['message'], status['pending']) == ('failed', 'No such schema', 1)
+        assert step.processed == ['claim-offer-create']
+    finally:
+        bulk.close()
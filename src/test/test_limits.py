@@ -0,0 +1,141 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+
+import asyncio
+import pytest
+
+
+limits = load_app_module('service.limits')
+
+CFG = {
+    'total': '6',
+    'default.concurrency': '4',
+    'default.queue': '4',
+    'claim-create.concurrency': '2',
+    'claim-create.queue': '2',
+    'retry.after': '3'
+}
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+async def hold(lim, msg_type, gate):
+    async with lim.slot(msg_type):
+        await gate.wait()
+
+
+def gate_stats(lim, msg_type):
+    return lim.stats()['msg.types'][msg_type]
+
+
+@pytest.mark.asyncio
+async def test_type_queue_full_429():
+    lim = limits.Limits(CFG)
+    gate = asyncio.Event()
+    held = [asyncio.ensure_future(hold(lim, 'claim-create', gate)) for _ in range(4)]  # 2 active, 2 queued
+    await settle()
+    s = gate_stats(lim, 'claim-create')
+    assert (s['concurrency'], s['queue'], s['active'], s['waiting']) == (2, 2, 2, 2)
+    assert lim.stats()['pending'] == 4
+
+    with pytest.raises(limits.LimitExceeded) as x_info:
+        await lim.acquire('claim-create')
+    assert x_info.value.status == 429 and x_info.value.retry_after == 3
+    assert gate_stats(lim, 'claim-create')['rejected'] == 1
+    assert lim.stats()['pending'] == 4  # rejection takes no place
+
+    async with lim.slot('schema-lookup'):  # other types keep their own bound
+        assert gate_stats(lim, 'schema-lookup')['active'] == 1
+
+    gate.set()
+    await asyncio.gather(*held)
+    s = gate_stats(lim, 'claim-create')
+    assert (s['active'], s['waiting'], s['rejected']) == (0, 0, 1)
+    assert lim.stats()['pending'] == 0
+    async with lim.slot('claim-create'):  # released: admits again
+        assert gate_stats(lim, 'claim-create')['active'] == 1
+
+
+@pytest.mark.asyncio
+async def test_total_bound_503():
+    lim = limits.Limits(CFG)
+    gate = asyncio.Event()
+    held = [asyncio.ensure_future(hold(lim, 'claim-create', gate)) for _ in range(3)]  # 2 active, 1 queued
+    held += [asyncio.ensure_future(hold(lim, 'schema-lookup', gate)) for _ in range(3)]
+    await settle()
+    assert lim.stats()['pending'] == 6
+
+    with pytest.raises(limits.LimitExceeded) as x_info:
+        await lim.acquire('agent-nym-lookup')  # its own gate is empty, but server is at capacity
+    assert x_info.value.status == 503 and x_info.value.retry_after == 3
+    assert gate_stats(lim, 'agent-nym-lookup')['rejected'] == 1
+
+    gate.set()
+    await asyncio.gather(*held)
+    assert lim.stats()['pending'] == 0
+    async with lim.slot('agent-nym-lookup'):
+        assert lim.stats()['pending'] == 1
+    assert all(s['active'] == 0 and s['waiting'] == 0 for s in lim.stats()['msg.types'].values())
+
+
+@pytest.mark.asyncio
+async def test_queued_moves_up_in_order():
+    lim = limits.Limits(CFG)
+    gates = [asyncio.Event() for _ in range(3)]
+    held = [asyncio.ensure_future(hold(lim, 'claim-create', g)) for g in gates]
+    await settle()
+    s = gate_stats(lim, 'claim-create')
+    assert (s['active'], s['waiting']) == (2, 1)
+    gates[0].set()
+    await settle()
+    s = gate_stats(lim, 'claim-create')
+    assert (s['active'], s['waiting']) == (2, 0)
+    assert held[0].done() and not held[2].done()
+    for g in gates:
+        g.set()
+    await asyncio.gather(*held)
+
+
+@pytest.mark.asyncio
+async def test_cancel_while_queued():
+    lim = limits.Limits(CFG)
+    gate = asyncio.Event()
+    held = [asyncio.ensure_future(hold(lim, 'claim-create', gate)) for _ in range(3)]
+    await settle()
+    held[2].cancel()  # queued: gives up its place without ever holding one
+    await settle()
+    s = gate_stats(lim, 'claim-create')
+    assert (s['active'], s['waiting']) == (2, 0)
+    assert lim.stats()['pending'] == 2
+    gate.set()
+    await asyncio.gather(*held[:2])
+    assert lim.stats()['pending'] == 0
+
+
+@pytest.mark.asyncio
+async def test_release_on_error():
+    lim = limits.Limits(CFG)
+    with pytest.raises(ValueError):
+        async with lim.slot('claim-create'):
+            raise ValueError('boom')
+    s = gate_stats(lim, 'claim-create')
+    assert (s['active'], s['waiting']) == (0, 0)
+    assert lim.stats()['pending'] == 0
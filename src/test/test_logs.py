@@ -0,0 +1,132 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+
+import asyncio
+import json
+import logging
+import pytest
+
+
+logs = load_app_module('service.logs')
+
+
+class Records(logging.Handler):
+    """
+    Handler keeping records and their formatted text in memory.
+    """
+
+    def __init__(self, formatter=None):
+        super().__init__()
+        self.records = []
+        self.lines = []
+        self.setFormatter(formatter or logs.JsonFormatter())
+
+    def emit(self, record):
+        self.records.append(record)
+        self.lines.append(self.format(record))
+
+
+@pytest.fixture
+def logger():
+    rv = logging.getLogger('test_logs')
+    rv.propagate = False
+    rv.setLevel(logging.INFO)
+    yield rv
+    for handler in list(rv.handlers):
+        rv.removeHandler(handler)
+        handler.close()
+
+
+@pytest.mark.asyncio
+async def test_bind_per_task(logger):
+    out = Records()
+    out.addFilter(logs._ContextFilter())
+    logger.addHandler(out)
+
+    async def request(request_id):
+        logs.bind(request_id=request_id, msg_type='schema-lookup')
+        await asyncio.sleep(0)  # interleave with the other request
+        logger.info('lookup %s', request_id)
+        logger.info('done', extra={'status': 200, 'request_id': 'explicit'})
+
+    await asyncio.gather(request('r1'), request('r2'))
+    logger.info('no task context')
+
+    lines = [json.loads(line) for line in out.lines]
+    assert {(r['message'], r['request_id'], r['msg_type']) for r in lines if r['message'].startswith('lookup')} == {
+        ('lookup r1', 'r1', 'schema-lookup'),
+        ('lookup r2', 'r2', 'schema-lookup')}
+    assert [(r['request_id'], r['status']) for r in lines if r['message'] == 'done'] == [('explicit', 200)] * 2
+    assert 'request_id' not in lines[-1]
+
+
+def test_json_formatter(logger):
+    out = Records()
+    logger.addHandler(out)
+    try:
+        raise ValueError('bad claim')
+    except ValueError:
+        logger.exception('Failed on %s', 'claim-create')
+
+    line = json.loads(out.lines[0])
+    assert (line['level'], line['logger'], line['message']) == ('ERROR', 'test_logs', 'Failed on claim-create')
+    assert line['time'].endswith('Z') and isinstance(line['pid'], int)
+    assert 'ValueError: bad claim' in line['exc']
+
+
+def test_queue_handler(logger, monkeypatch):
+    targets = []
+
+    def open_target():
+        targets.append(Records())
+        return targets[-1]
+
+    handler = logs._ProcessQueueHandler(open_target)
+    logger.addHandler(handler)
+    try:
+        raise KeyError('schema')
+    except KeyError:
+        logger.exception('Lookup %s failed', 'schema')
+    handler._listener.stop()  # drain queue
+    handler._listener = None
+    handler.start()
+
+    record = targets[0].records[0]
+    assert (record.msg, record.args, record.exc_info) == ('Lookup schema failed', None, None)
+    assert "KeyError: 'schema'" in record.exc_text
+
+    monkeypatch.setattr(logs, 'getpid', lambda: -1)  # as in a process forked after setup
+    logger.info('in child')
+    handler.close()
+    assert len(targets) == 3 and [r.msg for r in targets[2].records] == ['in child']
+
+
+def test_init(tmpdir):
+    root = logging.getLogger()
+    (level, handlers) = (root.level, list(root.handlers))
+    try:
+        logs.init(str(tmpdir), 'test', {'level': 'debug', 'format': 'json'})
+        logs.init(str(tmpdir), 'test', {})  # idempotent
+        added = [h for h in root.handlers if h not in handlers]
+        assert len(added) == 1 and root.level == logging.DEBUG
+        logging.getLogger('von_conx.test').debug('to file')
+        added[0].close()
+        root.removeHandler(added[0])
+        assert json.loads(tmpdir.join('test.log').read())['message'] == 'to file'
+    finally:
+        root.setLevel(level)
@@ -0,0 +1,92 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+
+import asyncio
+import pytest
+
+
+metrics = load_app_module('service.metrics')
+
+
+def samples(text):
+    """
+    Return dict mapping sample name and labels to value, from Prometheus text; check each metric has HELP and TYPE.
+    """
+
+    rv = {}
+    declared = set()
+    for line in text.splitlines():
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            declared.add((line[2:6], line.split(' ')[2]))
+            continue
+        (sample, value) = line.rsplit(' ', 1)
+        name = sample.split('{')[0]
+        assert any(('HELP', base) in declared and ('TYPE', base) in declared
+            for base in (name, name.rsplit('_', 1)[0]))
+        rv[sample] = float(value)
+    return rv
+
+
+def test_labels_escaped():
+    assert metrics._labels() == ''
+    assert metrics._labels(msg_type='a"b\\c', mode='native') == '{mode="native",msg_type="a\\"b\\\\c"}'
+
+
+def test_histogram_cumulative():
+    h = metrics.Histogram([0.1, 1.0])
+    for value in (0.05, 0.1, 0.5, 2.0):
+        h.observe(value)
+    assert h.lines('t', mode='proxy') == [
+        't_bucket{le="0.1",mode="proxy"} 2',  # bucket bound is inclusive
+        't_bucket{le="1.0",mode="proxy"} 3',
+        't_bucket{le="+Inf",mode="proxy"} 4',
+        't_sum{mode="proxy"} 2.65',
+        't_count{mode="proxy"} 4']
+
+
+def test_render():
+    m = metrics.Metrics({'latency.buckets': '1, 0.1'})
+    with m.timer('schema-lookup') as t:
+        assert m.in_flight == 1
+    with m.timer('claim-create') as t:
+        t.mode = 'proxy'
+        t.error_code = 503
+    m.observe('claim-create', 'proxy', 0.5)
+
+    s = samples(m.render({'pool': 0.25}))
+    assert m.in_flight == 0 and s['von_conx_in_flight'] == 0
+    assert s['von_conx_requests_total{mode="native",msg_type="schema-lookup"}'] == 1
+    assert s['von_conx_requests_total{mode="proxy",msg_type="claim-create"}'] == 2
+    assert s['von_conx_errors_total{error_code="503",msg_type="claim-create"}'] == 1
+    assert s['von_conx_request_seconds_bucket{le="0.1",mode="proxy",msg_type="claim-create"}'] == 1
+    assert s['von_conx_request_seconds_bucket{le="1.0",mode="proxy",msg_type="claim-create"}'] == 2
+    assert s['von_conx_request_seconds_count{mode="proxy",msg_type="claim-create"}'] == 2
+    assert s['von_conx_event_loop_lag_seconds_count'] == 0
+    assert s['von_conx_boot_phase_seconds{phase="pool"}'] == 0.25
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_watch():
+    m = metrics.Metrics({'loop.interval': '0.01'})
+    m.start()
+    try:
+        await asyncio.sleep(0.05)
+    finally:
+        m.close()
+    assert samples(m.render())['von_conx_event_loop_lag_seconds_count'] >= 1
+    assert m._watch is None
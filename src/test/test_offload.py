@@ -0,0 +1,166 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from queue import Queue
+
+import asyncio
+import pytest
+
+
+offload = load_app_module('service.offload')
+
+
+class Proc:
+    """
+    Worker process stand-in: records termination.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.name = '{}-0'.format(offload.PROCESS_NAME)
+        self.sentinel = -1
+        self.exitcode = -9
+        self.terminated = False
+
+    def join(self, timeout=None):
+        pass
+
+    def terminate(self):
+        self.terminated = True
+
+
+class Loop:
+    """
+    Event loop proxy: watches no sentinels and records scheduled respawns rather than run them.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_event_loop()
+        self.later = []
+
+    def create_future(self):
+        return self.loop.create_future()
+
+    def remove_reader(self, fd):
+        pass
+
+    def call_later(self, delay, fn, *args):
+        self.later.append((delay, fn.__name__, args))
+
+
+def running(cfg, pids=(101,)):
+    """
+    Return Offload instance as if started with worker processes on input pids, without spawning any:
+    tests play the workers' part on its task queue and result receiver.
+    """
+
+    rv = offload.Offload(dict({'processes': str(len(pids)), 'msg.types': 'proof-request'}, **cfg))
+    rv._loop = Loop()
+    rv._tasks = Queue()
+    rv._procs = {pid: (i, Proc(pid)) for (i, pid) in enumerate(pids)}
+    return rv
+
+
+def test_not_started():
+    o = offload.Offload({'processes': '2', 'msg.types': 'proof-request, verification-request'})
+    assert not o.handles('proof-request')  # no workers yet: process in the event loop
+    assert not offload.is_offload_process()
+    o.close()
+
+
+@pytest.mark.asyncio
+async def test_result():
+    o = running({})
+    assert o.handles('proof-request') and not o.handles('claim-create')
+    fut = asyncio.ensure_future(o.process_post({'type': 'proof-request'}))
+    await asyncio.sleep(0)
+    (task_id, form) = o._tasks.get_nowait()
+    assert form == {'type': 'proof-request'} and o.stats()['proof-request']['pending'] == 1
+
+    o._receive((101, task_id))
+    assert o._taken == {101: task_id}
+    o._receive((task_id, '{"proof": 1}', None, None))
+    assert await fut == '{"proof": 1}'
+    assert o._taken == {}
+    stats = o.stats()['proof-request']
+    assert (stats['pending'], stats['count'], stats['errors']) == (0, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_agent_error_relayed():
+    o = running({})
+    fut = asyncio.ensure_future(o.process_post({'type': 'proof-request'}))
+    await asyncio.sleep(0)
+    (task_id, _) = o._tasks.get_nowait()
+    o._receive((task_id, None, 1003, 'No such claim'))
+    with pytest.raises(offload.OffloadError) as x:
+        await fut
+    assert (int(x.value.error_code), str(x.value)) == (1003, 'No such claim')
+    assert o.stats()['proof-request']['errors'] == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_full():
+    o = running({'queue.max': '1', 'retry.after': '3'})
+    fut = asyncio.ensure_future(o.process_post({'type': 'proof-request'}))
+    await asyncio.sleep(0)
+    with pytest.raises(offload.OffloadFull):
+        await o.process_post({'type': 'proof-request'})
+    assert o.retry_after == 3 and o.stats()['proof-request']['rejected'] == 1
+
+    (task_id, _) = o._tasks.get_nowait()
+    o._receive((task_id, '{}', None, None))
+    assert await fut == '{}'
+
+
+@pytest.mark.asyncio
+async def test_worker_exits_on_task():
+    o = running({'retry.after': '2'}, (101, 102))
+    fut = asyncio.ensure_future(o.process_post({'type': 'proof-request'}))
+    await asyncio.sleep(0)
+    (task_id, _) = o._tasks.get_nowait()
+    o._receive((101, task_id))
+    o._exited(101)
+    with pytest.raises(offload.OffloadError) as x:
+        await fut
+    assert int(x.value.error_code) == 500 and '-9' in str(x.value)
+    assert list(o._procs) == [102] and o._loop.later == [(2, '_spawn', (0,))]
+
+    fut = asyncio.ensure_future(o.process_post({'type': 'proof-request'}))
+    await asyncio.sleep(0)
+    (task_id, _) = o._tasks.get_nowait()
+    o._receive((101, task_id))  # notice from worker already gone
+    with pytest.raises(offload.OffloadError) as x:
+        await fut
+    assert int(x.value.error_code) == 500
+
+
+@pytest.mark.asyncio
+async def test_timeout_replaces_stuck_worker():
+    o = running({'timeout': '0.05'})
+    fut = asyncio.ensure_future(o.process_post({'type': 'proof-request'}))
+    await asyncio.sleep(0)
+    (task_id, _) = o._tasks.get_nowait()
+    o._receive((101, task_id))
+    with pytest.raises(offload.OffloadError) as x:
+        await fut
+    assert int(x.value.error_code) == 504
+    assert o._procs[101][1].terminated
+
+    o._receive((task_id, '{}', None, None))  # late result: settled already
+    stats = o.stats()['proof-request']
+    assert (stats['pending'], stats['count'], stats['errors']) == (0, 1, 1)
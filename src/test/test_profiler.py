@@ -0,0 +1,87 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from time import monotonic
+
+import asyncio
+import pytest
+
+
+profiler = load_app_module('service.profiler')
+
+
+def spin_profiled(seconds):
+    end = monotonic() + seconds
+    while monotonic() < end:
+        pass
+
+
+def spin_other(seconds):
+    end = monotonic() + seconds
+    while monotonic() < end:
+        pass
+
+
+async def work(spin, rounds=5):
+    for _ in range(rounds):
+        spin(0.01)
+        await asyncio.sleep(0)
+    return 'done'
+
+
+@pytest.mark.asyncio
+async def test_run_off_session():
+    p = profiler.Profiler({})
+    coro = work(spin_other, 1)
+    assert p.run('schema-lookup', coro) is coro
+    assert await coro == 'done'
+
+
+@pytest.mark.asyncio
+async def test_sample():
+    p = profiler.Profiler({'interval': '0.001'})
+    session = asyncio.ensure_future(p.sample(0.2))
+    await asyncio.sleep(0)
+    with pytest.raises(profiler.ProfilerBusy):
+        await p.cprofile('schema-lookup', 0)
+    await work(spin_profiled, 10)
+    stacks = await session
+
+    lines = stacks.splitlines()
+    assert lines and all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
+    assert any('spin_profiled (test_profiler.py:' in line.split(';')[-1] for line in lines)
+    assert not p._busy
+
+
+@pytest.mark.asyncio
+async def test_cprofile_isolates_message_type():
+    p = profiler.Profiler({})
+    session = asyncio.ensure_future(p.cprofile('schema-lookup', 0.2))
+    await asyncio.sleep(0)
+    results = await asyncio.gather(
+        p.run('schema-lookup', work(spin_profiled)),
+        p.run('claim-create', work(spin_other)))  # interleaves on the loop, but is not the profiled type
+    assert results == ['done', 'done']
+    stats = await session
+    assert 'spin_profiled' in stats and 'spin_other' not in stats
+    assert not p._profiles  # session over: messages run unprofiled
+
+
+@pytest.mark.asyncio
+async def test_cprofile_no_messages():
+    p = profiler.Profiler({})
+    assert await p.cprofile('proof-request', 0.01) == 'No proof-request messages processed in 0.01 seconds\n'
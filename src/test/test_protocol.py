@@ -0,0 +1,98 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from os import walk
+from os.path import join as pjoin
+
+import json
+import pytest
+
+
+protocol = load_app_module('service.protocol')
+
+JSON_VALUES = (  # sample json slot values, by slot position modulo length
+    {'schema': {'origin-did': 'Q4zqM7aXqm7gDQkUVLng9h', 'name': 'bc-reg', 'version': '1.0'}},
+    [{'attr': 'id', 'pred-type': '>=', 'value': 1}, None, True, 1.5],
+    {'legalName': ['Org 1', 'Org 1'], 'é☃': 'a/b'},
+    ['legalName', 'effectiveDate'],
+    {}
+)
+
+
+def form_json(name, args, proxy_did=None):
+    """
+    Old path: interpolate slot values, as text, into template text and parse the result.
+    """
+
+    with open(pjoin(protocol.DIR_PROTO, '{}.json'.format(name)), 'r') as proto_f:
+        rv = json.loads(proto_f.read() % args)
+    if proxy_did:
+        rv['data']['proxy-did'] = proxy_did
+    return rv
+
+
+def sample(slots):
+    """
+    Return (values for Template.build(), text values for old interpolation) for template slots.
+    """
+
+    values = [
+        'slot-{}-Q4zqM7aXqm7gDQkUVLng9h'.format(i) if slot == 'str' else JSON_VALUES[i % len(JSON_VALUES)]
+        for (i, slot) in enumerate(slots)
+    ]
+    texts = tuple(v if slot == 'str' else json.dumps(v) for (v, slot) in zip(values, slots))
+    return (values, texts)
+
+
+def test_registry_covers_protocol_dir():
+    names = set()
+    for (dir_path, _, file_names) in walk(protocol.DIR_PROTO):
+        for file_name in file_names:
+            if file_name.endswith('.json'):
+                names.add(pjoin(dir_path, file_name)[len(protocol.DIR_PROTO) + 1:-len('.json')].replace('\\', '/'))
+    assert set(protocol.templates()) == names
+    assert 'schema-send/bc-reg/1.0/attr-names' in names
+
+
+@pytest.mark.parametrize('name', sorted(protocol.templates()))
+def test_golden(name):
+    template = protocol.templates()[name]
+    (values, texts) = sample(template.slots)
+    expected = form_json(name, texts)
+    assert protocol.form(name, *values) == expected
+    if isinstance(expected, dict) and 'data' in expected:
+        assert protocol.form(name, *values, proxy_did='Xx2Y6RkV3SrPzWRjvUWsHR') == form_json(
+            name,
+            texts,
+            proxy_did='Xx2Y6RkV3SrPzWRjvUWsHR')
+
+
+def test_build_is_fresh():
+    first = protocol.form('claim-offer-create', 'Q4zqM7aXqm7gDQkUVLng9h', 'bc-reg', '1.0', 'Xx2Y6RkV3SrPzWRjvUWsHR')
+    first['data']['schema']['name'] = 'altered'
+    first['data']['proxy-did'] = 'altered'
+    second = protocol.form('claim-offer-create', 'Q4zqM7aXqm7gDQkUVLng9h', 'bc-reg', '1.0', 'Xx2Y6RkV3SrPzWRjvUWsHR')
+    assert second == form_json(
+        'claim-offer-create',
+        ('Q4zqM7aXqm7gDQkUVLng9h', 'bc-reg', '1.0', 'Xx2Y6RkV3SrPzWRjvUWsHR'))
+
+
+def test_slot_count():
+    template = protocol.templates()['claim-create']
+    assert template.slots == ('json', 'json')
+    with pytest.raises(ValueError):
+        template.build({})
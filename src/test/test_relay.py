@@ -0,0 +1,181 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from aiohttp import web
+from bench import load_app_module
+from functools import partial
+from von_agent.error import ProxyHop
+
+import json
+import pytest
+
+
+cache = load_app_module('cache')
+relay = load_app_module('service.relay')
+trace = load_app_module('service.trace')
+
+PEER_DID = 'Xx2Y6RkV3SrPzWRjvUWsHR'
+NYM_LOOKUP = {'type': 'agent-nym-lookup', 'data': {'agent-nym': {'did': PEER_DID}, 'proxy-did': PEER_DID}}
+
+
+class Peer:
+    """
+    Local HTTP server standing in for the proxy DID's agent: records requests, answers with configured status.
+    """
+
+    def __init__(self, status=200):
+        self.status = status
+        self.requests = []  # (path, headers, body)
+
+    async def handle(self, request):
+        self.requests.append((request.path, dict(request.headers), json.loads(await request.text())))
+        if self.status != 200:
+            return web.Response(status=self.status, text='{}')
+        return web.Response(text='{"dest": "%s", "verkey": "~peer"}' % PEER_DID, content_type='application/json')
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post('/api/v0/{msg_type}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.endpoint = 'http://127.0.0.1:{}/api/v0'.format(self._runner.addresses[0][1])
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._runner.cleanup()
+
+
+class Agent:
+    """
+    Relaying agent: resolves the peer's endpoint as the ledger would, counting lookups.
+    """
+
+    did = 'Q4zqM7aXqm7gDQkUVLng9h'
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.lookups = 0
+
+    async def process_post(self, form):
+        assert form['type'] == 'agent-endpoint-lookup'
+        self.lookups += 1
+        return json.dumps({'endpoint': self.endpoint} if self.endpoint else {})
+
+
+def tracer(spans):
+    rv = trace.Tracer({'enabled': 'true', 'sample': '1'})
+    rv._export = spans.append  # keep finished spans in memory rather than write them
+    return rv
+
+
+def ledger_cache():
+    return cache.LedgerCache({
+        'agent-nym-lookup.ttl': '600',
+        'agent-nym-lookup.size': '16',
+        'agent-endpoint-lookup.ttl': '600',
+        'agent-endpoint-lookup.size': '16'
+    })
+
+
+@pytest.mark.asyncio
+async def test_cached_lookup_carries_request_trace():
+    spans = []
+    t = tracer(spans)
+    lc = ledger_cache()
+    r = relay.Relay({'timeout': '5'}, lc, t)
+    try:
+        async with Peer() as peer:
+            ag = Agent(peer.endpoint)
+            with t.span('POST agent-nym-lookup', root=True) as root:
+                rv = await lc.process_post(NYM_LOOKUP, partial(r.post, ag, parent=t.current()))
+            assert json.loads(rv)['dest'] == PEER_DID
+
+            (path, headers, body) = peer.requests[0]
+            assert path == '/api/v0/agent-nym-lookup'
+            assert 'proxy-did' not in body['data']
+            (version, trace_id, parent_id, flags) = headers['traceparent'].split('-')
+            relay_span = next(s for s in spans if s.name == 'relay')
+            assert (trace_id, parent_id) == (root.trace_id, relay_span.span_id)
+            assert relay_span.parent_id == root.span_id and relay_span.attrs['peer'] == peer.endpoint.split('/')[2]
+
+            with t.span('POST agent-nym-lookup', root=True):
+                await lc.process_post(NYM_LOOKUP, partial(r.post, ag, parent=t.current()))
+            assert len(peer.requests) == 1  # served from cache
+    finally:
+        await r.close()
+
+
+@pytest.mark.asyncio
+async def test_lookup_task_without_parent_is_untraced():
+    spans = []
+    t = tracer(spans)
+    lc = ledger_cache()
+    r = relay.Relay({'timeout': '5'}, lc, t)
+    try:
+        async with Peer() as peer:
+            with t.span('POST agent-nym-lookup', root=True):
+                await lc.process_post(NYM_LOOKUP, partial(r.post, Agent(peer.endpoint)))  # span follows task
+            assert 'traceparent' not in peer.requests[0][1]
+            assert [s.name for s in spans] == ['POST agent-nym-lookup']
+    finally:
+        await r.close()
+
+
+@pytest.mark.asyncio
+async def test_relay_in_request_task_sends_traceparent():
+    spans = []
+    t = tracer(spans)
+    r = relay.Relay({'timeout': '5'}, ledger_cache(), t)
+    try:
+        async with Peer() as peer:
+            upstream = '00-{}-{}-01'.format('ab' * 16, 'cd' * 8)
+            with t.span('POST claim-create', root=True, traceparent=upstream):
+                await r.post(Agent(peer.endpoint), dict(NYM_LOOKUP, type='claim-create'))
+            (version, trace_id, parent_id, flags) = peer.requests[0][1]['traceparent'].split('-')
+            relay_span = next(s for s in spans if s.name == 'relay')
+            assert (version, trace_id, parent_id, flags) == ('00', 'ab' * 16, relay_span.span_id, '01')
+    finally:
+        await r.close()
+
+
+@pytest.mark.asyncio
+async def test_relay_errors_and_stats():
+    t = trace.Tracer({})
+    r = relay.Relay({'timeout': '5', 'latency.buckets': '0.5, 5'}, ledger_cache(), t)
+    try:
+        async with Peer(status=500) as peer:
+            ag = Agent(peer.endpoint)
+            with pytest.raises(ProxyHop):
+                await r.post(ag, NYM_LOOKUP)
+            peer.status = 200
+            await r.post(ag, NYM_LOOKUP)
+            await r.post(ag, NYM_LOOKUP)
+            assert ag.lookups == 1  # endpoint resolved through ledger cache
+            assert 'traceparent' not in peer.requests[0][1]  # tracing disabled
+
+            stats = r.stats()[peer.endpoint.split('/')[2]]
+            assert stats['count'] == 3 and stats['errors'] == 1
+            assert stats['latency.histogram'] == {'0.5': 3, '5.0': 3, '+Inf': 3}
+            assert list(stats['latency.histogram']) == ['0.5', '5.0', '+Inf']
+
+        with pytest.raises(ProxyHop):  # peer gone
+            await r.post(ag, NYM_LOOKUP)
+        with pytest.raises(ProxyHop):  # no HTTP endpoint on ledger
+            await relay.Relay({}, ledger_cache(), t).post(Agent(None), NYM_LOOKUP)
+    finally:
+        await r.close()
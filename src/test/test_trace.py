@@ -0,0 +1,136 @@
+"""
+Copyright 2017-2018 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bench import load_app_module
+from io import StringIO
+from threading import Event
+
+import json
+import pytest
+
+
+trace = load_app_module('service.trace')
+
+UPSTREAM_TRACE = 'ab' * 16
+UPSTREAM_SPAN = 'cd' * 8
+
+
+class Output(StringIO):
+    """
+    Trace file stand-in: keeps its text on close.
+    """
+
+    def close(self):
+        self.text = self.getvalue()
+        super().close()
+
+
+def tracer(spans, **cfg):
+    rv = trace.Tracer(dict({'enabled': 'true', 'sample': '1'}, **cfg))
+    rv._export = spans.append
+    return rv
+
+
+def test_disabled():
+    t = trace.Tracer({})
+    assert t.span('POST schema-lookup', root=True) is trace.NO_SPAN
+    assert t.current() is trace.NO_SPAN
+    with t.span('x') as span:
+        span.set('k', 'v')
+        assert span.headers() == {}
+
+
+@pytest.mark.parametrize('traceparent,sample,continued', [
+    ('00-{}-{}-01'.format(UPSTREAM_TRACE, UPSTREAM_SPAN), '0', True),  # upstream sampled: continue regardless
+    ('00-{}-{}-00'.format(UPSTREAM_TRACE, UPSTREAM_SPAN), '1', None),  # upstream not sampled: do not trace
+    ('00-{}-{}-01'.format(UPSTREAM_TRACE.upper(), UPSTREAM_SPAN), '1', False),  # malformed: start own trace
+    (None, '1', False),
+    (None, '0', None)
+])
+@pytest.mark.asyncio
+async def test_root_span(traceparent, sample, continued):
+    spans = []
+    t = tracer(spans, sample=sample)
+    span = t.span('POST agent-nym-lookup', root=True, traceparent=traceparent)
+    if continued is None:
+        assert span is trace.NO_SPAN
+    elif continued:
+        assert (span.trace_id, span.parent_id) == (UPSTREAM_TRACE, UPSTREAM_SPAN)
+    else:
+        assert span.trace_id != UPSTREAM_TRACE and len(span.trace_id) == 32 and span.parent_id is None
+    assert t.span('child') is trace.NO_SPAN  # no root open: non-root span does not start a trace
+
+
+@pytest.mark.asyncio
+async def test_nested_spans():
+    spans = []
+    t = tracer(spans)
+    with t.span('POST claim-create', root=True) as root:
+        assert t.current() is root
+        with t.span('agent.process_post') as child:
+            assert t.current() is child
+            child.set('mode', 'native')
+        assert t.current() is root
+        with pytest.raises(ValueError):
+            with t.span('relay'):
+                raise ValueError('bad hop')
+        with t.span('detached', parent=trace.NO_SPAN) as detached:
+            pass
+    assert t.current() is trace.NO_SPAN
+
+    assert [s.name for s in spans] == ['agent.process_post', 'relay', 'POST claim-create']
+    assert all(s.trace_id == root.trace_id and s.parent_id == root.span_id for s in spans[:2])
+    assert spans[0].attrs == {'mode': 'native'} and 'bad hop' in spans[1].attrs['error']
+    assert detached is trace.NO_SPAN
+    assert child.headers() == {'traceparent': '00-{}-{}-01'.format(root.trace_id, child.span_id)}
+
+
+@pytest.mark.asyncio
+async def test_writer(monkeypatch):
+    out = Output()
+    t = trace.Tracer({'enabled': 'true', 'sample': '1'})
+    monkeypatch.setattr(t, '_open', lambda: out)
+    with t.span('POST schema-lookup', root=True) as root:
+        with t.span('ledger_cache.get'):
+            pass
+    t.close()
+
+    records = [json.loads(line) for line in out.text.splitlines()]
+    assert [(r['name'], r['trace'], r['parent']) for r in records] == [
+        ('ledger_cache.get', root.trace_id, root.span_id),
+        ('POST schema-lookup', root.trace_id, None)]
+    assert all(r['duration'] >= 0 and r['attrs'] == {} for r in records)
+
+
+@pytest.mark.asyncio
+async def test_writer_full_queue_drops(monkeypatch):
+    out = Output()
+    opened = Event()
+
+    def slow_open():
+        opened.wait(5)  # writer has not started draining yet
+        return out
+
+    t = trace.Tracer({'enabled': 'true', 'sample': '1'})
+    monkeypatch.setattr(trace.Tracer, 'QUEUE_MAX', 2)
+    monkeypatch.setattr(t, '_open', slow_open)
+    for i in range(5):
+        with t.span('POST {}'.format(i), root=True):
+            pass
+    assert t.dropped == 3
+    opened.set()
+    t.close()
+    assert [json.loads(line)['name'] for line in out.text.splitlines()] == ['POST 0', 'POST 1']
@@ -17,6 +17,7 @@ limitations under the License.
 from collections import Counter
 from configparser import ConfigParser
 from contextlib import closing
+from importlib.util import module_from_spec, spec_from_file_location
 from io import StringIO
 from os.path import abspath, dirname, expandvars, isfile, join as pjoin
 from requests.exceptions import ConnectionError
@@ -37,6 +38,13 @@ import socket
 
 manage_script = pjoin(dirname(dirname(dirname(abspath(__file__)))), 'docker', 'manage')
 
+# protocol template registry, standard library only: load it without the app package, which boots an agent
+_protocol_spec = spec_from_file_location(
+    'protocol',
+    pjoin(dirname(dirname(abspath(__file__))), 'app', 'service', 'protocol.py'))
+protocol = module_from_spec(_protocol_spec)
+_protocol_spec.loader.exec_module(protocol)
+
 
 def shutdown(wrappers, hard=False):
     global manage_script
@@ -68,7 +76,7 @@ class Wrapper:
         self._started = False
 
     def is_up(self):
-        url = url_for(self._port, 'did')
+        url = url_for(self._port, 'ready')
         try:
             r = requests.get(url)
             return r.status_code == 200
@@ -133,29 +141,22 @@ def set_docker():
     return rc
 
 
-def form_json(msg_type, args, proxy_did=None):
+def form(msg_type, args, proxy_did=None):
     assert all(isinstance(x, str) for x in args)
-    # print("... form_json interpolands {}".format([a for a in args]))
-
-    with open(pjoin(dirname(dirname(abspath(__file__))), 'app', 'protocol', '{}.json'.format(msg_type)), 'r') as proto:
-        raw_json = proto.read()
-    # print("... raw_json: {}".format(raw_json))
-    msg_json = raw_json % args
-    rv = msg_json
     if proxy_did:
         assert msg_type not in ('master-secret-set', 'claims-reset')
-        # print("... form_json json-loading {}".format(msg_json))
-        msg = json.loads(msg_json)
-        msg['data']['proxy-did'] = proxy_did
-        rv = json.dumps(msg, indent=4)
-    # print('... form_json composed {} form: {}'.format(msg_type, ppjson(rv)))
-    return rv
+
+    slots = protocol.templates()[msg_type].slots  # args fill json slots as json text, string slots as is
+    return protocol.form(
+        msg_type,
+        *[json.loads(arg) if slot == 'json' else arg for (arg, slot) in zip(args, slots)],
+        proxy_did=proxy_did)
 
 
 def get_post_response(port, msg_type, args, proxy_did=None, rc_http=200):
     assert all(isinstance(x, str) for x in args)
     url = url_for(port, msg_type)
-    r = requests.post(url, json=json.loads(form_json(msg_type, args, proxy_did=proxy_did)))
+    r = requests.post(url, json=form(msg_type, args, proxy_did=proxy_did))
     assert r.status_code == rc_http, 'Expected HTTP status code {} - received {}'.format(rc_http, r.status_code)
     return r.json()
 